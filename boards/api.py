@@ -1,21 +1,147 @@
 # Zastąp zawartość pliku boards/api.py
 
-from rest_framework import viewsets, status
+import functools
+import logging
+
+from asgiref.sync import async_to_sync
+from django.db import transaction
+from django.db.models import Count
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.shortcuts import get_object_or_404
-from .models import Board, Element
-from .serializers import BoardSerializer, ElementSerializer, BoardExportSerializer
-import json
+
+from .board_templates import created_events, template_elements
+from .broadcast import send_batch_to_board
+from .conditional import board_validators
+from .conf import board_setting
+from .models import Board, BoardChange, Element, coerce_element_id
+from .outbound import board_outbound_stats
+from .pagination import BoardCursorPagination, ElementKeysetPagination
+from .serializers import (
+    ApplyTemplateSerializer,
+    BoardSerializer,
+    ElementSerializer,
+    requested_fields,
+)
+from .spatial import filter_in_bbox, parse_bbox
+from .streaming import (
+    NDJSON_CONTENT_TYPE,
+    stream_elements,
+    streaming_response,
+    wants_stream,
+)
+from .transfer import (
+    accepted_encoding,
+    decoded_stream,
+    export_chunks,
+    import_stream,
+    read_ndjson,
+)
+from .viewport import track_events
+
+logger = logging.getLogger(__name__)
+
+
+def _broadcast_changes(board_id, events):
+    try:
+        # Ta sama grupa, do której dołączają połączenia BoardConsumer
+        async_to_sync(send_batch_to_board)(f'board_{board_id}', events)
+    except Exception:
+        logger.exception('Błąd rozgłaszania zmian tablicy %s', board_id)
+
+
+def register_bulk_changes(events_by_board):
+    """
+    Odnotuj zmiany w dziennikach tablic, a po zatwierdzeniu transakcji
+    roześlij je połączeniom WebSocket - jedna wiadomość na tablicę.
+    """
+    for board_id, events in events_by_board.items():
+        version = Board.register_change(board_id, events)
+        if version is None:
+            continue
+        first_seq = version - len(events) + 1
+        events = [
+            {**event, 'seq': first_seq + offset} for offset, event in enumerate(events)
+        ]
+        track_events(board_id, events)
+        transaction.on_commit(functools.partial(_broadcast_changes, board_id, events))
 
 class BoardViewSet(viewsets.ModelViewSet):
     queryset = Board.objects.all()
     serializer_class = BoardSerializer
+    pagination_class = BoardCursorPagination
+
+    def not_modified(self, request):
+        """
+        Odpowiedź 304, jeśli klient ma aktualną wersję tablicy (If-None-Match /
+        If-Modified-Since). Sprawdzane przed zapytaniami o elementy.
+        """
+        self.validators = board_validators(self.kwargs.get('pk'))
+        if self.validators is None:
+            return None
+        return self.validators.not_modified(request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        validators = getattr(self, 'validators', None)
+        cacheable = (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED)
+        if validators is not None and response.status_code in cacheable:
+            validators.apply(response)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.not_modified(request) or super().retrieve(request, *args, **kwargs)
+
+    def get_queryset(self):
+        # Zapisany stan tablicy bywa duży - pobieramy go tylko tam, gdzie jest potrzebny
+        if self.action == 'export_state' and not wants_stream(self.request):
+            return Board.objects.all()
+        queryset = Board.objects.defer('serialized_state')
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+
+        fields = requested_fields(self.request)
+        if fields is not None:
+            # Tylko kolumny wybranych pól (updated_at potrzebne do stronicowania)
+            columns = fields & {'title', 'created_at'}
+            queryset = queryset.only('id', 'updated_at', *columns)
+        if fields is None or 'elements_count' in fields:
+            # Liczba elementów w tym samym zapytaniu zamiast COUNT dla każdej tablicy
+            queryset = queryset.annotate(annotated_elements_count=Count('elements'))
+        return queryset
 
     @action(detail=True, methods=['get'])
     def elements(self, request, pk=None):
+        not_modified = self.not_modified(request)
+        if not_modified is not None:
+            return not_modified
         board = self.get_object()
         elements = Element.objects.filter(board=board)
+
+        # ?bbox=x0,y0,x1,y1 - tylko elementy widoczne w danym obszarze
+        if 'bbox' in request.query_params:
+            try:
+                bbox = parse_bbox(request.query_params['bbox'])
+            except ValueError as e:
+                return Response({"status": "error", "message": str(e)},
+                                status=status.HTTP_400_BAD_REQUEST)
+            elements = filter_in_bbox(elements, board.id, bbox)
+            elements = elements.order_by('z_index', 'id')
+
+        # ?stream=1 - NDJSON prosto z kursora bazy,
+        # ?page_size=N / ?cursor= - strony po (z_index, id)
+        if wants_stream(request):
+            return stream_elements(request, elements)
+        paginator = ElementKeysetPagination()
+        page = paginator.paginate_queryset(elements, request, view=self)
+        if page is not None:
+            data = ElementSerializer(page, many=True).data
+            return paginator.get_paginated_response(data)
+
         serializer = ElementSerializer(elements, many=True)
         return Response(serializer.data)
 
@@ -23,30 +149,293 @@ class BoardViewSet(viewsets.ModelViewSet):
     def import_state(self, request, pk=None):
         board = self.get_object()
         try:
+            if request.content_type.startswith(NDJSON_CONTENT_TYPE):
+                # Plik z export_state?stream=1 - treść czytana linia po linii,
+                # bez request.data
+                rows = ()
+                if request.stream is not None:
+                    encoding = request.META.get('HTTP_CONTENT_ENCODING')
+                    rows = read_ndjson(decoded_stream(request.stream, encoding))
+                report = import_stream(board, rows)
+                return Response({"status": "success", "report": report})
+
             data = request.data
-            board.update_from_json(data)
-            return Response({"status": "success"})
+            report = board.update_from_json(data)
+            return Response({
+                "status": "success",
+                "report": report
+            })
         except Exception as e:
             return Response({"status": "error", "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['post'])
+    def apply_template(self, request, pk=None):
+        """
+        Wstaw do tablicy elementy innej tablicy (szablonu).
+
+        Body: {"template": id tablicy-szablonu, "x": ..., "y": ..., "scale": ...} -
+        x/y to miejsce lewego górnego rogu szablonu (np. pozycja kursora),
+        bez nich elementy zachowują położenie z szablonu.
+        """
+        board = self.get_object()
+        params = ApplyTemplateSerializer(data=request.data)
+        if not params.is_valid():
+            return Response({"status": "error", "errors": params.errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        params = params.validated_data
+        templates = Board.objects.only('id', 'version')
+        template = get_object_or_404(templates, id=params['template'])
+        position = None
+        if params.get('x') is not None or params.get('y') is not None:
+            position = (params.get('x') or 0.0, params.get('y') or 0.0)
+
+        with transaction.atomic():
+            elements = Element.objects.bulk_create(
+                template_elements(template, board.id, position, params['scale'])
+            )
+            if elements:
+                register_bulk_changes({board.id: created_events(elements)})
+
+        return Response({
+            "status": "success",
+            "created": len(elements),
+            "ids": [element.id for element in elements]
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def changes(self, request, pk=None):
+        """Zmiany tablicy po wersji ?since=N (lub polecenie pełnej resynchronizacji)"""
+        board = self.get_object()
+        try:
+            since = int(request.query_params['since'])
+        except (KeyError, ValueError):
+            return Response(
+                {"status": "error", "message": "Parametr since musi być liczbą"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(BoardChange.since(board, since))
+
+    @action(detail=True, methods=['get'])
+    def queues(self, request, pk=None):
+        """Głębokość kolejek wysyłania do połączeń WebSocket tablicy (w tym procesie)"""
+        board = self.get_object()
+        return Response(board_outbound_stats(board.id))
+
     @action(detail=True, methods=['get'])
     def export_state(self, request, pk=None):
+        not_modified = self.not_modified(request)
+        if not_modified is not None:
+            return not_modified
         board = self.get_object()
-        data = board.serialize_to_json()
-        return Response(data)
+        if wants_stream(request):
+            # ?stream=1 - NDJSON czytany kursorem bazy, kompresowany w locie
+            # (Accept-Encoding)
+            encoding = accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+            response = streaming_response(
+                request, export_chunks(board, encoding),
+                content_type=NDJSON_CONTENT_TYPE
+            )
+            patch_vary_headers(response, ['Accept-Encoding'])
+            if encoding:
+                response['Content-Encoding'] = encoding
+                if self.validators is not None:
+                    # Skompresowana treść różni się bajtowo - ETag słaby,
+                    # jak w GZipMiddleware
+                    response['ETag'] = 'W/' + self.validators.etag
+            response['X-Board-Version'] = str(board.version)
+            return response
+
+        if not board_setting('SNAPSHOT_ENABLED'):
+            data = board.serialize_to_json()
+            return Response(data)
+
+        # Gotowy dokument JSON trzymany w tablicy - bez zapytań o elementy
+        response = HttpResponse(board.get_snapshot(), content_type='application/json')
+        response['X-Board-Version'] = str(board.version)
+        return response
 
 class ElementViewSet(viewsets.ModelViewSet):
     queryset = Element.objects.all()
     serializer_class = ElementSerializer
+    pagination_class = ElementKeysetPagination
 
     def get_queryset(self):
         # Filtruj elementy według tablicy, jeśli board_id jest podane
         board_id = self.request.query_params.get('board_id')
         if board_id:
-            return Element.objects.filter(board_id=board_id)
+            elements = Element.objects.filter(board_id=board_id)
+            bbox = self.request.query_params.get('bbox')
+            if bbox:
+                # Błędna ramka kończy się odpowiedzią 400
+                try:
+                    bounds = parse_bbox(bbox)
+                except ValueError as e:
+                    raise ValidationError({'bbox': str(e)}) from e
+                elements = filter_in_bbox(elements, board_id, bounds)
+                elements = elements.order_by('z_index', 'id')
+            return elements
         return Element.objects.all()
 
+    def list(self, request, *args, **kwargs):
+        if wants_stream(request):
+            return stream_elements(request, self.filter_queryset(self.get_queryset()))
+        return super().list(request, *args, **kwargs)
+
+    @action(detail=False, methods=['post', 'patch', 'delete'])
+    def bulk(self, request):
+        """
+        Zapis zbiorczy elementów: POST - lista nowych elementów, PATCH - lista
+        zmian (każda z id), DELETE - lista id. Odpowiedź zawiera wynik dla
+        każdej pozycji, w kolejności żądania. Błąd walidacji którejkolwiek
+        pozycji kończy się odpowiedzią 400 bez zapisu - PATCH odrzuca też
+        powtórzone id i zmianę tablicy elementu.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return Response({"status": "error", "message": "Oczekiwano listy"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        max_items = board_setting('BULK_MAX_ITEMS')
+        if len(items) > max_items:
+            message = f"Najwyżej {max_items} pozycji"
+            return Response({"status": "error", "message": message},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if request.method == 'POST':
+            return self.bulk_create(items)
+        if request.method == 'PATCH':
+            return self.bulk_update(items)
+        return self.bulk_destroy(items)
+
+    def _invalid(self, serializer):
+        results = [
+            {"status": "invalid", "errors": errors} if errors else {"status": "valid"}
+            for errors in serializer.errors
+        ]
+        return Response(results, status=status.HTTP_400_BAD_REQUEST)
+
+    def bulk_create(self, items):
+        serializer = self.get_serializer(data=items, many=True)
+        if not serializer.is_valid():
+            return self._invalid(serializer)
+
+        with transaction.atomic():
+            serializer.save()
+            data = serializer.data
+            events = {}
+            for element in data:
+                event = {'action': 'create_element', 'element': element}
+                events.setdefault(element['board'], []).append(event)
+            register_bulk_changes(events)
+        return Response([{"status": "created", "element": element} for element in data],
+                        status=status.HTTP_201_CREATED)
+
+    def bulk_update(self, items):
+        ids = [
+            coerce_element_id(item.get('id')) if isinstance(item, dict) else None
+            for item in items
+        ]
+        instances = Element.objects.in_bulk(
+            [element_id for element_id in ids if element_id is not None]
+        )
+        results = [
+            {"status": "not_found", "id": item.get('id')} if isinstance(item, dict)
+            else {"status": "not_found", "id": None}
+            for item in items
+        ]
+
+        # Błędy pozycji wykrywane przed walidacją serializera (indeks -> błędy)
+        errors = {}
+        seen = set()
+        for index, element_id in enumerate(ids):
+            if element_id not in instances:
+                continue
+            if element_id in seen:
+                errors[index] = {'id': ['Element występuje w żądaniu więcej niż raz']}
+            elif (
+                'board' in items[index]
+                and str(items[index]['board']) != str(instances[element_id].board_id)
+            ):
+                # Przeniesienie wymagałoby usunięcia elementu z dziennika starej tablicy
+                errors[index] = {'board': [
+                    'Zbiorcza zmiana nie może przenosić elementów między tablicami'
+                ]}
+            seen.add(element_id)
+        found = [
+            index for index, element_id in enumerate(ids)
+            if element_id in instances and index not in errors
+        ]
+
+        serializer = self.get_serializer(
+            [instances[ids[index]] for index in found],
+            data=[items[index] for index in found],
+            many=True, partial=True
+        )
+        valid = serializer.is_valid()
+        if errors or not valid:
+            if not valid:
+                errors.update(
+                    (index, item_errors)
+                    for index, item_errors in zip(found, serializer.errors, strict=True)
+                    if item_errors
+                )
+            for index in found:
+                results[index] = {"status": "valid"}
+            for index, item_errors in errors.items():
+                results[index] = {"status": "invalid", "errors": item_errors}
+            return Response(results, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            serializer.save()
+            data = serializer.data
+            events = {}
+            for element in data:
+                event = {'action': 'update_element', 'element': element}
+                events.setdefault(element['board'], []).append(event)
+            register_bulk_changes(events)
+
+        for index, element in zip(found, data, strict=True):
+            results[index] = {"status": "updated", "element": element}
+        return Response(results)
+
+    def bulk_destroy(self, items):
+        ids = [coerce_element_id(item) for item in items]
+        with transaction.atomic():
+            found_ids = [element_id for element_id in ids if element_id is not None]
+            existing = dict(
+                Element.objects.filter(id__in=found_ids).values_list('id', 'board_id')
+            )
+            Element.objects.filter(id__in=existing).delete()
+            events = {}
+            for element_id, board_id in existing.items():
+                event = {'action': 'delete_element', 'element_id': element_id}
+                events.setdefault(board_id, []).append(event)
+            register_bulk_changes(events)
+
+        return Response([
+            {"status": "deleted" if element_id in existing else "not_found", "id": item}
+            for item, element_id in zip(items, ids, strict=True)
+        ])
+
     def perform_create(self, serializer):
         board_id = self.request.data.get('board')
         board = get_object_or_404(Board, id=board_id)
-        serializer.save()
\ No newline at end of file
+        with transaction.atomic():
+            serializer.save()
+            Board.register_change(serializer.instance.board_id, [
+                {'action': 'create_element', 'element': serializer.data}
+            ])
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+            Board.register_change(serializer.instance.board_id, [
+                {'action': 'update_element', 'element': serializer.data}
+            ])
+
+    def perform_destroy(self, instance):
+        element_id = instance.id
+        with transaction.atomic():
+            instance.delete()
+            Board.register_change(instance.board_id, [
+                {'action': 'delete_element', 'element_id': element_id}
+            ])
\ No newline at end of file
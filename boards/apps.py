@@ -3,4 +3,13 @@ from django.apps import AppConfig
 
 class BoardsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'boards'
\ No newline at end of file
+    name = 'boards'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .db import configure_sqlite
+
+        connection_created.connect(
+            configure_sqlite, dispatch_uid='boards_configure_sqlite'
+        )
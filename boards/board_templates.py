@@ -0,0 +1,119 @@
+"""
+Wstawianie elementów innej tablicy jako szablonu.
+
+Elementy tablicy-szablonu są raz odczytywane do listy słowników pól
+i trzymane w pamięci procesu razem z wersją tablicy - każda zmiana
+szablonu podbija wersję, więc nieaktualny wpis jest po prostu budowany
+od nowa. Wstawienie to jeden bulk_create, bez serializatorów.
+"""
+
+from collections import OrderedDict
+
+from .models import ELEMENT_DATA_FIELDS, Element
+from .paths import (
+    decode_points,
+    encode_points,
+    path_points,
+    points_to_svg,
+    points_to_text,
+)
+
+# Liczba szablonów trzymanych w pamięci procesu
+CACHE_SIZE = 32
+
+# Skompilowane szablony (board_id -> (wersja, ramka, lista pól elementów))
+_compiled = OrderedDict()
+
+
+def compile_template(board):
+    """Pola elementów szablonu i lewy górny róg ich ramki (z pamięci, jeśli aktualne)"""
+    cached = _compiled.get(board.id)
+    if cached is not None and cached[0] == board.version:
+        _compiled.move_to_end(board.id)
+        return cached[1], cached[2]
+
+    rows = list(
+        Element.objects.filter(board_id=board.id)
+        .order_by('z_index', 'id')
+        .values(*ELEMENT_DATA_FIELDS)
+    )
+    for row in rows:
+        if row['points'] is not None:
+            row['points'] = bytes(row['points'])
+    origin = (
+        min((row['position_x'] for row in rows), default=0),
+        min((row['position_y'] for row in rows), default=0),
+    )
+
+    _compiled[board.id] = (board.version, origin, rows)
+    _compiled.move_to_end(board.id)
+    while len(_compiled) > CACHE_SIZE:
+        _compiled.popitem(last=False)
+    return origin, rows
+
+
+def _transform_points(row, transform):
+    """
+    Punkty i ścieżka rysunku po przesunięciu i skalowaniu - None, jeśli
+    element ich nie ma.
+
+    Punkty, których po skalowaniu nie da się zapisać, wracają jako ścieżka tekstowa.
+    """
+    if row['points'] is not None:
+        points = decode_points(row['points'])
+    elif row['element_type'] == 'path' and row['path']:
+        points = path_points(row['path'])
+        if points is None:
+            return None
+    else:
+        return None
+    points = [transform(x, y) for x, y in points]
+    try:
+        return encode_points(points), None
+    except ValueError:
+        return None, points_to_svg(points)
+
+
+def template_elements(template, board_id, position=None, scale=1.0):
+    """
+    Nowe (niezapisane) elementy tablicy board_id z szablonu.
+
+    position (x, y) to miejsce, w którym ma się znaleźć lewy górny róg
+    szablonu - bez niego elementy zachowują położenie z szablonu. scale
+    zmienia rozmiar szablonu względem tego rogu.
+    """
+    origin, rows = compile_template(template)
+    target = position if position is not None else origin
+
+    def transform(x, y):
+        return target[0] + (x - origin[0]) * scale, target[1] + (y - origin[1]) * scale
+
+    moved = target != origin or scale != 1
+    elements = []
+    for row in rows:
+        fields = dict(row)
+        if isinstance(fields['properties'], dict):
+            # Wpis w pamięci nie może współdzielić obiektów z nowymi elementami
+            fields['properties'] = dict(fields['properties'])
+        if moved:
+            fields['position_x'], fields['position_y'] = transform(
+                row['position_x'], row['position_y']
+            )
+            fields['width'] = row['width'] * scale
+            fields['height'] = row['height'] * scale
+            transformed = _transform_points(row, transform)
+            if transformed is not None:
+                fields['points'], fields['path'] = transformed
+        elements.append(Element(board_id=board_id, **fields))
+    return elements
+
+
+def created_events(elements):
+    """Zdarzenia create_element zapisanych elementów (do dziennika i rozgłoszenia)"""
+    events = []
+    for element in elements:
+        data = {field: getattr(element, field) for field in ELEMENT_DATA_FIELDS}
+        data['points'] = points_to_text(data['points'])
+        data.update(id=element.id, board=element.board_id)
+        events.append({'action': 'create_element', 'element': data})
+    return events
@@ -0,0 +1,232 @@
+import asyncio
+import functools
+import logging
+
+from channels.layers import get_channel_layer
+
+from . import codec
+from .conf import board_setting
+from .models import PROPERTIES_PATCH, apply_merge_patch, coerce_element_id
+from .spatial import union_bounds
+
+logger = logging.getLogger(__name__)
+
+# Kolejki zdarzeń tablic obsługiwanych w tym procesie (nazwa grupy -> BoardOutbox)
+_outboxes = {}
+
+
+def merge_update(queued, element):
+    """
+    Scal aktualizację elementu z aktualizacją czekającą w kolejce.
+
+    Dwóch łatek właściwości nie da się w ogólności złożyć w jedną, więc
+    w takim przypadku zwracamy False i zdarzenie trafia do kolejki osobno.
+    """
+    patch = element.get(PROPERTIES_PATCH)
+    if patch is not None and 'properties' not in element:
+        if 'properties' in queued:
+            element = {
+                key: value for key, value in element.items() if key != PROPERTIES_PATCH
+            }
+            queued['properties'] = apply_merge_patch(queued['properties'], patch)
+        elif PROPERTIES_PATCH in queued:
+            return False
+    elif 'properties' in element:
+        queued.pop(PROPERTIES_PATCH, None)
+
+    queued.update(element)
+    return True
+
+
+class BoardOutbox:
+    """
+    Kolejka zdarzeń jednej tablicy w trybie wsadowym.
+
+    Zdarzenia są zbierane przez jeden takt (tick), kolejne update_element
+    dla tego samego elementu są scalane, a na koniec taktu do grupy trafia
+    jedna ramka z tablicą zdarzeń - serializowana raz, wspólna dla wszystkich
+    odbiorców (klienci binarni dostają ją przekodowaną przez binary_frame).
+    """
+
+    def __init__(self, group_name, tick=None, max_queue=None):
+        self.group_name = group_name
+        self.tick = tick if tick is not None else board_setting('BROADCAST_TICK')
+        self.max_queue = (
+            max_queue if max_queue is not None
+            else board_setting('BROADCAST_MAX_QUEUE')
+        )
+        self.events = []
+        self.stats = {
+            'events_in': 0, 'events_coalesced': 0, 'events_out': 0, 'frames': 0,
+        }
+        self._pending_updates = {}
+        self._flush_task = None
+        # Ramka obejmująca zdarzenia taktu (None - takt dotyczy całej tablicy)
+        self._bounds = None
+        self._unscoped = False
+
+    async def push(self, event, bounds=None):
+        """Dodaj zdarzenie do bieżącego taktu"""
+        self.stats['events_in'] += 1
+        if bounds is None:
+            self._unscoped = True
+        elif not self._unscoped:
+            if self._bounds is not None:
+                bounds = union_bounds(self._bounds, bounds)
+            self._bounds = bounds
+        action = event.get('action')
+
+        if action == 'update_element':
+            element = event.get('element') or {}
+            element_id = element.get('id')
+            queued = self._pending_updates.get(element_id)
+            if queued is not None and merge_update(queued['element'], element):
+                # Scalono z wcześniejszą aktualizacją tego elementu w tym takcie
+                self.stats['events_coalesced'] += 1
+                return
+            event = {**event, 'element': dict(element)}
+            if element_id is not None:
+                self._pending_updates[element_id] = event
+        elif action == 'delete_element':
+            # Aktualizacje po usunięciu nie mogą się scalić z tymi sprzed usunięcia
+            self._pending_updates.pop(event.get('element_id'), None)
+
+        self.events.append(event)
+
+        if len(self.events) >= self.max_queue:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.tick)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception('Błąd wysyłania zdarzeń grupy %s', self.group_name)
+
+    async def flush(self):
+        """Wyślij zebrane zdarzenia jako jedną ramkę"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        if not self.events:
+            return 0
+
+        events, self.events = self.events, []
+        bounds = None if self._unscoped else self._bounds
+        self._pending_updates = {}
+        self._bounds = None
+        self._unscoped = False
+        events = [
+            {key: value for key, value in event.items() if key != 'type'}
+            for event in events
+        ]
+
+        await get_channel_layer().group_send(self.group_name, {
+            'type': 'board_batch',
+            'frame': codec.dumps(events),
+            'bounds': _bounds_message(bounds),
+        })
+
+        self.stats['events_out'] += len(events)
+        self.stats['frames'] += 1
+        return len(events)
+
+    def coalescing_ratio(self):
+        """Ile zdarzeń wejściowych przypada na jedno zdarzenie wysłane"""
+        if not self.stats['events_out']:
+            return 1.0
+        return self.stats['events_in'] / self.stats['events_out']
+
+
+@functools.lru_cache(maxsize=64)
+def binary_frame(frame):
+    """
+    Ramka binarna dla klientów podprotokołu binarnego (None - zdarzenie
+    idzie jako JSON).
+
+    Do grupy trafia tylko ramka JSON - postać binarną koduje dopiero konsument
+    klienta binarnego. Tablice bez takich klientów nie płacą za kodowanie,
+    a pamięć podręczna sprawia, że w jednym procesie ta sama ramka kodowana
+    jest raz, niezależnie od liczby odbiorców.
+    """
+    try:
+        data = codec.loads(frame)
+    except ValueError:
+        return None
+    if isinstance(data, list):
+        return codec.encode_binary_batch(data)
+    return codec.encode_binary(data) if isinstance(data, dict) else None
+
+
+def _bounds_message(bounds):
+    return list(bounds) if bounds is not None else None
+
+
+def _event_element_id(event):
+    """Id elementu, którego dotyczy zdarzenie (do scalania aktualizacji w kolejkach)"""
+    if event.get('action') == 'delete_element':
+        return coerce_element_id(event.get('element_id'))
+    element = event.get('element')
+    return coerce_element_id(element.get('id')) if isinstance(element, dict) else None
+
+
+async def send_to_board(group_name, event, bounds=None):
+    """
+    Wyślij zdarzenie do wszystkich członków grupy tablicy.
+
+    W trybie wsadowym zdarzenie trafia do kolejki i zostanie wysłane w ramce
+    zbiorczej na koniec taktu. W przeciwnym razie ramka jest serializowana
+    raz, tutaj, i przekazywana odbiorcom bez zmian. Ramka bounds pozwala
+    odbiorcom z ustawionym widokiem pominąć zdarzenia spoza niego.
+    """
+    if board_setting('BROADCAST_BATCHING'):
+        await get_outbox(group_name).push(event, bounds)
+    else:
+        await get_channel_layer().group_send(group_name, {
+            'type': 'board_event',
+            'action': event.get('action'),
+            'element_id': _event_element_id(event),
+            'frame': codec.dumps(event),
+            'bounds': _bounds_message(bounds),
+        })
+
+
+async def send_batch_to_board(group_name, events, bounds=None):
+    """
+    Wyślij kilka zdarzeń jedną wiadomością grupy (ramka z tablicą zdarzeń).
+
+    Klienci obsługują takie ramki tak jak w trybie wsadowym. bounds to ramka
+    obejmująca wszystkie zdarzenia (None - cała tablica).
+    """
+    if not events:
+        return
+    if board_setting('BROADCAST_BATCHING'):
+        outbox = get_outbox(group_name)
+        for event in events:
+            await outbox.push(event, bounds)
+        return
+    await get_channel_layer().group_send(group_name, {
+        'type': 'board_batch',
+        'frame': codec.dumps(events),
+        'bounds': _bounds_message(bounds),
+    })
+
+
+def get_outbox(group_name):
+    """Zwróć (i w razie potrzeby utwórz) kolejkę zdarzeń grupy tablicy"""
+    outbox = _outboxes.get(group_name)
+    if outbox is None:
+        outbox = _outboxes[group_name] = BoardOutbox(group_name)
+    return outbox
+
+
+def outbox_stats():
+    """Liczniki kolejek wszystkich tablic w tym procesie"""
+    return {
+        group_name: {**outbox.stats, 'coalescing_ratio': outbox.coalescing_ratio()}
+        for group_name, outbox in _outboxes.items()
+    }
@@ -0,0 +1,217 @@
+"""
+Kodowanie wiadomości WebSocket.
+
+Jeśli zainstalowany jest orjson, używamy go do (de)serializacji JSON,
+w przeciwnym razie korzystamy z modułu json z biblioteki standardowej.
+Klienci, którzy wynegocjują podprotokół BINARY_SUBPROTOCOL, wymieniają
+zmiany elementów w zwartym formacie binarnym (encode_binary/decode_binary).
+"""
+
+import base64
+import binascii
+import json
+import math
+import struct
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson jest opcjonalny
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def dumps(data):
+    """Zserializuj dane do tekstu JSON gotowego do wysłania przez WebSocket"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(data)
+
+
+def loads(data):
+    """Zdeserializuj tekst (lub bajty) JSON"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Binarny podprotokół WebSocket dla zmian elementów.
+#
+# Wiadomość: u8 kod operacji, u8 flagi, [f64 id], [pola geometrii], [JSON reszty pól].
+# Pola geometrii zapisywane są w stałej kolejności jako float32 (z_index jako int32),
+# a pozostałe pola (element_type, content, path, properties...) jako tekst JSON
+# do końca wiadomości. Punkty rysunku (pole points, w JSON jako base64) przesyłane są
+# bez zmian jako u32 długość + bajty po geometrii - sygnalizuje to bit OP_POINTS
+# w kodzie operacji. Ramka zbiorcza: u8 OP_BATCH, u32 liczba wiadomości, potem
+# każda wiadomość poprzedzona długością u32. Wszystkie liczby little-endian.
+BINARY_SUBPROTOCOL = 'whiteboard.bin.v1'
+JSON_SUBPROTOCOL = 'whiteboard.json'
+
+OP_BATCH = 0
+OP_POINTS = 0x80
+BINARY_OPS = {
+    'create_element': 1,
+    'update_element': 2,
+    'delete_element': 3,
+}
+BINARY_ACTIONS = {op: action for action, op in BINARY_OPS.items()}
+
+FLAG_ID = 1
+FLAG_EXTRA = 2
+GEOMETRY_FIELDS = (
+    ('position_x', struct.Struct('<f'), 4),
+    ('position_y', struct.Struct('<f'), 8),
+    ('width', struct.Struct('<f'), 16),
+    ('height', struct.Struct('<f'), 32),
+    ('rotation', struct.Struct('<f'), 64),
+    ('z_index', struct.Struct('<i'), 128),
+)
+_HEADER = struct.Struct('<BB')
+_ID = struct.Struct('<d')
+_LENGTH = struct.Struct('<I')
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def encode_binary(event):
+    """
+    Zakoduj zdarzenie elementu do postaci binarnej.
+
+    Zwraca None dla akcji, które nie mają binarnej reprezentacji - takie
+    zdarzenia wysyłane są klientom binarnym jako zwykły tekst JSON.
+    """
+    action = event.get('action')
+    op = BINARY_OPS.get(action)
+    if op is None:
+        return None
+
+    if action == 'delete_element':
+        element = {'id': event.get('element_id')}
+    else:
+        element = event.get('element') or {}
+
+    flags = 0
+    parts = []
+    encoded = set()
+
+    # Identyfikator jako float64 - dokładny do 2^53, tak jak Number w JS
+    element_id = element.get('id')
+    if (
+        isinstance(element_id, int) and not isinstance(element_id, bool)
+        and abs(element_id) < 2 ** 53
+    ):
+        flags |= FLAG_ID
+        parts.append(_ID.pack(element_id))
+        encoded.add('id')
+
+    for name, packer, bit in GEOMETRY_FIELDS:
+        value = element.get(name)
+        if not _is_number(value):
+            continue
+        if packer.format == '<i' and not isinstance(value, int):
+            continue
+        try:
+            parts.append(packer.pack(value))
+        except (struct.error, OverflowError):
+            continue
+        flags |= bit
+        encoded.add(name)
+
+    points = element.get('points')
+    if isinstance(points, str):
+        try:
+            points = base64.b64decode(points, validate=True)
+        except (ValueError, binascii.Error):
+            points = None
+        if points is not None:
+            op |= OP_POINTS
+            parts.append(_LENGTH.pack(len(points)))
+            parts.append(points)
+            encoded.add('points')
+
+    extra = {key: value for key, value in element.items() if key not in encoded}
+    if extra:
+        flags |= FLAG_EXTRA
+        parts.append(dumps(extra).encode('utf-8'))
+
+    return _HEADER.pack(op, flags) + b''.join(parts)
+
+
+def encode_binary_batch(events):
+    """
+    Zakoduj listę zdarzeń jako jedną ramkę binarną (None, jeśli któreś nie
+    ma postaci binarnej).
+    """
+    parts = [struct.pack('<BI', OP_BATCH, len(events))]
+    for event in events:
+        message = encode_binary(event)
+        if message is None:
+            return None
+        parts.append(_LENGTH.pack(len(message)))
+        parts.append(message)
+    return b''.join(parts)
+
+
+def decode_binary(data):
+    """
+    Zdekoduj ramkę binarną do słownika wiadomości (lub listy - dla ramki zbiorczej).
+
+    Uszkodzona ramka kończy się wyjątkiem ValueError albo struct.error.
+    """
+    data = memoryview(data)
+    if not len(data):
+        raise ValueError('Pusta ramka binarna')
+    op = data[0]
+
+    if op == OP_BATCH:
+        (count,) = _LENGTH.unpack_from(data, 1)
+        offset = 1 + _LENGTH.size
+        messages = []
+        for _ in range(count):
+            (length,) = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            messages.append(decode_binary(data[offset:offset + length]))
+            offset += length
+        return messages
+
+    action = BINARY_ACTIONS.get(op & ~OP_POINTS)
+    if action is None:
+        raise ValueError(f'Nieznany kod operacji binarnej: {op}')
+
+    _, flags = _HEADER.unpack_from(data)
+    element = {}
+    offset = _HEADER.size
+    if flags & FLAG_ID:
+        (element_id,) = _ID.unpack_from(data, offset)
+        if not math.isfinite(element_id):
+            raise ValueError('Niepoprawny identyfikator elementu')
+        element['id'] = int(element_id)
+        offset += _ID.size
+
+    for name, packer, bit in GEOMETRY_FIELDS:
+        if flags & bit:
+            (value,) = packer.unpack_from(data, offset)
+            if isinstance(value, float):
+                # float32 -> najkrótszy zapis (0.1 zamiast 0.10000000149011612)
+                value = float(f'{value:.7g}')
+            element[name] = value
+            offset += packer.size
+
+    if op & OP_POINTS:
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        points = data[offset:offset + length]
+        element['points'] = base64.b64encode(points).decode('ascii')
+        offset += length
+
+    if flags & FLAG_EXTRA:
+        extra = loads(bytes(data[offset:]))
+        if not isinstance(extra, dict):
+            raise ValueError('Dodatkowe pola muszą być obiektem JSON')
+        element = {**extra, **element}
+
+    if action == 'delete_element':
+        return {'action': action, 'element_id': element.get('id')}
+    return {'action': action, 'element': element}
@@ -0,0 +1,64 @@
+"""
+Warunkowe odczyty tablic (ETag / Last-Modified).
+
+Walidatorem jest wersja tablicy - register_change podbija ją przy każdej
+zmianie tablicy i jej elementów, a updated_at ustawia na czas zmiany.
+Sprawdzenie to jedno zapytanie o wiersz Board, więc odpowiedź 304 nie
+dotyka tabeli elementów.
+"""
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .models import Board
+
+
+class BoardValidators:
+    def __init__(self, board_id, version, updated_at):
+        self.board_id = board_id
+        self.version = version
+        self.updated_at = updated_at
+
+    @property
+    def etag(self):
+        return quote_etag(f'{self.board_id}.{self.version}')
+
+    @property
+    def last_modified(self):
+        return int(self.updated_at.timestamp())
+
+    def not_modified(self, request):
+        """Odpowiedź 304 (albo 412), jeśli klient ma aktualną wersję - inaczej None"""
+        return get_conditional_response(
+            request, etag=self.etag, last_modified=self.last_modified
+        )
+
+    def apply(self, response):
+        """Nagłówki walidatorów dla pełnej odpowiedzi"""
+        response.setdefault('ETag', self.etag)
+        response['Last-Modified'] = http_date(self.last_modified)
+        # Treść bywa nowsza od walidatorów (patrz board_validators) - jej wersja
+        # ma pierwszeństwo
+        response.setdefault('X-Board-Version', str(self.version))
+        # Przeglądarka ma zawsze pytać serwer (tanim 304), a nie zgadywać
+        # świeżości z Last-Modified
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+def board_validators(board_id):
+    """
+    Walidatory tablicy albo None, jeśli tablica nie istnieje.
+
+    Odczytywane przed treścią odpowiedzi - jeśli w międzyczasie tablica się
+    zmieni, klient dostanie nowszą treść ze starszym ETagiem i przy następnym
+    żądaniu po prostu pobierze ją ponownie.
+    """
+    try:
+        row = (
+            Board.objects.filter(pk=board_id)
+            .values_list('version', 'updated_at').first()
+        )
+    except (TypeError, ValueError):
+        return None
+    return BoardValidators(int(board_id), *row) if row is not None else None
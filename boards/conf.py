@@ -0,0 +1,79 @@
+from django.conf import settings
+
+# Domyślne wartości ustawień aplikacji tablic - nadpisywane przez BOARDS w settings.py
+DEFAULTS = {
+    # Bufor zapisów (write-behind) dla aktualizacji elementów z WebSocket
+    'WRITE_BEHIND_ENABLED': True,
+    'WRITE_BEHIND_FLUSH_INTERVAL': 0.5,  # sekundy
+    'WRITE_BEHIND_MAX_BATCH': 200,  # liczba brudnych elementów wymuszająca zapis
+    'WRITE_BEHIND_MAX_RETRIES': 3,  # ponowienia nieudanego zapisu zmian elementu
+
+    # Tryb wsadowy rozgłaszania - zdarzenia tablicy wysyłane jedną ramką na takt
+    'BROADCAST_BATCHING': False,
+    'BROADCAST_TICK': 0.03,  # sekundy
+    'BROADCAST_MAX_QUEUE': 500,  # od tylu zdarzeń ramka idzie przed końcem taktu
+
+    # Eksport i pierwsze ładowanie tablicy z zapisanego stanu (Board.serialized_state)
+    'SNAPSHOT_ENABLED': True,
+
+    # Dziennik zmian tablic (wznawianie połączeń od wersji N)
+    'CHANGE_LOG_RETENTION': 1000,  # liczba ostatnich zmian przechowywanych dla tablicy
+    'CHANGE_LOG_COMPACT_EVERY': 100,  # co ile wersji usuwać najstarsze wpisy
+    'CHANGE_LOG_PAGE_SIZE': 500,  # maksymalna liczba zmian w jednej odpowiedzi
+
+    # Subskrypcje widoku - klient dostaje tylko zdarzenia elementów w swoim obszarze
+    'VIEWPORT_MARGIN': 200,  # margines wokół widoku we współrzędnych tablicy
+
+    # Zwarty zapis rysunków odręcznych (Element.points zamiast tekstu ścieżki SVG)
+    'PATH_COMPACT_ENABLED': True,
+    'PATH_QUANTUM': 0.1,  # dokładność zapisu współrzędnych
+    'PATH_SIMPLIFY_TOLERANCE': 0.5,  # maksymalne odchylenie uproszczonej ścieżki
+
+    # Przesyłanie rysunków odręcznych w trakcie rysowania (stroke_begin/append/end)
+    'STROKE_MAX_POINTS': 20000,  # limit punktów jednego rysunku
+    'STROKE_MAX_OPEN': 8,  # limit jednocześnie rysowanych ścieżek na połączenie
+
+    # Przydział tablic do procesów serwera (boards/sharding.py)
+    'SHARD_COUNT': 1,  # liczba procesów - 1 wyłącza sharding
+    'SHARD_INDEX': None,  # numer tego procesu
+    'SHARD_STRICT': False,  # odrzucaj połączenia do tablic innego procesu
+
+    # Kolejki wysyłania do klientów WebSocket (boards/outbound.py)
+    'OUTBOUND_HIGH_WATER': 64,  # od tylu ramek w kolejce aktualizacje są scalane
+    'OUTBOUND_MAX_QUEUE': 512,  # po przekroczeniu klient dostaje resync_required
+
+    # Limity wiadomości od klientów WebSocket (boards/ratelimit.py), 0 wyłącza limit
+    'INBOUND_MAX_FRAME': 1024 * 1024,  # maksymalny rozmiar ramki w bajtach
+    'INBOUND_MAX_ITEMS': 5000,  # maks. liczba punktów lub operacji batch w wiadomości
+    'INBOUND_MESSAGE_RATE': 60,  # wiadomości na sekundę z jednego połączenia
+    'INBOUND_BYTE_RATE': 512 * 1024,  # bajty na sekundę z jednego połączenia
+    'BOARD_MESSAGE_RATE': 600,  # wiadomości na sekundę ze wszystkich połączeń tablicy
+    'BOARD_BYTE_RATE': 4 * 1024 * 1024,  # bajty na sekundę ze wszystkich połączeń
+    'INBOUND_BURST': 2.0,  # pojemność kubełków w sekundach limitu
+
+    # Zapis zbiorczy przez REST (/api/elements/bulk/)
+    'BULK_MAX_ITEMS': 1000,  # maksymalna liczba pozycji w jednym żądaniu
+
+    # Listy elementów - strony po (z_index, id) i odpowiedzi strumieniowe NDJSON
+    'ELEMENT_PAGE_MAX': 1000,  # maksymalny rozmiar strony
+    'ELEMENT_STREAM_CHUNK': 2000,  # liczba wierszy pobieranych z kursora bazy naraz
+
+    # Strumieniowy import tablicy (NDJSON, boards/transfer.py)
+    'IMPORT_BATCH_SIZE': 500,  # liczba elementów zapisywanych jedną paczką
+
+    # Wątki bazy dla konsumentów WebSocket (boards/db.py) - 0 to wspólny wątek Channels
+    'DB_EXECUTOR_WORKERS': 0,
+
+    # Ustawienia (PRAGMA) każdego nowego połączenia SQLite
+    'SQLITE_PRAGMAS': {
+        'journal_mode': 'WAL',  # odczyty nie czekają na zapis
+        'synchronous': 'NORMAL',  # w trybie WAL bezpieczne, bez fsync przy commicie
+        'busy_timeout': 5000,  # ms czekania na blokadę zapisu zamiast błędu
+        'mmap_size': 256 * 1024 * 1024,  # odczyty przez mapowanie pliku
+    },
+}
+
+
+def board_setting(name):
+    """Zwróć wartość ustawienia aplikacji tablic"""
+    return getattr(settings, 'BOARDS', {}).get(name, DEFAULTS[name])
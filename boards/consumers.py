@@ -1,14 +1,259 @@
 # Zastąp zawartość pliku boards/consumers.py
 
-import json
+import asyncio
+import math
+import struct
+import time
+
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from .models import Board, Element
+from django.db import transaction
+from django.utils import timezone
+
+from . import codec
+from .broadcast import binary_frame, merge_update, send_batch_to_board, send_to_board
+from .conf import board_setting
+from .db import db_sync_to_async
+from .models import PROPERTIES_PATCH, Board, BoardChange, Element, coerce_element_id
+from .outbound import close_queue, open_queue
+from .paths import (
+    compact_element_data,
+    compact_points,
+    parse_points,
+    points_bounds,
+    points_from_text,
+    points_to_text,
+)
+from .ratelimit import InboundLimiter, message_items
+from .spatial import expand_bounds, intersects, parse_bbox, union_bounds
+from .viewport import attach_geometry, detach_geometry, get_geometry
+from .writebehind import (
+    apply_element_changes,
+    flush_board,
+    get_buffer,
+    merge_changes,
+    write_element_changes,
+)
+
+# Pola elementu, które można zmieniać wiadomością update_element
+UPDATABLE_FIELDS = (
+    'content', 'position_x', 'position_y', 'width', 'height',
+    'rotation', 'z_index', 'properties', 'path'
+)
+
+
+# Pola tekstowe i liczbowe elementu
+# (pozostałe: z_index - liczba całkowita, properties - obiekt)
+TEXT_FIELDS = ('content', 'path')
+FLOAT_FIELDS = ('position_x', 'position_y', 'width', 'height', 'rotation')
+
+# Zakres z_index (IntegerField)
+Z_INDEX_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+# Dozwolone typy nowych elementów
+ELEMENT_TYPE_NAMES = frozenset(name for name, _ in Element.ELEMENT_TYPES)
+
+
+def coerce_field(field, value):
+    """Wartość pola z wiadomości w typie pola modelu - błędna kończy się ValueError"""
+    if field in TEXT_FIELDS:
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f'Pole {field} musi być tekstem')
+        return value
+    if field == 'properties':
+        if not isinstance(value, dict):
+            raise ValueError('Pole properties musi być obiektem')
+        return value
+
+    if isinstance(value, str):
+        try:
+            value = float(value) if field in FLOAT_FIELDS else int(value)
+        except ValueError as error:
+            raise ValueError(f'Pole {field} musi być liczbą') from error
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f'Pole {field} musi być liczbą')
+    if not math.isfinite(value):
+        raise ValueError(f'Pole {field} musi być liczbą')
+    if field == 'z_index':
+        if value != int(value) or not Z_INDEX_RANGE[0] <= value <= Z_INDEX_RANGE[1]:
+            raise ValueError('Pole z_index musi być liczbą całkowitą')
+        return int(value)
+    return value
+
+
+def element_changes(element_data):
+    """
+    Wyciągnij z wiadomości update_element tylko przesłane pola.
+
+    Wartości sprowadzane są do typów pól modelu (coerce_field) - błędna
+    wartość kończy się ValueError, zanim zmiana trafi do bazy lub innych
+    klientów. Zamiast pełnych properties klient może wysłać properties_patch
+    (JSON Merge Patch) - trafia on do zmian jako jednoelementowa lista łatek.
+    """
+    changes = {
+        field: coerce_field(field, element_data[field])
+        for field in UPDATABLE_FIELDS if field in element_data
+    }
+    if PROPERTIES_PATCH in element_data:
+        if not isinstance(element_data[PROPERTIES_PATCH], dict):
+            raise ValueError(f'Pole {PROPERTIES_PATCH} musi być obiektem')
+        changes[PROPERTIES_PATCH] = [element_data[PROPERTIES_PATCH]]
+    if 'path' in changes:
+        # Nowa ścieżka tekstowa zastępuje zapisane punkty rysunku
+        changes['points'] = None
+    return changes
+
+
+def create_fields(element_data):
+    """
+    Sprawdzone dane nowego elementu z wiadomości create_element (inaczej ValueError).
+
+    Typ musi być jednym z Element.ELEMENT_TYPES, a pola - w typach pól
+    modelu (coerce_field). Ścieżka może być też tablicą poleceń Fabric.js.
+    """
+    if not isinstance(element_data, dict):
+        raise ValueError('Brak danych elementu')
+    if element_data.get('element_type') not in ELEMENT_TYPE_NAMES:
+        raise ValueError('Nieznany typ elementu')
+    points = element_data.get('points')
+    if not isinstance(points, (str, bytes, type(None))):
+        raise ValueError('Pole points musi być tekstem base64')
+    if isinstance(points, str) and points_from_text(points) is None:
+        raise ValueError('Niepoprawne dane punktów')
+    fields = {
+        field: coerce_field(field, element_data[field])
+        for field in UPDATABLE_FIELDS
+        if field in element_data
+        and not (field == 'path' and isinstance(element_data[field], list))
+    }
+    return {**element_data, **fields}
+
+
+def update_changes(element_data):
+    """
+    Identyfikator elementu i sprawdzone zmiany z wiadomości update_element
+    (ValueError, gdy błędne).
+    """
+    if not isinstance(element_data, dict):
+        raise ValueError('Brak danych elementu')
+    element_id = coerce_element_id(element_data.get('id'))
+    if element_id is None:
+        raise ValueError('Brak identyfikatora elementu')
+    return element_id, element_changes(element_data)
+
+
+def batch_update_ids(operations):
+    """Identyfikatory elementów z operacji update_element wiadomości batch"""
+    ids = set()
+    for operation in operations:
+        if isinstance(operation, dict) and operation.get('action') == 'update_element':
+            element_data = operation.get('element')
+            if isinstance(element_data, dict):
+                ids.add(coerce_element_id(element_data.get('id')))
+    ids.discard(None)
+    return ids
+
+
+def updated_element(element_id, changes):
+    """Dane aktualizacji do rozgłoszenia - sprawdzone wartości, nie surowa wiadomość"""
+    element = {'id': element_id}
+    for field, value in changes.items():
+        if field == PROPERTIES_PATCH:
+            element[field] = value[0] if len(value) == 1 else value
+        elif field != 'points':
+            element[field] = value
+    return element
+
+
+def viewport_bounds(viewport):
+    """
+    Ramka widoku z wiadomości subscribe_viewport powiększona o margines.
+
+    Brak widoku albo błędne dane oznaczają subskrypcję całej tablicy (None).
+    """
+    if not isinstance(viewport, dict):
+        return None
+    try:
+        corners = [str(viewport[key]) for key in ('x0', 'y0', 'x1', 'y1')]
+        bounds = parse_bbox(','.join(corners))
+    except (KeyError, ValueError):
+        return None
+    return expand_bounds(bounds, board_setting('VIEWPORT_MARGIN'))
+
+def stroke_element(stroke, element_data):
+    """
+    Dane elementu path dla zakończonego rysunku.
+
+    Pola przesłane w stroke_end (np. położenie obiektu Fabric.js) mają
+    pierwszeństwo - brakujące położenie i rozmiar wyliczane są z punktów.
+    Punktów, których nie da się zapisać, nie zamieniamy na pusty rysunek
+    (ValueError).
+    """
+    points = compact_points(stroke['points'])
+    if points is None:
+        raise ValueError('Współrzędne rysunku poza zakresem')
+    min_x, min_y, max_x, max_y = points_bounds(stroke['points'])
+    element = {
+        key: value for key, value in element_data.items()
+        if key in UPDATABLE_FIELDS and key not in ('path', 'properties')
+    }
+    element.setdefault('position_x', min_x)
+    element.setdefault('position_y', min_y)
+    element.setdefault('width', max_x - min_x)
+    element.setdefault('height', max_y - min_y)
+    properties = element_data.get('properties')
+    if not isinstance(properties, dict):
+        properties = {}
+    return {
+        **element,
+        'element_type': 'path',
+        'points': points,
+        'properties': {**stroke['properties'], **properties},
+    }
+
+def build_element(board_id, element_data):
+    """
+    Nowy (niezapisany) element tablicy z danych wiadomości - brakujące pola
+    dostają wartości domyślne.
+    """
+    return Element(
+        board_id=board_id,
+        element_type=element_data.get('element_type'),
+        content=element_data.get('content'),
+        position_x=element_data.get('position_x', 0),
+        position_y=element_data.get('position_y', 0),
+        width=element_data.get('width', 100),
+        height=element_data.get('height', 100),
+        rotation=element_data.get('rotation', 0),
+        z_index=element_data.get('z_index', 0),
+        properties=element_data.get('properties', {}),
+        path=element_data.get('path'),
+        points=element_data.get('points')
+    )
+
+
+def created_element(element_data, element):
+    """Dane utworzonego elementu do rozgłoszenia (punkty jako base64)"""
+    created = {**element_data, 'id': element.id}
+    if 'points' in created:
+        created['points'] = points_to_text(created['points'])
+    return created
 
 class BoardConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.board_id = self.scope['url_route']['kwargs']['board_id']
         self.board_group_name = f'board_{self.board_id}'
+        # Widok klienta - None oznacza całą tablicę
+        self.viewport = None
+        # Rysunki w trakcie rysowania (stroke_id -> punkty i właściwości)
+        self.strokes = {}
+        # Ramki do klienta wysyłane są przez kolejkę połączenia (boards/outbound.py)
+        self.outbound = open_queue(self.board_id, self.send)
+        # Limity wiadomości od klienta i aktualizacje odłożone po ich przekroczeniu
+        self.limiter = InboundLimiter(self.board_id)
+        self.deferred = {}
+        self.replay_task = None
+        self.limit_report = {'dropped': 0, 'deferred': 0, 'sent_at': 0.0}
+        attach_geometry(self.board_id)
 
         # Akceptuj połączenie bez sprawdzania uwierzytelnienia
         await self.channel_layer.group_add(
@@ -16,9 +261,35 @@ class BoardConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
+        # Negocjacja podprotokołu - klienci bez podprotokołu dostają JSON jak dotąd
+        subprotocols = self.scope.get('subprotocols') or []
+        self.binary = codec.BINARY_SUBPROTOCOL in subprotocols
+        if self.binary:
+            await self.accept(subprotocol=codec.BINARY_SUBPROTOCOL)
+        elif codec.JSON_SUBPROTOCOL in subprotocols:
+            await self.accept(subprotocol=codec.JSON_SUBPROTOCOL)
+        else:
+            await self.accept()
 
     async def disconnect(self, close_code):
+        # Odłożone aktualizacje to ostatni stan elementów - zapisujemy je mimo limitów
+        if self.replay_task is not None:
+            self.replay_task.cancel()
+        deferred, self.deferred = self.deferred, {}
+        for element_data, _ in deferred.values():
+            await self.handle_update(element_data)
+        self.limiter.close()
+
+        # Zapisz zbuforowane zmiany, zanim połączenie zniknie
+        await flush_board(self.board_id)
+        detach_geometry(self.board_id)
+        close_queue(self.outbound)
+
+        # Niedokończone rysunki znikają z podglądu pozostałych użytkowników
+        for stroke_id in list(self.strokes):
+            await self.broadcast({'action': 'stroke_cancel', 'stroke_id': stroke_id})
+        self.strokes = {}
+
         # Opuszczenie grupy tablicy
         await self.channel_layer.group_discard(
             self.board_group_name,
@@ -26,115 +297,592 @@ class BoardConsumer(AsyncWebsocketConsumer):
         )
 
     # Odbieranie wiadomości od WebSocket
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        # Limity liczone są w bajtach, także dla ramek tekstowych
+        if bytes_data is not None:
+            size = len(bytes_data)
+        else:
+            size = len(text_data.encode('utf-8'))
+        max_frame = board_setting('INBOUND_MAX_FRAME')
+        if max_frame and size > max_frame:
+            # Za duża ramka - nawet jej nie parsujemy
+            self.report_limit('frame_too_large')
+            return
+        allowed = self.limiter.allow(size)
+
+        try:
+            if bytes_data is not None:
+                data = codec.decode_binary(bytes_data)
+            else:
+                data = codec.loads(text_data)
+        except (ValueError, struct.error):
+            self.send_error('invalid_frame')
+            return
+        if isinstance(data, list) and bytes_data is not None:
+            # Binarna ramka zbiorcza to lista operacji - jak wiadomość batch
+            data = {'action': 'batch', 'operations': data}
+        if not isinstance(data, dict):
+            self.send_error('invalid_message')
+            return
+        max_items = board_setting('INBOUND_MAX_ITEMS')
+        if max_items and message_items(data) > max_items:
+            self.report_limit('too_many_items')
+            return
         action = data.get('action')
 
+        if not allowed:
+            # Ponad limit: aktualizacje elementów odkładamy (scalone), resztę porzucamy
+            if action == 'update_element' and isinstance(data.get('element'), dict):
+                self.defer_update(data['element'], size)
+                self.report_limit('rate_limited', deferred=True)
+            elif action == 'batch' and isinstance(data.get('operations'), list):
+                self.limit_batch(data['operations'], size)
+            else:
+                self.report_limit('rate_limited')
+            return
+
         if action == 'create_element':
-            element_data = data.get('element')
-            element_id = await self.create_element(element_data)
+            try:
+                element_data = create_fields(data.get('element'))
+            except ValueError as error:
+                self.send_error('invalid_element', message=str(error))
+                return
+            element, seq = await self.create_element(element_data)
 
             # Wysyłanie informacji do wszystkich członków grupy
-            await self.channel_layer.group_send(
-                self.board_group_name,
-                {
-                    'type': 'board_event',
-                    'action': 'create_element',
-                    'element': {**element_data, 'id': element_id}
-                }
-            )
+            await self.broadcast({
+                'action': 'create_element',
+                'element': element,
+                'seq': seq
+            })
 
         elif action == 'update_element':
             element_data = data.get('element')
-            success = await self.update_element(element_data)
+            if (
+                isinstance(element_data, dict)
+                and coerce_element_id(element_data.get('id')) in self.deferred
+            ):
+                # Starsza aktualizacja elementu czeka - nowa musi trafić za nią
+                self.defer_update(element_data, size)
+            else:
+                await self.handle_update(element_data)
+
+        elif action == 'delete_element':
+            element_id = coerce_element_id(data.get('element_id'))
+            if element_id is None:
+                self.send_error('invalid_message')
+                return
+            get_buffer(self.board_id).discard(element_id)
+            self.deferred.pop(element_id, None)
+            success, seq = await self.delete_element(element_id)
 
             if success:
-                await self.channel_layer.group_send(
-                    self.board_group_name,
-                    {
-                        'type': 'board_event',
+                await self.broadcast({
+                    'action': 'delete_element',
+                    'element_id': element_id,
+                    'seq': seq
+                })
+
+        elif action == 'batch':
+            await self.handle_batch(data.get('operations'))
+
+        elif action == 'stroke_begin':
+            await self.stroke_begin(data)
+
+        elif action == 'stroke_append':
+            await self.stroke_append(data)
+
+        elif action == 'stroke_end':
+            await self.stroke_end(data)
+
+        elif action == 'subscribe_viewport':
+            # Od teraz wysyłamy tylko zdarzenia elementów w widoku klienta
+            self.viewport = viewport_bounds(data.get('viewport'))
+
+        elif action == 'resume':
+            # Wznowienie po ponownym połączeniu - wyślij tylko przegapione zmiany.
+            # Odpowiedź idzie przez kolejkę, żeby nie wyprzedziła czekających zdarzeń;
+            # kolejka przyjmuje nowe zdarzenia dopiero po odczycie dziennika
+            reply = await self.changes_since(data.get('since'))
+            self.outbound.resume(codec.dumps(reply))
+
+    async def handle_update(self, element_data):
+        """Zapisz (lub zbuforuj) aktualizację elementu i roześlij ją"""
+        try:
+            element_id, changes = update_changes(element_data)
+        except ValueError as error:
+            self.send_error('invalid_element', message=str(error))
+            return
+
+        if board_setting('WRITE_BEHIND_ENABLED'):
+            # Numer zmiany nadawany jest dopiero przy zapisie bufora
+            success, seq = await self.buffer_element_update(element_id, changes), None
+        else:
+            success, seq = await self.update_element(element_id, changes)
+
+        if not success:
+            self.send_error('not_found', element_id=element_id)
+            return
+        event = {
+            'action': 'update_element',
+            'element': updated_element(element_id, changes),
+        }
+        if seq is not None:
+            event['seq'] = seq
+        await self.broadcast(event)
+
+    async def handle_batch(self, operations):
+        """
+        Wykonaj listę operacji create/update/delete jako jedną zmianę.
+
+        Zapis w bazie odbywa się w jednej transakcji (bulk_create, bulk_update,
+        jedno DELETE), a zdarzenia trafiają do grupy jedną ramką - w kolejności
+        operacji z wiadomości, z numerami zmian w tej samej kolejności. Wynik
+        jest taki sam jak przy wysłaniu operacji po kolei: aktualizacja
+        elementu usuniętego wcześniej w tej wiadomości kończy się not_found.
+        """
+        if not isinstance(operations, list):
+            return
+
+        # Utworzenia i usunięcia jako (indeks operacji, dane), aktualizacje:
+        # element_id -> (indeks ostatniej aktualizacji, scalone zmiany)
+        creates, updates, deletes = [], {}, []
+        buffered = []
+        deleted = set()
+        write_behind = board_setting('WRITE_BEHIND_ENABLED')
+        if write_behind:
+            # Nieznane elementy sprawdzamy jednym zapytaniem na całą wiadomość
+            buffer = get_buffer(self.board_id)
+            existing = await buffer.contains_many(batch_update_ids(operations))
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                continue
+            action = operation.get('action')
+            element_data = operation.get('element')
+
+            if action == 'create_element':
+                # Błędny element pomijamy, zanim trafi do bulk_create
+                try:
+                    creates.append((index, create_fields(element_data)))
+                except ValueError as error:
+                    self.send_error('invalid_element', message=str(error), index=index)
+
+            elif action == 'update_element' and isinstance(element_data, dict):
+                try:
+                    element_id, changes = update_changes(element_data)
+                except ValueError as error:
+                    self.send_error(
+                        'invalid_element', message=str(error), index=index
+                    )
+                    continue
+                if element_id in deleted:
+                    self.send_error('not_found', element_id=element_id, index=index)
+                elif element_id in self.deferred:
+                    # Starsza aktualizacja czeka na limit - nowa trafia za nią
+                    self.defer_update(element_data, 0)
+                elif write_behind:
+                    # Jak pojedyncze update_element - do bufora zapisów,
+                    # bez transakcji
+                    if element_id not in existing:
+                        self.send_error(
+                            'not_found', element_id=element_id, index=index
+                        )
+                        continue
+                    if changes:
+                        await buffer.add(element_id, changes)
+                    buffered.append((index, {
                         'action': 'update_element',
-                        'element': element_data
-                    }
-                )
+                        'element': updated_element(element_id, changes),
+                    }))
+                else:
+                    _, merged = updates.get(element_id, (index, {}))
+                    updates[element_id] = (index, merge_changes(merged, changes))
 
-        elif action == 'delete_element':
-            element_id = data.get('element_id')
-            success = await self.delete_element(element_id)
+            elif action == 'delete_element':
+                element_id = coerce_element_id(operation.get('element_id'))
+                if element_id is None:
+                    continue
+                get_buffer(self.board_id).discard(element_id)
+                self.deferred.pop(element_id, None)
+                deletes.append((index, element_id))
+                deleted.add(element_id)
 
-            if success:
-                await self.channel_layer.group_send(
-                    self.board_group_name,
-                    {
-                        'type': 'board_event',
-                        'action': 'delete_element',
-                        'element_id': element_id
-                    }
+        events = buffered
+        if creates or updates or deletes:
+            events = events + await self.apply_batch(creates, updates, deletes)
+        events.sort(key=lambda item: item[0])
+        await self.broadcast_batch([event for _, event in events])
+
+    @db_sync_to_async
+    def apply_batch(self, creates, updates, deletes):
+        """
+        Zapisz operacje wiadomości batch w jednej transakcji.
+
+        Zwraca pary (indeks operacji, zdarzenie) - numery zmian nadawane są
+        w kolejności operacji, nie w kolejności zapisu.
+        """
+        with transaction.atomic():
+            events = []
+            if creates:
+                rows = [compact_element_data(data) for _, data in creates]
+                elements = Element.objects.bulk_create(
+                    [build_element(self.board_id, row) for row in rows]
                 )
+                created = zip(creates, rows, elements, strict=True)
+                for (index, _), row, element in created:
+                    events.append((index, {
+                        'action': 'create_element',
+                        'element': created_element(row, element),
+                    }))
+            if updates:
+                changes = {
+                    element_id: merged for element_id, (_, merged) in updates.items()
+                }
+                events.extend(
+                    (updates[event['element']['id']][0], event)
+                    for event in apply_element_changes(self.board_id, changes)
+                )
+            if deletes:
+                existing = set(
+                    Element.objects.filter(
+                        board_id=self.board_id,
+                        id__in=[element_id for _, element_id in deletes],
+                    ).values_list('id', flat=True)
+                )
+                Element.objects.filter(id__in=existing).delete()
+                events.extend(
+                    (index, {'action': 'delete_element', 'element_id': element_id})
+                    for index, element_id in deletes if element_id in existing
+                )
+
+            if not events:
+                return []
+            events.sort(key=lambda item: item[0])
+            version = Board.register_change(
+                self.board_id, [event for _, event in events]
+            )
+
+        first_seq = version - len(events) + 1
+        return [
+            (index, {**event, 'seq': first_seq + offset})
+            for offset, (index, event) in enumerate(events)
+        ]
+
+    def limit_batch(self, operations, size):
+        """
+        Wiadomość batch ponad limit - same aktualizacje są odkładane,
+        inną odrzucamy w całości.
+
+        Częściowe wykonanie (aktualizacje bez utworzeń i usunięć) złamałoby
+        zasadę jednej zmiany - klient dostaje batch_rejected z indeksami
+        porzuconych operacji i może wysłać je ponownie po retry_after.
+        """
+        updates = [
+            op['element'] for op in operations
+            if isinstance(op, dict)
+            and op.get('action') == 'update_element'
+            and isinstance(op.get('element'), dict)
+        ]
+        if updates and len(updates) == len(operations):
+            for element_data in updates:
+                self.defer_update(element_data, size // len(operations))
+            self.report_limit('rate_limited', deferred=True)
+            return
+        self.outbound.push(codec.dumps({
+            'action': 'batch_rejected',
+            'reason': 'rate_limited',
+            'operations': list(range(len(operations))),
+            'retry_after': round(self.limiter.delay(size), 3),
+        }))
+
+    def defer_update(self, element_data, size):
+        """Odłóż aktualizację ponad limit - kolejne aktualizacje są z nią scalane"""
+        element_id = coerce_element_id(element_data.get('id'))
+        if element_id is None:
+            return
+        queued = self.deferred.get(element_id)
+        if queued is None or not merge_update(queued[0], element_data):
+            if queued is not None:
+                # Dwóch łatek properties nie da się scalić - zostaje nowsza
+                self.limit_report['dropped'] += 1
+            self.deferred[element_id] = (dict(element_data), size)
+        if self.replay_task is None:
+            self.replay_task = asyncio.ensure_future(self.replay_deferred())
+
+    async def replay_deferred(self):
+        """Wykonaj odłożone aktualizacje, gdy limity na to pozwolą"""
+        try:
+            while self.deferred:
+                element_id, (element_data, size) = next(iter(self.deferred.items()))
+                if not self.limiter.allow(size):
+                    await asyncio.sleep(self.limiter.delay(size))
+                    continue
+                del self.deferred[element_id]
+                await self.handle_update(element_data)
+        finally:
+            self.replay_task = None
+
+    def report_limit(self, reason, deferred=False):
+        """
+        Powiadom klienta o porzuconych lub odłożonych wiadomościach
+        (najwyżej raz na sekundę).
+        """
+        report = self.limit_report
+        report['deferred' if deferred else 'dropped'] += 1
+        now = time.monotonic()
+        if now - report['sent_at'] < 1.0:
+            return
+        self.outbound.push(codec.dumps({
+            'action': 'rate_limited',
+            'reason': reason,
+            'dropped': report['dropped'],
+            'deferred': report['deferred'],
+            'retry_after': round(self.limiter.delay(1), 3),
+        }))
+        report.update(dropped=0, deferred=0, sent_at=now)
+
+    def send_error(self, reason, **details):
+        """Powiadom klienta o odrzuconej wiadomości (połączenie zostaje otwarte)"""
+        frame = codec.dumps({'action': 'error', 'reason': reason, **details})
+        self.outbound.push(frame)
+
+    async def reject_stroke(self, stroke_id, reason):
+        """
+        Odrzuć rysunek - klient zapisze go zwykłym create_element po zakończeniu.
+
+        Otwarty już rysunek jest zamykany, a pozostali klienci usuwają podgląd.
+        """
+        self.outbound.push(codec.dumps({
+            'action': 'stroke_rejected', 'stroke_id': stroke_id, 'reason': reason
+        }))
+        if self.strokes.pop(stroke_id, None) is not None:
+            await self.broadcast({'action': 'stroke_cancel', 'stroke_id': stroke_id})
+
+    async def stroke_begin(self, data):
+        """Rozpocznij rysunek - punkty są w pamięci połączenia, nie w bazie"""
+        stroke_id = data.get('stroke_id')
+        if not isinstance(stroke_id, str):
+            self.send_error('invalid_message')
+            return
+        # Długość sprawdzamy przed parsowaniem - nie przeglądamy punktów ponad limit
+        points = data.get('points', [])
+        max_points = board_setting('STROKE_MAX_POINTS')
+        if isinstance(points, list) and len(points) > max_points:
+            await self.reject_stroke(stroke_id, 'too_many_points')
+            return
+        points = parse_points(points)
+        if points is None:
+            await self.reject_stroke(stroke_id, 'invalid_points')
+            return
+        max_open = board_setting('STROKE_MAX_OPEN')
+        if stroke_id not in self.strokes and len(self.strokes) >= max_open:
+            await self.reject_stroke(stroke_id, 'too_many_strokes')
+            return
+
+        properties = data.get('properties')
+        properties = properties if isinstance(properties, dict) else {}
+        self.strokes[stroke_id] = {'points': points, 'properties': properties}
+        await self.broadcast({
+            'action': 'stroke_begin',
+            'stroke_id': stroke_id,
+            'properties': properties,
+            'points': [list(point) for point in points]
+        })
+
+    async def stroke_append(self, data):
+        """Dopisz punkty do rysunku i prześlij dalej tylko nowe punkty"""
+        stroke_id = data.get('stroke_id')
+        if not isinstance(stroke_id, str):
+            self.send_error('invalid_message')
+            return
+        stroke = self.strokes.get(stroke_id)
+        points = data.get('points')
+        if stroke is None or not isinstance(points, list) or not points:
+            return
+        if len(stroke['points']) + len(points) > board_setting('STROKE_MAX_POINTS'):
+            await self.reject_stroke(stroke_id, 'too_many_points')
+            return
+        points = parse_points(points)
+        if points is None:
+            self.send_error('invalid_message')
+            return
+
+        stroke['points'].extend(points)
+        await self.broadcast({
+            'action': 'stroke_append',
+            'stroke_id': stroke_id,
+            'points': [list(point) for point in points]
+        })
+
+    async def stroke_end(self, data):
+        """Zakończ rysunek - zapisz go jako jeden element path"""
+        stroke_id = data.get('stroke_id')
+        if not isinstance(stroke_id, str):
+            self.send_error('invalid_message')
+            return
+        stroke = self.strokes.pop(stroke_id, None)
+        if stroke is None:
+            return
+        if not stroke['points']:
+            await self.broadcast({'action': 'stroke_cancel', 'stroke_id': stroke_id})
+            return
+
+        element_data = data.get('element')
+        if not isinstance(element_data, dict):
+            element_data = {}
+        try:
+            element_data = create_fields(stroke_element(stroke, element_data))
+        except ValueError as error:
+            self.send_error(
+                'invalid_element', message=str(error), stroke_id=stroke_id
+            )
+            await self.broadcast({'action': 'stroke_cancel', 'stroke_id': stroke_id})
+            return
+        element, seq = await self.create_element(element_data)
+
+        # stroke_id pozwala klientom zastąpić podgląd rysunku zapisanym elementem
+        await self.broadcast({
+            'action': 'create_element',
+            'element': {**element, 'stroke_id': stroke_id},
+            'seq': seq
+        })
+
+    async def broadcast(self, event):
+        """Wyślij zdarzenie do grupy tablicy razem z ramką, której dotyczy"""
+        bounds = await get_geometry(self.board_id).event_bounds(event)
+        await send_to_board(self.board_group_name, event, bounds)
+
+    async def broadcast_batch(self, events):
+        """Wyślij zdarzenia do grupy tablicy jedną ramką"""
+        if not events:
+            return
+        geometry = get_geometry(self.board_id)
+        bounds, unscoped = None, False
+        for event in events:
+            # Geometria śledzi wszystkie zdarzenia, także gdy ramka obejmie całą
+            # tablicę
+            event_bounds = await geometry.event_bounds(event)
+            if event_bounds is None:
+                unscoped = True
+            elif bounds is None:
+                bounds = event_bounds
+            else:
+                bounds = union_bounds(bounds, event_bounds)
+        if unscoped:
+            bounds = None
+        await send_batch_to_board(self.board_group_name, events, bounds)
+
+    def in_viewport(self, event):
+        """Czy zdarzenie z kanału dotyczy widoku tego klienta"""
+        bounds = event.get('bounds')
+        if self.viewport is None or bounds is None:
+            return True
+        return intersects(bounds, self.viewport)
 
     # Obsługa zdarzeń z kanału
     async def board_event(self, event):
-        # Wysyłanie wiadomości do WebSocket
-        await self.send(text_data=json.dumps({
-            'action': event['action'],
-            'element': event.get('element'),
-            'element_id': event.get('element_id')
-        }))
+        if not self.in_viewport(event):
+            return
+
+        # Wysyłanie wiadomości do WebSocket (przez kolejkę połączenia)
+        frame = event.get('frame')
+        if self.binary and frame is not None:
+            frame = binary_frame(frame) or frame
+        if frame is None:
+            # Zdarzenia wysłane do grupy bez gotowej ramki
+            frame = codec.dumps({
+                'action': event['action'],
+                'element': event.get('element'),
+                'element_id': event.get('element_id')
+            })
+        self.outbound.push(frame, event.get('action'), event.get('element_id'))
+
+    async def board_batch(self, event):
+        if not self.in_viewport(event):
+            return
 
-    @database_sync_to_async
+        # Ramka zbiorcza jest już zserializowana - wysyłamy ją bez zmian
+        frame = event['frame']
+        self.outbound.push((binary_frame(frame) or frame) if self.binary else frame)
+
+    async def changes_since(self, since):
+        """Zmiany tablicy po wersji since w formacie odpowiedzi na resume"""
+        # Zmiany czekające w buforze muszą trafić do dziennika przed odczytem
+        await flush_board(self.board_id)
+        result = await self.read_changes(since)
+        return {'action': 'resume', **result}
+
+    @db_sync_to_async
+    def read_changes(self, since):
+        board = Board.objects.only('id', 'version').get(id=self.board_id)
+        try:
+            since = int(since)
+        except (TypeError, ValueError):
+            # Klient nie zna swojej wersji - musi pobrać całą tablicę
+            return {
+                'version': board.version, 'resync': True,
+                'changes': [], 'has_more': False,
+            }
+        return BoardChange.since(board, since)
+
+    @db_sync_to_async
+    @transaction.atomic
     def create_element(self, element_data):
+        """Utwórz element - zwraca dane elementu do rozgłoszenia i numer zmiany"""
+        # Ścieżka rysunku odręcznego zapisywana jest jako uproszczone punkty
+        element_data = compact_element_data(element_data)
         board = Board.objects.get(id=self.board_id)
-        element = Element.objects.create(
-            board=board,
-            element_type=element_data.get('element_type'),
-            content=element_data.get('content'),
-            position_x=element_data.get('position_x', 0),
-            position_y=element_data.get('position_y', 0),
-            width=element_data.get('width', 100),
-            height=element_data.get('height', 100),
-            rotation=element_data.get('rotation', 0),
-            z_index=element_data.get('z_index', 0),
-            properties=element_data.get('properties', {}),
-            path=element_data.get('path')
-        )
-        return element.id
+        element = build_element(board.id, element_data)
+        element.save()
+        created = created_element(element_data, element)
+        seq = Board.register_change(board.id, [
+            {'action': 'create_element', 'element': created}
+        ])
+        return created, seq
 
-    @database_sync_to_async
-    def update_element(self, element_data):
-        try:
-            element_id = element_data.get('id')
-            element = Element.objects.get(id=element_id, board_id=self.board_id)
+    async def buffer_element_update(self, element_id, changes):
+        """
+        Odłóż zmiany elementu do bufora zapisów tablicy zamiast zapisywać je od razu.
 
-            # Aktualizacja właściwości
-            if 'content' in element_data:
-                element.content = element_data['content']
-            if 'position_x' in element_data:
-                element.position_x = element_data['position_x']
-            if 'position_y' in element_data:
-                element.position_y = element_data['position_y']
-            if 'width' in element_data:
-                element.width = element_data['width']
-            if 'height' in element_data:
-                element.height = element_data['height']
-            if 'rotation' in element_data:
-                element.rotation = element_data['rotation']
-            if 'z_index' in element_data:
-                element.z_index = element_data['z_index']
-            if 'properties' in element_data:
-                element.properties = element_data['properties']
-            if 'path' in element_data:
-                element.path = element_data['path']
-
-            element.save()
-            return True
-        except Element.DoesNotExist:
+        Zwraca False, jeśli elementu nie ma na tablicy - takiej zmiany nie rozgłaszamy.
+        """
+        buffer = get_buffer(self.board_id)
+        if not await buffer.contains(element_id):
             return False
+        if changes:
+            await buffer.add(element_id, changes)
+        return True
+
+    @db_sync_to_async
+    def update_element(self, element_id, changes):
+        """Zapisz zmiany elementu od razu - zwraca (czy się udało, numer zmiany)"""
+        elements = Element.objects.filter(id=element_id, board_id=self.board_id)
 
-    @database_sync_to_async
+        if PROPERTIES_PATCH in changes:
+            # Łatka właściwości wymaga odczytu bieżącego stanu
+            written, seq = write_element_changes(self.board_id, {element_id: changes})
+            return written > 0, seq
+        if not changes:
+            return elements.exists(), None
+
+        # Zapis tylko zmienionych kolumn jednym UPDATE ... WHERE id=
+        with transaction.atomic():
+            if not elements.update(**changes, updated_at=timezone.now()):
+                return False, None
+            seq = Board.register_change(self.board_id, [
+                {'action': 'update_element', 'element': {'id': element_id, **changes}}
+            ])
+        return True, seq
+
+    @db_sync_to_async
+    @transaction.atomic
     def delete_element(self, element_id):
         try:
             element = Element.objects.get(id=element_id, board_id=self.board_id)
             element.delete()
-            return True
+            seq = Board.register_change(self.board_id, [
+                {'action': 'delete_element', 'element_id': element_id}
+            ])
+            return True, seq
         except Element.DoesNotExist:
-            return False
\ No newline at end of file
+            return False, None
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""
+Wywołania bazy danych z kodu asynchronicznego (konsumenci WebSocket, bufor zapisów).
+
+database_sync_to_async z Channels wykonuje wszystkie wywołania procesu
+w jednym wspólnym wątku - przy wielu połączeniach każda zmiana czeka
+w kolejce do tego wątku. Przy DB_EXECUTOR_WORKERS > 0 wywołania trafiają
+do własnej puli tylu wątków (każdy z własnym połączeniem do bazy).
+
+Pula ma sens przy PostgreSQL. SQLite i tak zapisuje jedną transakcją
+naraz, a równoległe transakcje odczyt-zapis kończą się błędem "database
+is locked" - dla SQLite pula ma najwyżej jeden wątek (tylko dla tablic,
+niezależny od wspólnego wątku Channels).
+
+Każde nowe połączenie SQLite dostaje ustawienia SQLITE_PRAGMAS (WAL,
+synchronous=NORMAL, busy_timeout...) - configure_sqlite podpięte do
+sygnału connection_created w BoardsConfig.ready.
+
+Asynchroniczne API ORM Django 4.2 (aget, asave...) nie pomaga: każde
+wywołanie to osobny przeskok do tego samego wspólnego wątku i nie działa
+w nim transaction.atomic. Dlatego każda operacja konsumenta to jedna
+funkcja synchroniczna (jedna transakcja) wykonywana jednym przeskokiem.
+"""
+
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.db import connection
+
+from .conf import board_setting
+
+# Pula wątków bazy (liczba wątków, executor) - tworzona przy pierwszym użyciu
+_pool = (0, None)
+
+
+def get_executor():
+    """Pula wątków bazy albo None, jeśli wywołania idą do wspólnego wątku"""
+    global _pool
+    workers = board_setting('DB_EXECUTOR_WORKERS')
+    if workers and connection.vendor == 'sqlite':
+        workers = 1
+    if workers != _pool[0]:
+        if _pool[1] is not None:
+            _pool[1].shutdown(wait=False)
+        executor = None
+        if workers:
+            executor = ThreadPoolExecutor(workers, thread_name_prefix='boards-db')
+        _pool = (workers, executor)
+    return _pool[1]
+
+
+def db_sync_to_async(func):
+    """database_sync_to_async korzystające z puli DB_EXECUTOR_WORKERS, jeśli jest"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        executor = get_executor()
+        if executor is None:
+            return await database_sync_to_async(func)(*args, **kwargs)
+        call = database_sync_to_async(func, thread_sensitive=False, executor=executor)
+        return await call(*args, **kwargs)
+    return wrapper
+
+
+def configure_sqlite(connection, **_kwargs):
+    """Ustawienia SQLite dla nowego połączenia (sygnał connection_created)"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in board_setting('SQLITE_PRAGMAS').items():
+            cursor.execute(f'PRAGMA {name}={value}')
@@ -0,0 +1,466 @@
+"""
+Warstwa kanałów (channel layer) oparta na SQLite w trybie WAL.
+
+Pozwala uruchomić kilka procesów Daphne/Uvicorn na jednym serwerze bez
+zewnętrznych usług (Redis). Każdy proces ma własną skrzynkę (inbox):
+wiadomości do kanałów innego procesu trafiają do tabeli channel_messages
+- jeden wiersz na proces adresata, niezależnie od liczby jego kanałów -
+i są odbierane przez jedno zadanie odpytujące bazę w tym procesie.
+Kanały tego samego procesu dostają wiadomości bezpośrednio, bez bazy.
+
+Członkostwo w grupach jest wspólne dla wszystkich procesów (tabela
+channel_groups) i wygasa po group_expiry sekundach od ostatniego
+group_add - wpisy po procesach, które padły, znikają same. Członków
+z tego procesu group_send bierze z pamięci, a członków z innych procesów
+czyta z bazy najwyżej raz na group_cache_ttl sekund - przy przydziale
+tablic do procesów (boards/sharding.py) rozgłaszanie nie dotyka bazy.
+Nowy członek z innego procesu dostaje wiadomości grupy najpóźniej po
+group_cache_ttl sekundach (0 - odczyt przy każdym group_send).
+
+Skrzynka odpytywana jest co poll_interval sekund, dopóki przychodzą
+wiadomości. Bez ruchu odstęp rośnie dwukrotnie z każdym pustym odczytem,
+aż do max_poll_interval - bezczynny proces nie odpytuje bazy 200 razy na
+sekundę. Wysłanie wiadomości przywraca krótki odstęp (odpowiedzi zwykle
+przychodzą zaraz potem).
+
+Limit capacity dotyczy kolejki kanału w procesie odbiorcy: wiadomości
+grupowe ponad limit są porzucane, a send() do pełnego lokalnego kanału
+rzuca ChannelFull (dla kanałów innych procesów limit sprawdza odbiorca).
+
+Konfiguracja w settings.py:
+
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'boards.layers.SQLiteChannelLayer',
+            'CONFIG': {'path': '/var/run/whiteboard/channels.sqlite3'},
+        },
+    }
+"""
+
+import asyncio
+import base64
+import logging
+import os
+import random
+import sqlite3
+import string
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS channel_messages ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    ' inbox TEXT NOT NULL,'
+    ' channels TEXT NOT NULL,'
+    ' expires REAL NOT NULL,'
+    ' body BLOB NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS channel_messages_inbox ON channel_messages (inbox, id)',
+    'CREATE TABLE IF NOT EXISTS channel_groups ('
+    ' group_name TEXT NOT NULL,'
+    ' channel TEXT NOT NULL,'
+    ' inbox TEXT NOT NULL,'
+    ' expires REAL NOT NULL,'
+    ' PRIMARY KEY (group_name, channel))',
+)
+
+# Co ile sekund usuwać wygasłe wiadomości i członkostwa w grupach
+CLEANUP_INTERVAL = 10
+
+
+def _encode(value):
+    # JSON nie ma typu bajtów - ramki binarne zapisujemy jako base64
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if len(value) == 1 and '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def pack_message(message):
+    """Zserializuj wiadomość kanału (słownik z tekstem, liczbami i bajtami)"""
+    return codec.dumps(_encode(message)).encode('utf-8')
+
+
+def unpack_message(data):
+    return _decode(codec.loads(data))
+
+
+def _random_name(length=12):
+    return ''.join(random.choice(string.ascii_letters) for _ in range(length))
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """Warstwa kanałów dla wielu procesów jednego serwera, oparta na pliku SQLite"""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        path=None,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.005,
+        max_poll_interval=0.1,
+        group_cache_ttl=1.0,
+        **kwargs
+    ):
+        super().__init__(
+            expiry=expiry, capacity=capacity, channel_capacity=channel_capacity,
+            **kwargs
+        )
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.path = path or os.path.join(
+            tempfile.gettempdir(), 'whiteboard-channels.sqlite3'
+        )
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max(max_poll_interval, poll_interval)
+        self.group_cache_ttl = group_cache_ttl
+        self.client_prefix = _random_name()
+        self.stats = {
+            'local': 0, 'remote_rows': 0, 'polled_rows': 0, 'dropped': 0, 'bad_rows': 0
+        }
+
+        self._inboxes = set()
+        self._queues = {}
+        # Członkostwo kanałów tego procesu (grupa -> {kanał: wygasa}) i odczytani
+        # z bazy członkowie z innych procesów
+        # (grupa -> (czas odczytu, [(kanał, skrzynka)]))
+        self._groups = {}
+        self._remote_groups = {}
+        self._loop = None
+        self._poller = None
+        # Bieżący odstęp odpytywania skrzynki (rośnie, gdy nic nie przychodzi)
+        self._idle_interval = poll_interval
+        self._connection = None
+        self._last_cleanup = 0
+        # Jedno połączenie SQLite używane zawsze z tego samego wątku - zapytania
+        # nie blokują pętli zdarzeń
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='channels-sqlite'
+        )
+
+    # Dostęp do bazy (wykonywany w wątku wykonawcy)
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._connection = connection
+        return self._connection
+
+    def _write(self, statements):
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, params in statements:
+                if isinstance(params, list):
+                    connection.executemany(sql, params)
+                else:
+                    connection.execute(sql, params)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _group_members(self, group, now):
+        return self._connect().execute(
+            'SELECT channel, inbox FROM channel_groups'
+            ' WHERE group_name = ? AND expires > ?',
+            (group, now)
+        ).fetchall()
+
+    def _fetch(self, inboxes, now):
+        """Pobierz i usuń wiadomości ze skrzynek tego procesu"""
+        connection = self._connect()
+        if now - self._last_cleanup > CLEANUP_INTERVAL:
+            self._last_cleanup = now
+            self._write([
+                ('DELETE FROM channel_messages WHERE expires < ?', (now,)),
+                ('DELETE FROM channel_groups WHERE expires < ?', (now,)),
+            ])
+
+        placeholders = ','.join('?' * len(inboxes))
+        # Odczyt bez blokady - transakcja zapisu tylko wtedy, gdy jest co odebrać
+        pending = connection.execute(
+            'SELECT EXISTS (SELECT 1 FROM channel_messages'
+            f' WHERE inbox IN ({placeholders}))', inboxes
+        ).fetchone()[0]
+        if not pending:
+            return []
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                f'SELECT id, channels, expires, body FROM channel_messages '
+                f'WHERE inbox IN ({placeholders}) ORDER BY id', inboxes
+            ).fetchall()
+            if rows:
+                connection.execute(
+                    'DELETE FROM channel_messages'
+                    f' WHERE inbox IN ({placeholders}) AND id <= ?',
+                    (*inboxes, rows[-1][0])
+                )
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return [(channels, expires, body) for _, channels, expires, body in rows]
+
+    def _claim(self, channel):
+        """
+        Odbierz jedną wiadomość ze zwykłego (nie procesowego) kanału - może
+        czekać na nim wiele procesów.
+        """
+        return self._connect().execute(
+            'DELETE FROM channel_messages WHERE id = ('
+            ' SELECT id FROM channel_messages WHERE inbox = ? AND expires >= ?'
+            ' ORDER BY id LIMIT 1'
+            ') RETURNING expires, body',
+            (channel, time.time())
+        ).fetchone()
+
+    def _insert_statement(self, rows):
+        return (
+            'INSERT INTO channel_messages (inbox, channels, expires, body)'
+            ' VALUES (?, ?, ?, ?)',
+            [
+                (inbox, codec.dumps(channels), expires, body)
+                for inbox, channels, expires, body in rows
+            ]
+        )
+
+    async def _db(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    # Kolejki kanałów tego procesu
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Nowa pętla zdarzeń (np. w testach) - kolejki i zadanie odpytujące
+            # starej są bezużyteczne
+            self._loop = loop
+            self._queues = {}
+            self._poller = None
+
+    def _is_local(self, channel):
+        return self.non_local_name(channel) in self._inboxes
+
+    async def _remote_members(self, group, now):
+        """Członkowie grupy z innych procesów - z bazy raz na group_cache_ttl"""
+        cached = self._remote_groups.get(group)
+        if cached is not None and now - cached[0] < self.group_cache_ttl:
+            return cached[1]
+        rows = await self._db(self._group_members, group, now)
+        members = [
+            (channel, inbox) for channel, inbox in rows if inbox not in self._inboxes
+        ]
+        if len(self._remote_groups) >= 1024:
+            # Grupy, do których dawno nic nie wysłano, nie muszą zostawać w pamięci
+            self._remote_groups = {
+                name: entry for name, entry in self._remote_groups.items()
+                if now - entry[0] < self.group_cache_ttl
+            }
+        self._remote_groups[group] = (now, members)
+        return members
+
+    def _deliver(self, channel, expires, message):
+        """Wstaw wiadomość do kolejki kanału tego procesu - False, gdy jest pełna"""
+        queue = self._queues.setdefault(channel, asyncio.Queue())
+        if queue.qsize() >= self.get_capacity(channel):
+            self.stats['dropped'] += 1
+            return False
+        # Płytka kopia - odbiorcy nie współdzielą słownika wiadomości
+        queue.put_nowait((expires, dict(message)))
+        return True
+
+    def _ensure_poller(self):
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll())
+
+    async def _poll(self):
+        while True:
+            try:
+                inboxes = tuple(sorted(self._inboxes))
+                rows = await self._db(self._fetch, inboxes, time.time())
+            except Exception:
+                # Np. baza chwilowo zablokowana - spróbujemy ponownie za chwilę
+                logger.exception('Błąd odczytu wiadomości z %s', self.path)
+                await asyncio.sleep(self._idle_interval)
+                continue
+            now = time.time()
+            for channels, expires, body in rows:
+                if expires < now:
+                    continue
+                try:
+                    message = unpack_message(body)
+                    for channel in codec.loads(channels):
+                        self._deliver(channel, expires, message)
+                except Exception:
+                    # Uszkodzony wiersz nie może zatrzymać odbioru pozostałych
+                    logger.exception('Pominięto błędną wiadomość w %s', self.path)
+                    self.stats['bad_rows'] += 1
+            self.stats['polled_rows'] += len(rows)
+            if rows:
+                # Przy ruchu odpytujemy od razu
+                self._idle_interval = self.poll_interval
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(self._idle_interval)
+                self._idle_interval = min(
+                    self._idle_interval * 2, self.max_poll_interval
+                )
+
+    # API warstwy kanałów
+
+    async def send(self, channel, message):
+        """Wyślij wiadomość do kanału"""
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+
+        self._check_loop()
+        expires = time.time() + self.expiry
+        if self._is_local(channel):
+            if not self._deliver(channel, expires, message):
+                raise ChannelFull(channel)
+            self.stats['local'] += 1
+            return
+
+        await self._db(self._write, [self._insert_statement([
+            (self.non_local_name(channel), [channel], expires, pack_message(message))
+        ])])
+        self.stats['remote_rows'] += 1
+        self._idle_interval = self.poll_interval
+
+    async def receive(self, channel):
+        """Odbierz pierwszą wiadomość z kanału"""
+        assert self.valid_channel_name(channel)
+        self._check_loop()
+
+        if not self._is_local(channel):
+            while True:
+                row = await self._db(self._claim, channel)
+                if row is not None:
+                    return unpack_message(row[1])
+                await asyncio.sleep(self.poll_interval)
+
+        self._ensure_poller()
+        queue = self._queues.setdefault(channel, asyncio.Queue())
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires >= time.time():
+                    return message
+        finally:
+            if queue.empty() and self._queues.get(channel) is queue:
+                del self._queues[channel]
+
+    async def new_channel(self, prefix='specific.'):
+        """Nowy kanał tego procesu"""
+        inbox = f'{prefix}{self.client_prefix}!'
+        self._inboxes.add(inbox)
+        return inbox + _random_name()
+
+    async def group_add(self, group, channel):
+        """Dodaj kanał do grupy (albo odśwież członkostwo)"""
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        expires = time.time() + self.group_expiry
+        await self._db(self._write, [(
+            'INSERT OR REPLACE INTO channel_groups'
+            ' (group_name, channel, inbox, expires) VALUES (?, ?, ?, ?)',
+            (group, channel, self.non_local_name(channel), expires)
+        )])
+        if self._is_local(channel):
+            self._groups.setdefault(group, {})[channel] = expires
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), 'Invalid channel name'
+        assert self.valid_group_name(group), 'Invalid group name'
+        members = self._groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self._groups[group]
+        await self._db(self._write, [(
+            'DELETE FROM channel_groups WHERE group_name = ? AND channel = ?',
+            (group, channel)
+        )])
+
+    async def group_send(self, group, message):
+        """
+        Wyślij wiadomość do wszystkich członków grupy.
+
+        Kanały tego procesu dostają ją od razu, a dla każdego innego
+        procesu zapisywany jest jeden wiersz z listą jego kanałów -
+        wiadomość jest serializowana raz. Bez członków z innych procesów
+        (odczytanych najwyżej raz na group_cache_ttl) baza nie jest używana.
+        """
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Invalid group name'
+        self._check_loop()
+
+        now = time.time()
+        expires = now + self.expiry
+        for channel, channel_expires in list(self._groups.get(group, {}).items()):
+            if channel_expires > now and self._deliver(channel, expires, message):
+                self.stats['local'] += 1
+        remote = {}
+        for channel, inbox in await self._remote_members(group, now):
+            remote.setdefault(inbox, []).append(channel)
+
+        if remote:
+            body = pack_message(message)
+            await self._db(self._write, [self._insert_statement([
+                (inbox, channels, expires, body) for inbox, channels in remote.items()
+            ])])
+            self.stats['remote_rows'] += len(remote)
+            self._idle_interval = self.poll_interval
+
+    async def flush(self):
+        """Usuń wszystkie wiadomości i grupy (używane w testach)"""
+        await self._db(self._write, [
+            ('DELETE FROM channel_messages', ()),
+            ('DELETE FROM channel_groups', ()),
+        ])
+        self._queues = {}
+        self._groups = {}
+        self._remote_groups = {}
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        if self._connection is not None:
+            await self._db(self._connection.close)
+            self._connection = None
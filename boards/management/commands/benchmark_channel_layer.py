@@ -0,0 +1,156 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from boards.layers import SQLiteChannelLayer
+
+GROUP = 'benchmark'
+
+
+def _make_layer(name, path, capacity):
+    if name == 'inmemory':
+        return InMemoryChannelLayer(capacity=capacity)
+    return SQLiteChannelLayer(path=path, capacity=capacity)
+
+
+async def _receive_all(layer, channels, messages):
+    await asyncio.gather(*(
+        _receive_channel(layer, channel, messages) for channel in channels
+    ))
+
+
+def _message(payload, index):
+    return {'type': 'board_event', 'frame': payload, 'index': index}
+
+
+async def _receive_channel(layer, channel, messages):
+    for _ in range(messages):
+        await layer.receive(channel)
+
+
+async def _run_local(layer, members, messages, payload):
+    """Nadawca i odbiorcy w jednym procesie - zwraca (czas wysyłania, czas całkowity)"""
+    channels = [await layer.new_channel() for _ in range(members)]
+    for channel in channels:
+        await layer.group_add(GROUP, channel)
+
+    started = time.perf_counter()
+    receiving = asyncio.ensure_future(_receive_all(layer, channels, messages))
+    for index in range(messages):
+        await layer.group_send(GROUP, _message(payload, index))
+    sent = time.perf_counter()
+    await receiving
+    finished = time.perf_counter()
+
+    await layer.flush()
+    await layer.close()
+    return sent - started, finished - started
+
+
+def _receiver_process(path, members, messages, capacity, ready, results):
+    """Proces odbiorcy - dołącza kanały do grupy i mierzy czas odebrania wiadomości"""
+    async def run():
+        layer = SQLiteChannelLayer(path=path, capacity=capacity)
+        channels = [await layer.new_channel() for _ in range(members)]
+        for channel in channels:
+            await layer.group_add(GROUP, channel)
+        ready.set()
+        await _receive_all(layer, channels, messages)
+        results.put(time.time())
+        await layer.close()
+
+    asyncio.run(run())
+
+
+async def _send_remote(path, messages, payload):
+    layer = SQLiteChannelLayer(path=path)
+    started = time.perf_counter()
+    for index in range(messages):
+        await layer.group_send(GROUP, _message(payload, index))
+    sent = time.perf_counter() - started
+    await layer.close()
+    return sent
+
+
+class Command(BaseCommand):
+    help = 'Mierzy przepustowość warstwy kanałów (group_send do grupy tablicy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--members', type=int, default=50, help='Liczba kanałów w grupie'
+        )
+        parser.add_argument(
+            '--messages', type=int, default=1000, help='Liczba wiadomości group_send'
+        )
+        parser.add_argument(
+            '--size', type=int, default=200, help='Rozmiar ramki w bajtach'
+        )
+        parser.add_argument(
+            '--processes', type=int, default=0,
+            help='Liczba procesów odbiorców dla warstwy SQLite '
+                 '(0 - tylko test w jednym procesie)'
+        )
+        parser.add_argument('--path', help='Plik bazy SQLite (domyślnie tymczasowy)')
+
+    def handle(self, *args, **options):
+        members, messages = options['members'], options['messages']
+        payload = 'x' * options['size']
+        # Pojemność kanałów tak duża, żeby test niczego nie porzucił
+        capacity = messages + 1
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = options['path'] or os.path.join(directory, 'channels.sqlite3')
+
+            for name in ('inmemory', 'sqlite'):
+                layer = _make_layer(name, path, capacity)
+                send_time, total_time = asyncio.run(
+                    _run_local(layer, members, messages, payload)
+                )
+                self._report(
+                    f'{name} (1 proces)', members, messages, send_time, total_time
+                )
+
+            if options['processes']:
+                self._run_processes(
+                    path, options['processes'], members, messages, payload, capacity
+                )
+
+    def _run_processes(self, path, processes, members, messages, payload, capacity):
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        per_process = max(1, members // processes)
+        workers = []
+        for _ in range(processes):
+            ready = context.Event()
+            worker = context.Process(
+                target=_receiver_process,
+                args=(path, per_process, messages, capacity, ready, results)
+            )
+            worker.start()
+            ready.wait()
+            workers.append(worker)
+
+        started_wall = time.time()
+        send_time = asyncio.run(_send_remote(path, messages, payload))
+        finished_wall = max(results.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+
+        self._report(
+            f'sqlite ({processes} procesy odbiorców)', per_process * processes,
+            messages, send_time, finished_wall - started_wall
+        )
+
+    def _report(self, name, members, messages, send_time, total_time):
+        deliveries = members * messages
+        self.stdout.write(
+            f'{name}: {messages} x group_send do {members} kanałów - '
+            f'wysyłanie {messages / send_time:,.0f} wiad./s, '
+            f'dostarczenie {deliveries / total_time:,.0f} wiad./s '
+            f'({total_time * 1000:.0f} ms)'
+        )
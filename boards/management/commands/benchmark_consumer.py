@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from boards.models import Board
+from boards.routing import websocket_urlpatterns
+
+OPERATIONS = ('create', 'update', 'delete')
+
+# Benchmark mierzy zapis do bazy - bez bufora zapisów i limitów wiadomości
+BENCHMARK_SETTINGS = {
+    'WRITE_BEHIND_ENABLED': False,
+    'BROADCAST_BATCHING': False,
+    'INBOUND_MESSAGE_RATE': 0,
+    'INBOUND_BYTE_RATE': 0,
+    'BOARD_MESSAGE_RATE': 0,
+    'BOARD_BYTE_RATE': 0,
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(fraction * (len(values) - 1)))]
+
+
+async def _wait_for(communicator, matches):
+    """
+    Pierwsza wiadomość spełniająca warunek - pozostałe (zdarzenia innych
+    klientów) są pomijane.
+    """
+    while True:
+        message = await communicator.receive_json_from(timeout=30)
+        if matches(message):
+            return message
+
+
+async def _timed(communicator, message, matches, latencies):
+    started = time.perf_counter()
+    await communicator.send_json_to(message)
+    reply = await _wait_for(communicator, matches)
+    latencies.append(time.perf_counter() - started)
+    return reply
+
+
+async def _client(application, board_id, index, operations, latencies):
+    """Jeden klient: tworzy, przesuwa i usuwa elementy, czekając na rozgłoszenie"""
+    communicator = WebsocketCommunicator(application, f'/ws/boards/{board_id}/')
+    connected, _ = await communicator.connect()
+    if not connected:
+        raise RuntimeError('Nie udało się połączyć z konsumentem tablicy')
+
+    ids = []
+    for number in range(operations):
+        tag = f'{index}-{number}'
+        reply = await _timed(communicator, {
+            'action': 'create_element',
+            'element': {
+                'element_type': 'shape', 'position_x': number,
+                'properties': {'benchmark': tag},
+            },
+        }, lambda message, tag=tag: (
+            message.get('action') == 'create_element'
+            and message['element'].get('properties', {}).get('benchmark') == tag
+        ), latencies['create'])
+        ids.append(reply['element']['id'])
+
+    for element_id in ids:
+        await _timed(communicator, {
+            'action': 'update_element',
+            'element': {'id': element_id, 'position_y': index},
+        }, lambda message, element_id=element_id: (
+            message.get('action') == 'update_element'
+            and message['element'].get('id') == element_id
+        ), latencies['update'])
+
+    for element_id in ids:
+        await _timed(communicator, {
+            'action': 'delete_element', 'element_id': element_id,
+        }, lambda message, element_id=element_id: (
+            message.get('action') == 'delete_element'
+            and message.get('element_id') == element_id
+        ), latencies['delete'])
+
+    await communicator.disconnect()
+
+
+async def _run(board_id, clients, operations):
+    application = URLRouter(websocket_urlpatterns)
+    latencies = {name: [] for name in OPERATIONS}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _client(application, board_id, index, operations, latencies)
+        for index in range(clients)
+    ))
+    return latencies, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        'Mierzy opóźnienia operacji BoardConsumer (p50/p99) przy wspólnym wątku bazy '
+        'i przy puli DB_EXECUTOR_WORKERS wątków'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clients', type=int, default=8, help='Liczba jednoczesnych połączeń'
+        )
+        parser.add_argument(
+            '--operations', type=int, default=50, help='Liczba elementów na połączenie'
+        )
+        parser.add_argument(
+            '--workers', type=int, nargs='+', default=[0, 4],
+            help='Warianty DB_EXECUTOR_WORKERS do porównania '
+                 '(0 - wspólny wątek Channels)'
+        )
+
+    def handle(self, *args, **options):
+        clients, operations = options['clients'], options['operations']
+        for workers in options['workers']:
+            overrides = {**BENCHMARK_SETTINGS, 'DB_EXECUTOR_WORKERS': workers}
+            board = Board.objects.create(title='benchmark_consumer')
+            try:
+                boards = {**getattr(settings, 'BOARDS', {}), **overrides}
+                with override_settings(BOARDS=boards):
+                    latencies, total = asyncio.run(_run(board.id, clients, operations))
+            finally:
+                board.delete()
+            self._report(workers, clients, latencies, total)
+
+    def _report(self, workers, clients, latencies, total):
+        name = f'pula {workers} wątków' if workers else 'wspólny wątek'
+        count = sum(len(values) for values in latencies.values())
+        self.stdout.write(
+            f'{name}, {clients} połączeń: {count / total:,.0f} operacji/s'
+        )
+        for operation in OPERATIONS:
+            values = latencies[operation]
+            self.stdout.write(
+                f'  {operation}: p50 {percentile(values, 0.5) * 1000:.1f} ms, '
+                f'p99 {percentile(values, 0.99) * 1000:.1f} ms ({len(values)} operacji)'
+            )
@@ -0,0 +1,144 @@
+import multiprocessing
+import queue
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from boards.conf import board_setting
+
+# Modele importowane są w funkcjach - procesy potomne importują ten moduł
+# przed django.setup()
+
+# Domyślne zachowanie SQLite - punkt odniesienia dla SQLITE_PRAGMAS
+SQLITE_DEFAULTS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(fraction * (len(values) - 1)))]
+
+
+def _use_pragmas(pragmas):
+    from django.conf import settings
+
+    settings.BOARDS = {**getattr(settings, 'BOARDS', {}), 'SQLITE_PRAGMAS': pragmas}
+    connection.close()
+
+
+def _write(board_id, number):
+    """
+    Zapis jak w BoardConsumer: nowy element i jego aktualizacja, każdy z wpisem
+    w dzienniku zmian.
+    """
+    from boards.models import Board, Element
+
+    started = time.perf_counter()
+    with transaction.atomic():
+        element = Element.objects.create(
+            board_id=board_id, element_type='shape', position_x=number
+        )
+        Board.register_change(board_id, [{
+            'action': 'create_element',
+            'element': {'id': element.id, 'position_x': number},
+        }])
+    with transaction.atomic():
+        Element.objects.filter(id=element.id).update(position_y=number)
+        Board.register_change(board_id, [{
+            'action': 'update_element',
+            'element': {'id': element.id, 'position_y': number},
+        }])
+    return time.perf_counter() - started
+
+
+def _writer_process(pragmas, board_id, writes, ready, start, results):
+    """Proces piszący do tej samej tablicy - zwraca czasy zapisów i liczbę błędów"""
+    import django
+
+    django.setup()
+    _use_pragmas(pragmas)
+    latencies, errors = [], 0
+    ready.put(True)
+    start.wait()
+    for number in range(writes):
+        try:
+            latencies.append(_write(board_id, number))
+        except Exception:
+            errors += 1
+    connection.close()
+    results.put((latencies, errors))
+
+
+class Command(BaseCommand):
+    help = (
+        'Mierzy przepustowość zapisów do bazy z kilku procesów naraz '
+        '(z SQLITE_PRAGMAS i bez)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=4, help='Liczba procesów piszących'
+        )
+        parser.add_argument(
+            '--writes', type=int, default=200, help='Liczba zapisów na proces'
+        )
+
+    def handle(self, *args, **options):
+        from boards.models import Board
+
+        variants = [('SQLITE_PRAGMAS', board_setting('SQLITE_PRAGMAS'))]
+        if connection.vendor == 'sqlite':
+            variants.insert(0, ('domyślne SQLite', SQLITE_DEFAULTS))
+
+        for name, pragmas in variants:
+            # Tryb dziennika zmieniamy, zanim procesy otworzą swoje połączenia
+            _use_pragmas(pragmas)
+            board = Board.objects.create(title='benchmark_db_writes')
+            try:
+                latencies, errors, total = self._run(
+                    pragmas, board.id, options['processes'], options['writes']
+                )
+            finally:
+                board.delete()
+            self._report(name, options['processes'], latencies, errors, total)
+
+    def _run(self, pragmas, board_id, processes, writes):
+        context = multiprocessing.get_context('spawn')
+        ready, start, results = context.Queue(), context.Event(), context.Queue()
+        args = (pragmas, board_id, writes, ready, start, results)
+        workers = [
+            context.Process(target=_writer_process, args=args) for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        # Wszystkie procesy zaczynają pisać naraz, po uruchomieniu Django
+        try:
+            for _ in workers:
+                ready.get(timeout=60)
+        except queue.Empty as error:
+            for worker in workers:
+                worker.terminate()
+            raise CommandError('Procesy piszące nie wystartowały') from error
+
+        started = time.perf_counter()
+        start.set()
+        latencies, errors = [], 0
+        for _ in workers:
+            process_latencies, process_errors = results.get()
+            latencies += process_latencies
+            errors += process_errors
+        total = time.perf_counter() - started
+        for worker in workers:
+            worker.join()
+        return latencies, errors, total
+
+    def _report(self, name, processes, latencies, errors, total):
+        line = f'{name}, {processes} procesy: {len(latencies) / total:,.0f} zapisów/s'
+        if latencies:
+            line += (
+                f', p50 {percentile(latencies, 0.5) * 1000:.1f} ms'
+                f', p99 {percentile(latencies, 0.99) * 1000:.1f} ms'
+            )
+        if errors:
+            line += f', błędy blokady: {errors}'
+        self.stdout.write(line)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from boards.models import Board
+
+
+class Command(BaseCommand):
+    help = 'Odbudowuje zapisany stan (serialized_state) tablic'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'board_ids', nargs='*', type=int,
+            help='Identyfikatory tablic (domyślnie wszystkie)'
+        )
+        parser.add_argument(
+            '--stale-only', action='store_true',
+            help='Odbuduj tylko tablice bez aktualnego stanu'
+        )
+
+    def handle(self, *args, **options):
+        boards = Board.objects.order_by('id')
+        if options['board_ids']:
+            boards = boards.filter(id__in=options['board_ids'])
+        if options['stale_only']:
+            boards = boards.filter(serialized_state__isnull=True)
+
+        rebuilt = 0
+        for board in boards.defer('serialized_state').iterator():
+            board.rebuild_snapshot()
+            rebuilt += 1
+            self.stdout.write(
+                f'Tablica {board.id} (wersja {board.version}) - odbudowano'
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Odbudowano stan {rebuilt} tablic'))
@@ -0,0 +1,116 @@
+import asyncio
+import itertools
+
+from django.core.management.base import BaseCommand, CommandError
+
+from boards.conf import board_setting
+from boards.sharding import board_shard, path_board_id
+
+# Maksymalny rozmiar nagłówków pierwszego żądania połączenia
+MAX_HEAD = 64 * 1024
+
+
+def _address(value):
+    host, _, port = value.rpartition(':')
+    if not host or not port.isdigit():
+        raise CommandError(f'Niepoprawny adres: {value} (oczekiwano host:port)')
+    return host, int(port)
+
+
+async def _pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+class ShardProxy:
+    """
+    Pośrednik TCP kierujący połączenia do procesów serwera.
+
+    Połączenia WebSocket do ws/boards/<id>/ trafiają do procesu wskazanego
+    przez board_shard, pozostałe (HTTP) - kolejno do wszystkich procesów.
+    O wyborze decyduje pierwsze żądanie połączenia; dalej bajty są tylko
+    przepisywane w obie strony.
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+        self._round_robin = itertools.cycle(range(len(backends)))
+
+    def choose(self, path):
+        board_id = path_board_id(path)
+        if board_id is not None:
+            return board_shard(board_id, len(self.backends))
+        return next(self._round_robin)
+
+    async def handle(self, client_reader, client_writer):
+        try:
+            head = await client_reader.readuntil(b'\r\n\r\n')
+        except (
+            asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError
+        ):
+            client_writer.close()
+            return
+
+        # Linia żądania: GET /ws/boards/12/ HTTP/1.1
+        parts = head.split(b'\r\n', 1)[0].split(b' ')
+        path = parts[1].decode('latin-1') if len(parts) > 1 else ''
+        host, port = self.backends[self.choose(path)]
+        try:
+            backend_reader, backend_writer = await asyncio.open_connection(host, port)
+        except OSError:
+            client_writer.write(
+                b'HTTP/1.1 502 Bad Gateway\r\n'
+                b'Content-Length: 0\r\nConnection: close\r\n\r\n'
+            )
+            client_writer.close()
+            return
+
+        backend_writer.write(head)
+        await asyncio.gather(
+            _pipe(client_reader, backend_writer),
+            _pipe(backend_reader, client_writer),
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        'Serwer pośredniczący kierujący połączenia tablicy '
+        'zawsze do tego samego procesu'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--listen', default='127.0.0.1:8000', help='Adres nasłuchiwania host:port'
+        )
+        parser.add_argument(
+            '--backend', action='append', required=True,
+            help='Adres procesu serwera host:port (kolejność = numer BOARD_SHARD)'
+        )
+
+    def handle(self, *args, **options):
+        backends = [_address(value) for value in options['backend']]
+        shard_count = board_setting('SHARD_COUNT')
+        if len(backends) != shard_count:
+            self.stderr.write(
+                f'Uwaga: {len(backends)} procesów, a SHARD_COUNT = {shard_count} - '
+                f'procesy będą zgłaszać połączenia do nie swoich tablic'
+            )
+        asyncio.run(self._serve(_address(options['listen']), ShardProxy(backends)))
+
+    async def _serve(self, listen, proxy):
+        server = await asyncio.start_server(proxy.handle, *listen, limit=MAX_HEAD)
+        self.stdout.write(
+            f'Nasłuchiwanie na {listen[0]}:{listen[1]}, '
+            f'procesów: {len(proxy.backends)}'
+        )
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0002_add_path_field'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='serialized_state',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0003_board_snapshot_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoardChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveBigIntegerField()),
+                ('action', models.CharField(max_length=32)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('board', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='boards.board')),
+            ],
+            options={
+                'unique_together': {('board', 'seq')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+from boards.spatial import (
+    rtree_create_statements,
+    rtree_drop_statements,
+    rtree_supported,
+)
+
+
+def create_rtree(apps, schema_editor):
+    # Indeks R*Tree jest dostępny tylko w SQLite z modułem rtree - pozostałe bazy
+    # korzystają z wyrażeń SQL (spatial.filter_in_bbox)
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or not rtree_supported(connection):
+        return
+    for statement in rtree_create_statements():
+        schema_editor.execute(statement)
+
+
+def drop_rtree(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in rtree_drop_statements():
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0004_boardchange'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_rtree, drop_rtree),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0005_element_rtree'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='element',
+            name='points',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0006_element_points'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='board',
+            index=models.Index(
+                fields=['updated_at', 'id'], name='board_updated_at_idx'
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0007_board_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='element',
+            index=models.Index(
+                fields=['board', 'z_index', 'id'], name='element_board_z_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='element',
+            index=models.Index(
+                fields=['board', 'updated_at'], name='element_board_updated_idx'
+            ),
+        ),
+    ]
@@ -1,106 +1,398 @@
 # Zastąp całą zawartość pliku boards/models.py
 
-from django.db import models
+import time
+
+from django.db import models, transaction
+from django.utils import timezone
+
+from . import codec
+from .conf import board_setting
+from .paths import compact_element_data, element_svg_path
+
+# Pola elementu przenoszone w eksporcie/imporcie JSON wraz z wartościami domyślnymi
+ELEMENT_DEFAULTS = {
+    'element_type': '',
+    'content': '',
+    'path': '',
+    'points': None,
+    'position_x': 0,
+    'position_y': 0,
+    'width': 100,
+    'height': 100,
+    'rotation': 0,
+    'z_index': 0,
+    'properties': {},
+}
+ELEMENT_DATA_FIELDS = tuple(ELEMENT_DEFAULTS)
+
+# Klucz zmian elementu niosący łatki właściwości (JSON Merge Patch)
+# zamiast całego obiektu
+PROPERTIES_PATCH = 'properties_patch'
+
+
+def elapsed_ms(started):
+    """Milisekundy od chwili started (wartość time.perf_counter)"""
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+def element_field_values(element_data):
+    """Wartości pól nowego elementu z danych JSON, uzupełnione domyślnymi"""
+    values = {
+        field: element_data.get(field, default)
+        for field, default in ELEMENT_DEFAULTS.items()
+    }
+    if values['properties'] is ELEMENT_DEFAULTS['properties']:
+        values['properties'] = {}
+    return values
+
+
+def apply_merge_patch(target, patch):
+    """
+    Zastosuj łatkę w stylu JSON Merge Patch (RFC 7396) do słownika właściwości.
+
+    Klucze z wartością None są usuwane, zagnieżdżone słowniki są scalane
+    rekurencyjnie, pozostałe wartości nadpisywane. Zwraca nowy słownik.
+    """
+    if not isinstance(patch, dict):
+        return patch
+
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        elif isinstance(value, dict):
+            result[key] = apply_merge_patch(result.get(key), value)
+        else:
+            result[key] = value
+    return result
+
+
+def element_export_data(element):
+    """Element w postaci eksportu tablicy (rysunki z punktami jako ścieżka SVG)"""
+    return {
+        'id': element.id,
+        'element_type': element.element_type,
+        'content': element.content,
+        'path': element_svg_path(element),
+        'position_x': element.position_x,
+        'position_y': element.position_y,
+        'width': element.width,
+        'height': element.height,
+        'rotation': element.rotation,
+        'z_index': element.z_index,
+        'properties': element.properties
+    }
+
+
+def coerce_element_id(value):
+    """Identyfikatory z JSONa mogą przyjść jako tekst - sprowadź je do int"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
 class Board(models.Model):
     title = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Zapisany stan tablicy (JSON)
     serialized_state = models.TextField(blank=True, null=True)
+    # Podbijana przy każdej zmianie tablicy
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Lista tablic stronicowana kursorem po updated_at
+            models.Index(fields=['updated_at', 'id'], name='board_updated_at_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    # Pola tablicy, których zmiana trafia do dziennika zmian (update_board)
+    TRACKED_FIELDS = ('title',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._saved_values = self._tracked_values()
+
+    def _tracked_values(self):
+        # __dict__ zamiast atrybutów - odczyt pola odroczonego (only())
+        # wykonałby zapytanie
+        return {
+            name: self.__dict__[name]
+            for name in self.TRACKED_FIELDS if name in self.__dict__
+        }
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        fields = kwargs.get('fields')
+        for name, value in self._tracked_values().items():
+            if fields is None or name in fields:
+                self._saved_values[name] = value
+
+    def changed_fields(self):
+        """Śledzone pola zmienione od odczytu z bazy (lub ostatniego zapisu)"""
+        current = self._tracked_values()
+        saved = self._saved_values
+        return [
+            name for name in self.TRACKED_FIELDS
+            if name in current and (name not in saved or current[name] != saved[name])
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            self._saved_values = self._tracked_values()
+            return
+
+        update_fields = kwargs.get('update_fields')
+        changed = [
+            name for name in self.changed_fields()
+            if update_fields is None or name in update_fields
+        ]
+        if not changed and update_fields is None:
+            # Nic się nie zmieniło - bez zapisu, nowej wersji i unieważniania stanu
+            return
+
+        # Wersję podbija wyłącznie register_change, a zapisany stan unieważnia ona albo
+        # rebuild_snapshot - nie nadpisujemy ich wartościami z pamięci
+        skipped = ('version', 'serialized_state')
+        if update_fields is None:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped
+            ]
+        kwargs['update_fields'] = [
+            name for name in update_fields if name not in skipped
+        ]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if changed:
+                self.serialized_state = None
+                values = {name: getattr(self, name) for name in changed}
+                self.version = Board.register_change(self.pk, [
+                    {'action': 'update_board', 'board': values}
+                ])
+        self._saved_values = self._tracked_values()
+
+    @classmethod
+    def register_change(cls, board_id, changes):
+        """
+        Odnotuj zmiany tablicy: podbij wersję, unieważnij zapisany stan
+        i dopisz zmiany do dziennika (BoardChange).
+
+        changes to lista wiadomości w formacie WebSocket (action, element,
+        element_id...) - każda dostaje kolejny numer sekwencyjny. Wywoływane
+        po zapisie zmian, w tej samej transakcji - dzięki temu odbudowa stanu
+        nie utrwali dokumentu sprzed zmiany. Zwraca nową wersję tablicy.
+        """
+        count = len(changes)
+        with transaction.atomic():
+            cls.objects.filter(id=board_id).update(
+                serialized_state=None,
+                version=models.F('version') + count,
+                updated_at=timezone.now()
+            )
+            versions = cls.objects.filter(id=board_id).values_list('version', flat=True)
+            version = versions.first()
+            if version is None:
+                return None
+
+            first_seq = version - count + 1
+            BoardChange.objects.bulk_create([
+                BoardChange(
+                    board_id=board_id,
+                    seq=first_seq + offset,
+                    action=change['action'],
+                    data={
+                        key: value for key, value in change.items() if key != 'action'
+                    }
+                )
+                for offset, change in enumerate(changes)
+            ])
+            BoardChange.compact(board_id, version, previous_version=first_seq - 1)
+
+        return version
+
+    def get_snapshot(self):
+        """Zserializowany stan tablicy (tekst JSON) - budowany, gdy jest nieaktualny"""
+        if self.serialized_state:
+            return self.serialized_state
+        return self.rebuild_snapshot()
+
+    def rebuild_snapshot(self):
+        """Zbuduj stan tablicy od nowa i zapisz go, jeśli tablica się nie zmieniła"""
+        state = codec.dumps(self.serialize_to_json())
+        current = Board.objects.filter(id=self.id, version=self.version)
+        current.update(serialized_state=state)
+        self.serialized_state = state
+        return state
+
     def serialize_to_json(self):
         """Serializuj całą tablicę z jej elementami do JSONa"""
-        elements = self.elements.all()
-        elements_data = []
-
-        for element in elements:
-            element_data = {
-                'id': element.id,
-                'element_type': element.element_type,
-                'content': element.content,
-                'path': element.path,
-                'position_x': element.position_x,
-                'position_y': element.position_y,
-                'width': element.width,
-                'height': element.height,
-                'rotation': element.rotation,
-                'z_index': element.z_index,
-                'properties': element.properties
-            }
-            elements_data.append(element_data)
-
-        board_data = {
+        elements_data = [
+            element_export_data(element) for element in self.elements.all()
+        ]
+
+        board_data = self.export_header()
+        board_data['elements'] = elements_data
+        return board_data
+
+    def export_header(self):
+        """Dane tablicy bez elementów (nagłówek eksportu)"""
+        return {
             'id': self.id,
             'title': self.title,
-            'elements': elements_data,
-            'last_updated': self.updated_at.isoformat()
+            'last_updated': self.updated_at.isoformat(),
+            'version': self.version
         }
 
-        return board_data
-
     def update_from_json(self, data):
-        """Zaktualizuj tablicę i elementy z danych JSON"""
+        """
+        Zaktualizuj tablicę i elementy z danych JSON.
+
+        Zwraca raport bulk_upsert_elements albo None, jeśli dane nie mają elementów.
+        """
         # Aktualizuj właściwości tablicy
         if 'title' in data:
             self.title = data['title']
 
-        # Najpierw zapisz tablicę
-        self.save()
-
-        # Obsługa elementów
-        if 'elements' in data:
-            existing_element_ids = set(self.elements.values_list('id', flat=True))
-            updated_element_ids = set()
-
-            # Aktualizuj lub twórz elementy
-            for element_data in data['elements']:
-                element_id = element_data.get('id')
-
-                if element_id and Element.objects.filter(id=element_id, board=self).exists():
-                    # Aktualizacja istniejącego elementu
-                    element = Element.objects.get(id=element_id)
-
-                    # Aktualizacja pól
-                    element.element_type = element_data.get('element_type', element.element_type)
-                    element.content = element_data.get('content', element.content)
-                    element.path = element_data.get('path', element.path)
-                    element.position_x = element_data.get('position_x', element.position_x)
-                    element.position_y = element_data.get('position_y', element.position_y)
-                    element.width = element_data.get('width', element.width)
-                    element.height = element_data.get('height', element.height)
-                    element.rotation = element_data.get('rotation', element.rotation)
-                    element.z_index = element_data.get('z_index', element.z_index)
-                    element.properties = element_data.get('properties', element.properties)
-
-                    element.save()
-                    updated_element_ids.add(element.id)
-                else:
-                    # Tworzenie nowego elementu
-                    new_element = Element(
-                        board=self,
-                        element_type=element_data.get('element_type', ''),
-                        content=element_data.get('content', ''),
-                        path=element_data.get('path', ''),
-                        position_x=element_data.get('position_x', 0),
-                        position_y=element_data.get('position_y', 0),
-                        width=element_data.get('width', 100),
-                        height=element_data.get('height', 100),
-                        rotation=element_data.get('rotation', 0),
-                        z_index=element_data.get('z_index', 0),
-                        properties=element_data.get('properties', {})
-                    )
-                    new_element.save()
-                    updated_element_ids.add(new_element.id)
+        report = None
+        with transaction.atomic():
+            # Najpierw zapisz tablicę
+            self.save()
+
+            # Obsługa elementów - jeden zbiorczy upsert zamiast zapytań per element
+            if 'elements' in data:
+                report = self.bulk_upsert_elements(data['elements'])
+
+        return report
+
+    def bulk_upsert_elements(self, elements_data, delete_missing=True):
+        """
+        Zsynchronizuj elementy tablicy z listą słowników w jednej transakcji.
+
+        Istniejące wiersze są pobierane jednym zapytaniem do mapy id -> element,
+        a zmiany są aplikowane przez bulk_create, bulk_update (tylko dla pól,
+        które faktycznie się zmieniły) i jeden delete. Liczba zapytań nie zależy
+        od liczby elementów. Zwraca słownik z licznikami i czasami faz w ms.
+        """
+        timings = {}
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            rows = self.elements.only('id', 'board_id', *ELEMENT_DATA_FIELDS)
+            existing = {element.id: element for element in rows}
+            timings['prefetch'] = elapsed_ms(started)
+
+            report = self.upsert_element_batch(elements_data, existing, timings)
+            seen_ids = report.pop('seen_ids')
 
             # Usuń elementy, których nie ma już w danych
-            elements_to_delete = existing_element_ids - updated_element_ids
-            if elements_to_delete:
-                Element.objects.filter(id__in=elements_to_delete).delete()
+            phase = time.perf_counter()
+            deleted = 0
+            if delete_missing:
+                ids_to_delete = existing.keys() - seen_ids
+                if ids_to_delete:
+                    deleted, _ = Element.objects.filter(id__in=ids_to_delete).delete()
+            timings['delete'] = elapsed_ms(phase)
+
+            if report['created'] or report['updated'] or deleted:
+                # Import zmienia zbyt wiele naraz - klienci muszą pobrać całą tablicę
+                Board.register_change(self.id, [{'action': 'reset'}])
+
+        timings['total'] = elapsed_ms(started)
+
+        report['deleted'] = deleted
+        report['updated_fields'] = sorted(report['updated_fields'])
+        report['timings_ms'] = timings
+        return report
+
+    def upsert_element_batch(self, elements_data, existing=None, timings=None):
+        """
+        Utwórz lub zaktualizuj elementy z listy słowników (bez usuwania i bez
+        rejestrowania zmiany). existing to mapa id -> element - bez niej
+        pobierane są tylko elementy o id z tej listy. Czasy faz są dodawane
+        do słownika timings.
+        """
+        if timings is None:
+            timings = {}
+        if existing is None:
+            phase = time.perf_counter()
+            ids = {coerce_element_id(data.get('id')) for data in elements_data} - {None}
+            existing = {}
+            if ids:
+                rows = self.elements.filter(id__in=ids).only(
+                    'id', 'board_id', *ELEMENT_DATA_FIELDS
+                )
+                existing = {element.id: element for element in rows}
+            timings['prefetch'] = timings.get('prefetch', 0) + elapsed_ms(phase)
+
+        phase = time.perf_counter()
+        to_create = []
+        to_update = {}
+        changed_fields = set()
+        seen_ids = set()
+        unchanged = 0
+
+        for element_data in elements_data:
+            element = existing.get(coerce_element_id(element_data.get('id')))
+            if (
+                element is not None and element.points
+                and element_data.get('path') == element_svg_path(element)
+            ):
+                # Ścieżka z eksportu - ponowne uproszczenie mogłoby zmienić punkty
+                element_data = {
+                    key: value for key, value in element_data.items() if key != 'path'
+                }
+            # Ścieżki rysunków trafiają do bazy jako uproszczone punkty
+            element_data = compact_element_data(element_data)
+
+            if element is None:
+                # Tworzenie nowego elementu
+                values = element_field_values(element_data)
+                to_create.append(Element(board=self, **values))
+                continue
+
+            seen_ids.add(element.id)
+            element_changed = False
+            for field in ELEMENT_DATA_FIELDS:
+                if field not in element_data:
+                    continue
+                if getattr(element, field) != element_data[field]:
+                    setattr(element, field, element_data[field])
+                    changed_fields.add(field)
+                    element_changed = True
+
+            if element_changed:
+                to_update[element.id] = element
+            else:
+                unchanged += 1
+        timings['diff'] = timings.get('diff', 0) + elapsed_ms(phase)
+
+        phase = time.perf_counter()
+        if to_create:
+            Element.objects.bulk_create(to_create)
+        timings['create'] = timings.get('create', 0) + elapsed_ms(phase)
 
-        return self
+        phase = time.perf_counter()
+        if to_update:
+            now = timezone.now()
+            for element in to_update.values():
+                element.updated_at = now
+            Element.objects.bulk_update(
+                to_update.values(), sorted(changed_fields) + ['updated_at']
+            )
+        timings['update'] = timings.get('update', 0) + elapsed_ms(phase)
+
+        return {
+            'created': len(to_create),
+            'updated': len(to_update),
+            'unchanged': unchanged,
+            'updated_fields': changed_fields,
+            'seen_ids': seen_ids,
+        }
 
 class Element(models.Model):
     ELEMENT_TYPES = (
@@ -117,6 +409,8 @@ class Element(models.Model):
     content = models.TextField(blank=True, null=True)  # Dla tekstu
     image = models.ImageField(upload_to='board_images/', blank=True, null=True)  # Dla obrazów
     path = models.TextField(blank=True, null=True)  # Dla rysunków odręcznych - ścieżka SVG
+    # Dla rysunków odręcznych - zwarte punkty (paths.py)
+    points = models.BinaryField(blank=True, null=True)
     position_x = models.FloatField(default=0)
     position_y = models.FloatField(default=0)
     width = models.FloatField(default=100)
@@ -127,5 +421,87 @@ class Element(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Elementy tablicy w kolejności rysowania
+            # (listy, eksport, stronicowanie po kluczu)
+            models.Index(fields=['board', 'z_index', 'id'], name='element_board_z_idx'),
+            # Ostatnio zmienione elementy tablicy
+            models.Index(
+                fields=['board', 'updated_at'], name='element_board_updated_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.element_type} on {self.board.title}"
+
+
+class BoardChange(models.Model):
+    """Dziennik zmian tablicy - pozwala klientom pobrać tylko to, co przegapili"""
+    board = models.ForeignKey(Board, on_delete=models.CASCADE, related_name='changes')
+    seq = models.PositiveBigIntegerField()  # Wersja tablicy po tej zmianie
+    action = models.CharField(max_length=32)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('board', 'seq')
+
     def __str__(self):
-        return f"{self.element_type} on {self.board.title}"
\ No newline at end of file
+        return f"{self.action} #{self.seq} on board {self.board_id}"
+
+    def to_message(self):
+        """Zmiana w formacie wiadomości WebSocket"""
+        return {'seq': self.seq, 'action': self.action, **self.data}
+
+    @classmethod
+    def compact(cls, board_id, version, previous_version=None):
+        """
+        Usuń najstarsze wpisy, zostawiając CHANGE_LOG_RETENTION ostatnich.
+
+        Sprzątanie odbywa się co CHANGE_LOG_COMPACT_EVERY wersji, a nie przy
+        każdej zmianie.
+        """
+        every = board_setting('CHANGE_LOG_COMPACT_EVERY')
+        if previous_version is not None and (
+            version // every == previous_version // every
+        ):
+            return 0
+        deleted, _ = cls.objects.filter(
+            board_id=board_id,
+            seq__lte=version - board_setting('CHANGE_LOG_RETENTION')
+        ).delete()
+        return deleted
+
+    @classmethod
+    def since(cls, board, seq):
+        """
+        Zwróć zmiany tablicy po wersji seq.
+
+        Jeśli dziennik nie sięga już tak daleko (został skrócony), w zakresie
+        jest zmiana wymagająca pełnego przeładowania albo klient zna wersję
+        nowszą niż tablica (np. odtworzoną z kopii), zwraca resync=True.
+        """
+        version = board.version
+        resync = {'version': version, 'resync': True, 'changes': [], 'has_more': False}
+        if seq > version:
+            return resync
+        if seq == version:
+            return {**resync, 'resync': False}
+
+        limit = board_setting('CHANGE_LOG_PAGE_SIZE')
+        entries = cls.objects.filter(board=board, seq__gt=seq).order_by('seq')
+        entries = list(entries[:limit + 1])
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+
+        compacted = not entries or entries[0].seq != seq + 1
+        if compacted or any(entry.action == 'reset' for entry in entries):
+            return resync
+
+        return {
+            'version': version,
+            'resync': False,
+            'changes': [entry.to_message() for entry in entries],
+            'has_more': has_more,
+        }
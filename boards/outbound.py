@@ -0,0 +1,191 @@
+"""
+Kolejki wysyłania do klientów WebSocket.
+
+Zdarzenia z grupy tablicy nie są wysyłane bezpośrednio w board_event, tylko
+trafiają do kolejki połączenia, którą opróżnia osobne zadanie. Wolny klient
+nie wstrzymuje więc odbioru z warstwy kanałów, a jego zaległości są
+ograniczone:
+
+- powyżej OUTBOUND_HIGH_WATER ramek kolejne update_element elementu, który
+  ma już aktualizację w kolejce, są z nią scalane (zostaje najnowszy stan),
+- po przekroczeniu OUTBOUND_MAX_QUEUE kolejka jest czyszczona, klient dostaje
+  resync_required i do jego wiadomości resume nie dostaje nowych zdarzeń -
+  przegapione zmiany pobierze z dziennika zmian.
+"""
+
+import asyncio
+import logging
+import struct
+from collections import deque
+
+from . import codec
+from .broadcast import merge_update
+from .conf import board_setting
+
+logger = logging.getLogger(__name__)
+
+# Kolejki połączeń obsługiwanych w tym procesie (board_id -> zbiór OutboundQueue)
+_queues = {}
+
+RESYNC_FRAME = codec.dumps({'action': 'resync_required'})
+
+
+def _decode(data):
+    return codec.decode_binary(data) if isinstance(data, bytes) else codec.loads(data)
+
+
+class OutboundQueue:
+    """Kolejka ramek do wysłania jednemu klientowi"""
+
+    def __init__(self, board_id, send, high_water=None, max_queue=None):
+        self.board_id = board_id
+        self.send = send
+        self.high_water = (
+            high_water if high_water is not None
+            else board_setting('OUTBOUND_HIGH_WATER')
+        )
+        self.max_queue = (
+            max_queue if max_queue is not None
+            else board_setting('OUTBOUND_MAX_QUEUE')
+        )
+        # Elementy kolejki: [ramka (tekst lub bajty), id aktualizowanego elementu/None]
+        self.items = deque()
+        self.stats = {
+            'sent': 0, 'coalesced': 0, 'dropped': 0, 'resyncs': 0, 'max_depth': 0,
+        }
+        # Czekające aktualizacje elementów (id -> element kolejki) do scalania
+        self._updates = {}
+        self._resync = False
+        self._task = None
+
+    def push(self, data, action=None, element_id=None):
+        """Dodaj ramkę do kolejki - action i element_id pozwalają scalać aktualizacje"""
+        if self._resync:
+            self.stats['dropped'] += 1
+            return
+
+        if action == 'delete_element':
+            # Po usunięciu nie wolno scalać z aktualizacjami sprzed niego
+            self._updates.pop(element_id, None)
+        key = element_id if action == 'update_element' else None
+
+        if key is not None and len(self.items) >= self.high_water:
+            queued = self._updates.get(key)
+            if queued is not None and self._coalesce(queued, data):
+                self.stats['coalesced'] += 1
+                return
+
+        if len(self.items) >= self.max_queue:
+            self.require_resync()
+            return
+
+        item = [data, key]
+        self.items.append(item)
+        if key is not None:
+            self._updates[key] = item
+        self.stats['max_depth'] = max(self.stats['max_depth'], len(self.items))
+        self._wake()
+
+    def _coalesce(self, item, data):
+        """Scal aktualizację z czekającą w kolejce (w miejscu) - False, gdy nie można"""
+        try:
+            queued, event = _decode(item[0]), _decode(data)
+        except (ValueError, struct.error):
+            return False
+        # Ramki zbiorcze (listy zdarzeń) nie są scalane
+        if not isinstance(queued, dict) or not isinstance(event, dict):
+            return False
+        element = dict(queued.get('element') or {})
+        if not merge_update(element, event.get('element') or {}):
+            return False
+
+        merged = {**queued, **event, 'element': element}
+        binary = codec.encode_binary(merged) if isinstance(item[0], bytes) else None
+        item[0] = binary if binary is not None else codec.dumps(merged)
+        return True
+
+    def require_resync(self):
+        """Porzuć zaległe ramki - klient musi nadrobić zmiany przez resume"""
+        self.stats['dropped'] += len(self.items)
+        self.stats['resyncs'] += 1
+        self.items.clear()
+        self._updates = {}
+        self.items.append([RESYNC_FRAME, None])
+        self._resync = True
+        self._wake()
+        logger.info(
+            'Klient tablicy %s nie nadąża - wymagana resynchronizacja', self.board_id
+        )
+
+    def resume(self, frame):
+        """
+        Wyślij odpowiedź na resume - od niej klient znowu dostaje bieżące zdarzenia.
+
+        Odpowiedź trafia do kolejki przed zdarzeniami odebranymi po odczycie
+        dziennika - te, które odpowiedź już zawiera, klient pomija po seq.
+        """
+        self._resync = False
+        self.push(frame)
+
+    def _wake(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._drain())
+
+    async def _drain(self):
+        try:
+            while self.items:
+                item = self.items.popleft()
+                if item[1] is not None and self._updates.get(item[1]) is item:
+                    del self._updates[item[1]]
+                if isinstance(item[0], bytes):
+                    await self.send(bytes_data=item[0])
+                else:
+                    await self.send(text_data=item[0])
+                self.stats['sent'] += 1
+        except Exception:
+            logger.exception('Błąd wysyłania do klienta tablicy %s', self.board_id)
+        finally:
+            self._task = None
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.items.clear()
+        self._updates = {}
+
+
+def open_queue(board_id, send):
+    """Utwórz kolejkę połączenia i zarejestruj ją w statystykach tablicy"""
+    queue = OutboundQueue(board_id, send)
+    _queues.setdefault(board_id, set()).add(queue)
+    return queue
+
+
+def close_queue(queue):
+    queue.close()
+    queues = _queues.get(queue.board_id)
+    if queues is not None:
+        queues.discard(queue)
+        if not queues:
+            del _queues[queue.board_id]
+
+
+def board_outbound_stats(board_id):
+    """Głębokość kolejek i liczniki połączeń tablicy w tym procesie"""
+    queues = _queues.get(board_id, ())
+    depths = [len(queue.items) for queue in queues]
+    stats = {
+        'connections': len(queues),
+        'queued': sum(depths),
+        'max_queued': max(depths, default=0),
+        'resyncing': sum(queue._resync for queue in queues),
+    }
+    for name in ('sent', 'coalesced', 'dropped', 'resyncs'):
+        stats[name] = sum(queue.stats[name] for queue in queues)
+    return stats
+
+
+def outbound_stats():
+    """Statystyki kolejek wszystkich tablic w tym procesie"""
+    return {board_id: board_outbound_stats(board_id) for board_id in _queues}
@@ -0,0 +1,108 @@
+"""
+Stronicowanie list REST.
+
+Obie listy są stronicowane tylko na życzenie (?page_size=N) - bez tego
+parametru zwracają pełną listę, jak dotąd, bo tego oczekuje frontend.
+"""
+
+import base64
+import binascii
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .conf import board_setting
+
+
+class BoardCursorPagination(CursorPagination):
+    """Lista tablic stronicowana kursorem (od ostatnio zmienionych)"""
+    ordering = ('-updated_at', '-id')
+    page_size = None
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+def encode_element_cursor(z_index, element_id):
+    raw = f'{z_index}:{element_id}'.encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_element_cursor(cursor):
+    """Klucz (z_index, id) ostatniego elementu poprzedniej strony"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+        z_index, element_id = raw.split(':')
+        return int(z_index), int(element_id)
+    except (UnicodeError, ValueError, binascii.Error) as error:
+        raise NotFound('Niepoprawny kursor') from error
+
+
+def after_element_key(queryset, key):
+    """Elementy położone w kolejności (z_index, id) za kluczem key"""
+    z_index, element_id = key
+    return queryset.filter(
+        Q(z_index__gt=z_index) | Q(z_index=z_index, id__gt=element_id)
+    )
+
+
+class ElementKeysetPagination(BasePagination):
+    """
+    Lista elementów stronicowana kluczem (z_index, id).
+
+    Następna strona zaczyna się warunkiem WHERE za ostatnim elementem
+    poprzedniej zamiast OFFSET - koszt strony nie rośnie z jej numerem,
+    a elementy o tym samym z_index (zwykle wszystkie) nie psują kursora.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        max_size = board_setting('ELEMENT_PAGE_MAX')
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+            if size > 0:
+                return min(size, max_size)
+        except (KeyError, ValueError):
+            pass
+        # Sam kursor (bez page_size) też oznacza stronicowanie
+        return max_size if self.cursor_query_param in request.query_params else None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.request = request
+        queryset = queryset.order_by('z_index', 'id')
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = after_element_key(queryset, decode_element_cursor(cursor))
+
+        # Jeden element więcej mówi, czy istnieje następna strona
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.next_key = (page[-1].z_index, page[-1].id) if self.has_next else None
+        return page
+
+    def get_next_link(self):
+        if self.next_key is None:
+            return None
+        url = self.request.build_absolute_uri()
+        cursor = encode_element_cursor(*self.next_key)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,358 @@
+"""
+Zwarty zapis rysunków odręcznych.
+
+Zamiast tekstu ścieżki SVG z tysiącami współrzędnych element typu path
+przechowuje w Element.points tablicę punktów: współrzędne są kwantowane
+(zaokrąglane do wielokrotności PATH_QUANTUM), zapisywane jako różnice
+względem poprzedniego punktu i kodowane jako liczby zmiennej długości
+(zigzag + LEB128). Przed zapisem ścieżka jest upraszczana algorytmem
+Ramera-Douglasa-Peuckera z tolerancją PATH_SIMPLIFY_TOLERANCE.
+
+Krzywe Béziera (Q, T, C, S - np. ze ścieżek PencilBrush Fabric.js) zapisywane
+są jako łamana przez punkty krzywej. Odczytana ścieżka (points_to_svg) składa
+się z samych odcinków - różni się od oryginału najwyżej o tolerancję
+uproszczenia i kwant, ale polecenia krzywych nie są odtwarzane.
+
+Format: u8 wersja, f32 kwant, potem pary varint (dx, dy). W JSON punkty
+przesyłane są jako base64, w binarnym podprotokole WebSocket - bez zmian.
+Ścieżka SVG budowana jest dopiero przy eksporcie (points_to_svg).
+"""
+
+import base64
+import binascii
+import math
+import re
+import struct
+
+from .conf import board_setting
+
+POINTS_FORMAT = 1
+_HEADER = struct.Struct('<Bf')
+
+# Liczba argumentów poleceń SVG
+_COMMAND_ARGS = {'M': 2, 'L': 2, 'T': 2, 'Q': 4, 'S': 4, 'C': 6, 'H': 1, 'V': 1, 'Z': 0}
+
+# Krzywe zamieniane są na łamaną z tylu odcinków - nadmiarowe punkty usuwa simplify
+CURVE_SEGMENTS = 8
+_TOKEN = re.compile(r'[A-Za-z]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+
+def _path_commands(path):
+    """Polecenia ścieżki [polecenie, liczby...] (z tekstu SVG albo tablicy Fabric.js)"""
+    if isinstance(path, (list, tuple)):
+        return [
+            list(command) for command in path
+            if isinstance(command, (list, tuple)) and command
+        ]
+
+    commands = []
+    for token in _TOKEN.findall(path):
+        if token.isalpha():
+            commands.append([token])
+        elif commands:
+            commands[-1].append(float(token))
+        else:
+            raise ValueError('Ścieżka musi zaczynać się od polecenia')
+    return commands
+
+
+def _curve_points(points, segments=CURVE_SEGMENTS):
+    """Punkty krzywej Béziera o punktach kontrolnych points (bez punktu początkowego)"""
+    result = []
+    for step in range(1, segments + 1):
+        t = step / segments
+        current = points
+        # Algorytm de Casteljau - działa dla krzywych kwadratowych i sześciennych
+        while len(current) > 1:
+            current = [
+                ((1 - t) * a[0] + t * b[0], (1 - t) * a[1] + t * b[1])
+                for a, b in zip(current[:-1], current[1:], strict=True)
+            ]
+        result.append(current[0])
+    return result
+
+
+def path_points(path):
+    """
+    Wyciągnij punkty z bezwzględnej ścieżki SVG lub tablicy poleceń Fabric.js.
+
+    Zwraca None dla ścieżek, których nie obsługujemy (polecenia względne,
+    łuki) - takie ścieżki zostają zapisane jako tekst.
+    """
+    try:
+        commands = _path_commands(path)
+    except ValueError:
+        return None
+
+    points = []
+    x = y = 0.0
+    # Ostatni punkt kontrolny krzywej ('Q' albo 'C', punkt) - do odbicia w T i S
+    control = None
+    for command in commands:
+        name, args = command[0], command[1:]
+        count = _COMMAND_ARGS.get(name)
+        if count is None:
+            return None
+        if count == 0:
+            control = None
+            continue
+        if len(args) % count or not args:
+            return None
+        try:
+            args = [float(value) for value in args]
+        except (TypeError, ValueError):
+            return None
+        # Powtórzone argumenty oznaczają kolejne segmenty tego samego polecenia
+        for offset in range(0, len(args), count):
+            segment = args[offset:offset + count]
+            if name in ('Q', 'T', 'C', 'S'):
+                start, end = (x, y), (segment[-2], segment[-1])
+                kind = 'Q' if name in ('Q', 'T') else 'C'
+                controls = [
+                    (segment[i], segment[i + 1]) for i in range(0, len(segment) - 2, 2)
+                ]
+                if name in ('T', 'S'):
+                    # Pierwszy punkt kontrolny to odbicie poprzedniego (albo początek)
+                    reflected = (
+                        (2 * x - control[1][0], 2 * y - control[1][1])
+                        if control is not None and control[0] == kind else start
+                    )
+                    controls.insert(0, reflected)
+                points.extend(_curve_points([start, *controls, end]))
+                control = (kind, controls[-1])
+                x, y = end
+                continue
+            if name == 'H':
+                x = segment[0]
+            elif name == 'V':
+                y = segment[0]
+            else:
+                x, y = segment
+            control = None
+            points.append((x, y))
+
+    finite = all(math.isfinite(value) for point in points for value in point)
+    if not points or not finite:
+        return None
+    return points
+
+
+def _segment_distance(point, start, end):
+    """Odległość punktu od odcinka start-end"""
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    length = dx * dx + dy * dy
+    if length == 0:
+        return math.hypot(point[0] - start[0], point[1] - start[1])
+    t = ((point[0] - start[0]) * dx + (point[1] - start[1]) * dy) / length
+    t = max(0.0, min(1.0, t))
+    return math.hypot(point[0] - start[0] - t * dx, point[1] - start[1] - t * dy)
+
+
+def simplify(points, tolerance):
+    """Uprość łamaną algorytmem Ramera-Douglasa-Peuckera (bez rekurencji)"""
+    if tolerance <= 0 or len(points) < 3:
+        return list(points)
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        index, max_distance = None, tolerance
+        for i in range(first + 1, last):
+            distance = _segment_distance(points[i], points[first], points[last])
+            if distance > max_distance:
+                index, max_distance = i, distance
+        if index is not None:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [point for point, kept in zip(points, keep, strict=True) if kept]
+
+
+# Największa kwantowana współrzędna - różnice kolejnych punktów mieszczą się w 64 bitach
+MAX_QUANTIZED = 2 ** 62
+
+
+def _write_varint(out, value):
+    # zigzag - małe liczby ujemne też zajmują mało bajtów
+    value = (value << 1) ^ (value >> 63)
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varints(data, offset):
+    values = []
+    value = shift = 0
+    for byte in data[offset:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append((value >> 1) ^ -(value & 1))
+        value = shift = 0
+    if shift:
+        raise ValueError('Niepełna liczba w danych punktów')
+    return values
+
+
+def encode_points(points, quantum=None):
+    """
+    Zakoduj punkty jako kwantowane różnice - zwraca bajty.
+
+    Współrzędne, których nie da się zapisać (|x / kwant| >= MAX_QUANTIZED,
+    nieskończoność), kończą się ValueError.
+    """
+    quantum = quantum if quantum is not None else board_setting('PATH_QUANTUM')
+    # Kwant zapisany w nagłówku jako float32 - liczymy na tej samej wartości co dekoder
+    (quantum,) = struct.unpack('<f', struct.pack('<f', quantum))
+    out = bytearray(_HEADER.pack(POINTS_FORMAT, quantum))
+    previous_x = previous_y = 0
+    for x, y in points:
+        try:
+            qx, qy = round(x / quantum), round(y / quantum)
+        except (OverflowError, ValueError) as error:
+            raise ValueError('Współrzędne punktu poza zakresem') from error
+        if abs(qx) >= MAX_QUANTIZED or abs(qy) >= MAX_QUANTIZED:
+            raise ValueError('Współrzędne punktu poza zakresem')
+        if (qx, qy) == (previous_x, previous_y) and len(out) > _HEADER.size:
+            continue  # punkty sklejone przez kwantowanie
+        _write_varint(out, qx - previous_x)
+        _write_varint(out, qy - previous_y)
+        previous_x, previous_y = qx, qy
+    return bytes(out)
+
+
+def decode_points(data):
+    """Odkoduj bajty z encode_points do listy punktów (x, y)"""
+    data = bytes(data)
+    version, quantum = _HEADER.unpack_from(data)
+    if version != POINTS_FORMAT:
+        raise ValueError(f'Nieznany format punktów: {version}')
+    values = _read_varints(data, _HEADER.size)
+    if len(values) % 2:
+        raise ValueError('Nieparzysta liczba współrzędnych')
+
+    points = []
+    x = y = 0
+    for dx, dy in zip(values[::2], values[1::2], strict=True):
+        x, y = x + dx, y + dy
+        points.append((x * quantum, y * quantum))
+    return points
+
+
+def _format_number(value):
+    text = f'{value:.4f}'.rstrip('0').rstrip('.')
+    return '0' if text in ('', '-0') else text
+
+
+def points_to_svg(points):
+    """Ścieżka SVG (łamana) z listy punktów"""
+    if not points:
+        return ''
+    commands = [f'M {_format_number(points[0][0])} {_format_number(points[0][1])}']
+    commands.extend(f'L {_format_number(x)} {_format_number(y)}' for x, y in points[1:])
+    if len(points) == 1:
+        # Pojedyncza kropka - odcinek zerowej długości, żeby była widoczna
+        commands.append(commands[0].replace('M', 'L', 1))
+    return ' '.join(commands)
+
+
+def points_to_text(data):
+    """Punkty w postaci do JSON (base64)"""
+    return base64.b64encode(bytes(data)).decode('ascii') if data is not None else None
+
+
+def points_from_text(text):
+    """Bajty punktów z base64 - None dla błędnych danych"""
+    try:
+        data = base64.b64decode(text, validate=True)
+        decode_points(data)
+    except (TypeError, ValueError, binascii.Error, struct.error):
+        return None
+    return data
+
+
+def parse_points(value):
+    """Punkty z wiadomości WebSocket ([[x, y], ...]) - None dla błędnych danych"""
+    if not isinstance(value, list):
+        return None
+    points = []
+    for point in value:
+        if not isinstance(point, (list, tuple)) or len(point) != 2:
+            return None
+        try:
+            x, y = float(point[0]), float(point[1])
+        except (TypeError, ValueError):
+            return None
+        if not (math.isfinite(x) and math.isfinite(y)):
+            return None
+        points.append((x, y))
+    return points
+
+
+def points_bounds(points):
+    """Ramka (min_x, min_y, max_x, max_y) punktów - None dla pustej listy"""
+    if not points:
+        return None
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def compact_points(points):
+    """Uprość i zakoduj listę punktów - None, jeśli współrzędnych nie da się zapisać"""
+    try:
+        return encode_points(simplify(points, board_setting('PATH_SIMPLIFY_TOLERANCE')))
+    except ValueError:
+        return None
+
+
+def compact_path(path):
+    """Uprość i zakoduj ścieżkę - None, jeśli ścieżki nie da się zapisać jako punktów"""
+    if not path:
+        return None
+    points = path_points(path)
+    if points is None:
+        return None
+    return compact_points(points)
+
+
+def compact_element_data(element_data):
+    """
+    Dane elementu z punktami zamiast tekstu ścieżki (do zapisu w bazie).
+
+    Punkty przesłane jako base64 są dekodowane (błędne kończą się
+    ValueError), a ścieżka elementu path zamieniana na punkty - jeśli się
+    da, inaczej zostaje tekst. Zwraca nowy słownik - wejście nie jest zmieniane.
+    """
+    if 'points' in element_data:
+        points = element_data['points']
+        if isinstance(points, str):
+            points = points_from_text(points)
+            if points is None:
+                raise ValueError('Niepoprawne dane punktów')
+        return {**element_data, 'points': points}
+
+    if element_data.get('element_type') != 'path':
+        return element_data
+    if not board_setting('PATH_COMPACT_ENABLED'):
+        return element_data
+
+    points = compact_path(element_data.get('path'))
+    if points is None:
+        return element_data
+    return {**element_data, 'path': None, 'points': points}
+
+
+def element_svg_path(element):
+    """Ścieżka SVG elementu do eksportu - zbudowana z punktów, jeśli je ma"""
+    if element.points:
+        try:
+            return points_to_svg(decode_points(element.points))
+        except (ValueError, struct.error):
+            pass
+    return element.path
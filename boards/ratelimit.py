@@ -0,0 +1,119 @@
+"""
+Limity wiadomości przychodzących z WebSocket.
+
+Każde połączenie ma kubełki żetonów (token bucket) na liczbę wiadomości
+i liczbę bajtów na sekundę, a dodatkowo wszystkie połączenia jednej
+tablicy w tym procesie dzielą wspólne kubełki. Pojemność kubełka to
+INBOUND_BURST sekund limitu - krótkie serie są przepuszczane.
+"""
+
+import time
+
+from .conf import board_setting
+
+# Wspólne kubełki tablic obsługiwanych w tym procesie (board_id -> BoardBuckets)
+_boards = {}
+
+
+class TokenBucket:
+    """Kubełek żetonów - rate żetonów na sekundę, najwyżej capacity naraz"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, amount, now):
+        self._refill(now)
+        return self.tokens >= amount
+
+    def take(self, amount):
+        self.tokens -= amount
+
+    def delay(self, amount, now):
+        """Za ile sekund będzie dostępne amount żetonów"""
+        self._refill(now)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+
+def _buckets(message_rate, byte_rate):
+    """Kubełki wiadomości i bajtów (0 wyłącza dany limit)"""
+    burst = board_setting('INBOUND_BURST')
+    buckets = []
+    if message_rate:
+        bucket = TokenBucket(message_rate, max(1.0, message_rate * burst))
+        buckets.append(('messages', bucket))
+    if byte_rate:
+        # Pojedyncza ramka o maksymalnym rozmiarze musi się zmieścić w kubełku
+        capacity = max(byte_rate * burst, board_setting('INBOUND_MAX_FRAME'))
+        buckets.append(('bytes', TokenBucket(byte_rate, capacity)))
+    return buckets
+
+
+class BoardBuckets:
+    def __init__(self):
+        self.buckets = _buckets(
+            board_setting('BOARD_MESSAGE_RATE'), board_setting('BOARD_BYTE_RATE')
+        )
+        self.connections = 0
+
+
+class InboundLimiter:
+    """Limity jednego połączenia razem ze wspólnymi limitami jego tablicy"""
+
+    def __init__(self, board_id):
+        self.board_id = board_id
+        board = _boards.get(board_id)
+        if board is None:
+            board = _boards[board_id] = BoardBuckets()
+        board.connections += 1
+        self.buckets = _buckets(
+            board_setting('INBOUND_MESSAGE_RATE'), board_setting('INBOUND_BYTE_RATE')
+        )
+        self.buckets += board.buckets
+        self.stats = {'allowed': 0, 'limited': 0}
+
+    def _amounts(self, size):
+        return [
+            (bucket, 1 if kind == 'messages' else size) for kind, bucket in self.buckets
+        ]
+
+    def allow(self, size):
+        """Czy wiadomość o rozmiarze size mieści się w limitach (zużywa wtedy żetony)"""
+        now = time.monotonic()
+        amounts = self._amounts(size)
+        # Żetony zużywamy dopiero, gdy wszystkie kubełki się zgadzają
+        if not all(bucket.available(amount, now) for bucket, amount in amounts):
+            self.stats['limited'] += 1
+            return False
+        for bucket, amount in amounts:
+            bucket.take(amount)
+        self.stats['allowed'] += 1
+        return True
+
+    def delay(self, size):
+        """Za ile sekund wiadomość o rozmiarze size zmieści się w limitach"""
+        now = time.monotonic()
+        delays = (bucket.delay(amount, now) for bucket, amount in self._amounts(size))
+        return max(delays, default=0.0)
+
+    def close(self):
+        board = _boards.get(self.board_id)
+        if board is None:
+            return
+        board.connections -= 1
+        if board.connections <= 0:
+            del _boards[self.board_id]
+
+
+def message_items(data):
+    """Liczba elementów (punktów rysunku, operacji batch) niesionych przez wiadomość"""
+    return sum(
+        len(data[key]) for key in ('points', 'operations')
+        if isinstance(data.get(key), list)
+    )
@@ -1,17 +1,162 @@
 # Zastąp zawartość pliku boards/serializers.py
 
+import math
+from contextlib import suppress
+
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Board, Element
+
+from .models import PROPERTIES_PATCH, Board, Element, apply_merge_patch
+from .paths import (
+    compact_element_data,
+    element_svg_path,
+    points_from_text,
+    points_to_text,
+)
+
+
+class PointsField(serializers.Field):
+    """Zwarte punkty rysunku (bajty w bazie) przesyłane w JSON jako base64"""
+
+    def to_representation(self, value):
+        return points_to_text(value)
+
+    def to_internal_value(self, data):
+        points = points_from_text(data)
+        if points is None:
+            raise serializers.ValidationError('Niepoprawne dane punktów')
+        return points
+
+class BoardField(serializers.PrimaryKeyRelatedField):
+    """
+    Tablica elementu. Przy zapisie zbiorczym tablice są pobierane raz dla
+    całej listy (context['boards']) zamiast osobnym zapytaniem dla każdego elementu.
+    """
+
+    def to_internal_value(self, data):
+        boards = self.context.get('boards')
+        if boards is None:
+            return super().to_internal_value(data)
+        try:
+            board = boards.get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if board is None:
+            self.fail('does_not_exist', pk_value=data)
+        return board
+
+
+def _with_properties_patch(validated_data):
+    """Dane nowego elementu z nałożoną łatką właściwości"""
+    patch = validated_data.pop(PROPERTIES_PATCH, None)
+    if patch is not None:
+        properties = validated_data.get('properties', {})
+        validated_data['properties'] = apply_merge_patch(properties, patch)
+    return validated_data
+
+
+def apply_element_fields(instance, validated_data):
+    """Ustaw w elemencie zmienione pola (bez zapisu) - zwraca listę zmienionych pól"""
+    patch = validated_data.pop(PROPERTIES_PATCH, None)
+    changed_fields = []
+
+    if 'path' in validated_data and 'points' not in validated_data:
+        # Nowa ścieżka zastępuje zapisane punkty - i sama trafia do punktów,
+        # jak przy tworzeniu
+        element_type = validated_data.get('element_type', instance.element_type)
+        validated_data = compact_element_data(
+            {**validated_data, 'element_type': element_type}
+        )
+        validated_data.setdefault('points', None)
+
+    for field, value in validated_data.items():
+        model_field = instance._meta.get_field(field)
+        current = getattr(instance, model_field.attname)
+        new = value.pk if model_field.is_relation and value is not None else value
+        if current != new:
+            setattr(instance, field, value)
+            changed_fields.append(field)
+
+    if patch is not None:
+        instance.properties = apply_merge_patch(instance.properties, patch)
+        if 'properties' not in changed_fields:
+            changed_fields.append('properties')
+    return changed_fields
+
+
+class ElementListSerializer(serializers.ListSerializer):
+    """Zapis listy elementów jednym bulk_create / bulk_update"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            board_ids = set()
+            for item in data:
+                with suppress(TypeError, ValueError, KeyError):
+                    board_ids.add(int(item['board']))
+            self.context['boards'] = (
+                Board.objects.in_bulk(board_ids) if board_ids else {}
+            )
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        elements = [
+            Element(**compact_element_data(_with_properties_patch(item)))
+            for item in validated_data
+        ]
+        return Element.objects.bulk_create(elements)
+
+    def update(self, instances, validated_data):
+        """instances i validated_data to listy w tej samej kolejności"""
+        now = timezone.now()
+        fields = set()
+        changed = []
+        for instance, item in zip(instances, validated_data, strict=True):
+            changed_fields = apply_element_fields(instance, item)
+            if changed_fields:
+                instance.updated_at = now
+                fields.update(changed_fields)
+                changed.append(instance)
+        if changed:
+            Element.objects.bulk_update(changed, sorted(fields) + ['updated_at'])
+        return instances
+
 
 class ElementSerializer(serializers.ModelSerializer):
+    board = BoardField(queryset=Board.objects.all())
+    # Zmiana części właściwości (JSON Merge Patch) zamiast przesyłania całego obiektu
+    properties_patch = serializers.DictField(write_only=True, required=False)
+    points = PointsField(required=False, allow_null=True)
+
     class Meta:
         model = Element
         fields = [
-            'id', 'board', 'element_type', 'content', 'path', 
+            'id', 'board', 'element_type', 'content', 'path', 'points',
             'position_x', 'position_y', 'width', 'height', 
-            'rotation', 'z_index', 'properties', 'created_at', 'updated_at'
+            'rotation', 'z_index', 'properties', 'created_at', 'updated_at',
+            'properties_patch'
         ]
         read_only_fields = ['created_at', 'updated_at']
+        list_serializer_class = ElementListSerializer
+
+    def create(self, validated_data):
+        validated_data = _with_properties_patch(validated_data)
+        return super().create(compact_element_data(validated_data))
+
+    def update(self, instance, validated_data):
+        """Zapisz tylko pola, które faktycznie się zmieniły, zamiast całego wiersza"""
+        changed_fields = apply_element_fields(instance, validated_data)
+        if changed_fields:
+            instance.save(update_fields=changed_fields + ['updated_at'])
+        return instance
+
+def requested_fields(request):
+    """Pola wybrane parametrem ?fields=a,b,c (tylko przy odczycie) - None: wszystkie"""
+    if request is None or request.method != 'GET':
+        return None
+    names = request.query_params.get('fields')
+    if not names:
+        return None
+    return {name.strip() for name in names.split(',') if name.strip()}
 
 class BoardSerializer(serializers.ModelSerializer):
     elements_count = serializers.SerializerMethodField()
@@ -22,11 +167,25 @@ class BoardSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'created_at', 'updated_at', 'elements_count', 'serialized_state']
         read_only_fields = ['created_at', 'updated_at']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # ?fields= - odpowiedź tylko z wybranymi polami
+        fields = requested_fields(self.context.get('request'))
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
     def get_elements_count(self, obj):
-        return obj.elements.count()
+        # Lista tablic liczy elementy w głównym zapytaniu (annotate) - bez zapytania
+        # na każdą tablicę
+        count = getattr(obj, 'annotated_elements_count', None)
+        return count if count is not None else obj.elements.count()
 
 # Serializator eksportu elementów dla bardziej szczegółowego eksportu
 class ElementExportSerializer(serializers.ModelSerializer):
+    # Rysunki zapisane jako punkty eksportowane są jako ścieżka SVG
+    path = serializers.SerializerMethodField()
+
     class Meta:
         model = Element
         fields = [
@@ -35,10 +194,34 @@ class ElementExportSerializer(serializers.ModelSerializer):
             'rotation', 'z_index', 'properties'
         ]
 
+    def get_path(self, obj):
+        return element_svg_path(obj)
+
 # Serializator eksportu tablicy dla bardziej szczegółowego eksportu
 class BoardExportSerializer(serializers.ModelSerializer):
     elements = ElementExportSerializer(many=True, read_only=True)
 
     class Meta:
         model = Board
-        fields = ['id', 'title', 'elements', 'created_at', 'updated_at']
\ No newline at end of file
+        fields = ['id', 'title', 'elements', 'created_at', 'updated_at']
+
+class FiniteFloatField(serializers.FloatField):
+    """Liczba zmiennoprzecinkowa bez NaN i nieskończoności"""
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if not math.isfinite(value):
+            raise serializers.ValidationError('Wartość musi być skończoną liczbą')
+        return value
+
+# Parametry wstawienia szablonu (BoardViewSet.apply_template)
+class ApplyTemplateSerializer(serializers.Serializer):
+    template = serializers.IntegerField(min_value=1, max_value=2 ** 63 - 1)
+    x = FiniteFloatField(required=False, allow_null=True)
+    y = FiniteFloatField(required=False, allow_null=True)
+    scale = FiniteFloatField(required=False, default=1.0)
+
+    def validate_scale(self, value):
+        if not 0 < value < 1000:
+            raise serializers.ValidationError('Niepoprawna skala')
+        return value
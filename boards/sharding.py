@@ -0,0 +1,91 @@
+"""
+Przydział tablic do procesów serwera (sharding po board_id).
+
+Przy kilku procesach Daphne/Uvicorn wszystkie połączenia WebSocket jednej
+tablicy powinny trafiać do tego samego procesu - wtedy rozgłaszanie zmian
+zostaje w pamięci procesu, a warstwa kanałów (np. boards.layers) przenosi
+między procesami tylko zdarzenia z REST API obsłużonego przez inny proces.
+
+Proces wybierany jest stabilnym haszem board_id (board_shard). Połączenia
+rozdziela mały serwer pośredniczący (manage.py shard_proxy), a każdy proces
+serwera dostaje swój numer w zmiennej środowiskowej BOARD_SHARD, a liczbę
+procesów w BOARD_SHARDS:
+
+    export BOARD_SHARDS=2 CHANNEL_LAYER=sqlite
+    BOARD_SHARD=0 daphne -p 8001 whiteboard_project.asgi:application
+    BOARD_SHARD=1 daphne -p 8002 whiteboard_project.asgi:application
+    python manage.py shard_proxy --listen 0.0.0.0:8000 \\
+        --backend 127.0.0.1:8001 --backend 127.0.0.1:8002
+
+Kolejność --backend musi odpowiadać numerom BOARD_SHARD.
+"""
+
+import logging
+import re
+
+from .conf import board_setting
+
+logger = logging.getLogger(__name__)
+
+BOARD_PATH = re.compile(r'^/?ws/boards/(\d+)/')
+
+# Kod zamknięcia WebSocket dla połączenia do tablicy obsługiwanej przez inny proces
+CLOSE_WRONG_SHARD = 4409
+
+
+def board_shard(board_id, shards):
+    """
+    Numer procesu (0..shards-1) dla tablicy.
+
+    Jump consistent hash (Lamping, Veach) - przy zmianie liczby procesów
+    przenoszona jest tylko niezbędna część tablic.
+    """
+    key = int(board_id) & 0xFFFFFFFFFFFFFFFF
+    bucket, jump = -1, 0
+    while jump < shards:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def path_board_id(path):
+    """Identyfikator tablicy z adresu ws/boards/<id>/ albo None"""
+    match = BOARD_PATH.match(path or '')
+    return int(match.group(1)) if match else None
+
+
+class BoardShardMiddleware:
+    """
+    Middleware ASGI sprawdzające, czy połączenie trafiło do właściwego procesu.
+
+    Numer procesu zapisywany jest w scope['board_shard']. Połączenia do tablic
+    innego procesu są obsługiwane normalnie (spójność zapewnia wspólna warstwa
+    kanałów), chyba że włączono SHARD_STRICT - wtedy są odrzucane.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        shards = board_setting('SHARD_COUNT')
+        index = board_setting('SHARD_INDEX')
+        board_id = path_board_id(scope.get('path'))
+        if (
+            scope['type'] != 'websocket' or shards <= 1
+            or index is None or board_id is None
+        ):
+            return await self.inner(scope, receive, send)
+
+        shard = board_shard(board_id, shards)
+        if shard != index:
+            logger.warning(
+                'Tablica %s należy do procesu %s, połączenie trafiło do %s',
+                board_id, shard, index,
+            )
+            if board_setting('SHARD_STRICT'):
+                await receive()  # websocket.connect
+                await send({'type': 'websocket.close', 'code': CLOSE_WRONG_SHARD})
+                return
+
+        return await self.inner({**scope, 'board_shard': shard}, receive, send)
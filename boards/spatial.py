@@ -0,0 +1,186 @@
+"""
+Zapytania przestrzenne o elementy tablicy.
+
+Prostokąt elementu obracany jest (tak jak w Fabric.js) wokół lewego górnego
+rogu (position_x, position_y) o kąt rotation w stopniach. Ramka ograniczająca
+obejmuje wszystkie cztery obrócone narożniki.
+
+W SQLite ramki są trzymane w tabeli wirtualnej R*Tree (boards_element_rtree),
+aktualizowanej przez wyzwalacze na boards_element - dzięki temu indeks jest
+zgodny z danymi niezależnie od ścieżki zapisu (save, bulk_update, update()).
+Na innych bazach (i w SQLite bez modułu rtree) ten sam test przecięcia
+liczony jest wyrażeniem SQL na elementach tablicy, bez indeksu przestrzennego.
+"""
+
+import math
+
+from django.db import connection
+from django.db.models import F, FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cos, Greatest, Least, Radians, Sin
+
+RTREE_TABLE = 'boards_element_rtree'
+
+
+def element_bounds(position_x, position_y, width, height, rotation=0):
+    """Ramka ograniczająca obróconego elementu: (min_x, min_y, max_x, max_y)"""
+    angle = math.radians(rotation or 0)
+    cos, sin = math.cos(angle), math.sin(angle)
+    xs = (0, width * cos, -height * sin, width * cos - height * sin)
+    ys = (0, width * sin, height * cos, width * sin + height * cos)
+    return (
+        position_x + min(xs), position_y + min(ys),
+        position_x + max(xs), position_y + max(ys),
+    )
+
+
+def element_data_bounds(element_data):
+    """Ramka ograniczająca elementu zapisanego jako słownik (np. z WebSocket)"""
+    return element_bounds(
+        element_data.get('position_x') or 0,
+        element_data.get('position_y') or 0,
+        element_data.get('width') if element_data.get('width') is not None else 100,
+        element_data.get('height') if element_data.get('height') is not None else 100,
+        element_data.get('rotation') or 0,
+    )
+
+
+def intersects(bounds, bbox):
+    """Czy dwie ramki (min_x, min_y, max_x, max_y) się przecinają"""
+    return (
+        bounds[0] <= bbox[2] and bounds[2] >= bbox[0]
+        and bounds[1] <= bbox[3] and bounds[3] >= bbox[1]
+    )
+
+
+def union_bounds(first, second):
+    """Najmniejsza ramka obejmująca obie podane ramki"""
+    return (
+        min(first[0], second[0]), min(first[1], second[1]),
+        max(first[2], second[2]), max(first[3], second[3]),
+    )
+
+
+def expand_bounds(bounds, margin):
+    """Powiększ ramkę o margines z każdej strony"""
+    min_x, min_y, max_x, max_y = bounds
+    return min_x - margin, min_y - margin, max_x + margin, max_y + margin
+
+
+def parse_bbox(value):
+    """
+    Odczytaj ramkę z parametru w postaci "x0,y0,x1,y1".
+
+    Kolejność narożników nie ma znaczenia. Rzuca ValueError dla błędnych danych.
+    """
+    parts = [float(part) for part in value.split(',')]
+    if len(parts) != 4 or not all(math.isfinite(part) for part in parts):
+        raise ValueError('Ramka musi mieć postać x0,y0,x1,y1')
+    x0, y0, x1, y1 = parts
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def _bounds_sql(prefix):
+    """Wyrażenia SQL (min_x, max_x, min_y, max_y) wiersza o podanym prefiksie (NEW.)"""
+    x, y = f'{prefix}position_x', f'{prefix}position_y'
+    w, h = f'{prefix}width', f'{prefix}height'
+    cos, sin = f'COS(RADIANS({prefix}rotation))', f'SIN(RADIANS({prefix}rotation))'
+    xs = f'0, {w} * {cos}, -{h} * {sin}, {w} * {cos} - {h} * {sin}'
+    ys = f'0, {w} * {sin}, {h} * {cos}, {w} * {sin} + {h} * {cos}'
+    return (
+        f'{x} + MIN({xs})', f'{x} + MAX({xs})',
+        f'{y} + MIN({ys})', f'{y} + MAX({ys})',
+    )
+
+
+def _upsert_sql(prefix):
+    min_x, max_x, min_y, max_y = _bounds_sql(prefix)
+    return (
+        f'INSERT OR REPLACE INTO {RTREE_TABLE} '
+        f'(id, min_x, max_x, min_y, max_y, board_id) '
+        f'VALUES ({prefix}id, {min_x}, {max_x}, {min_y}, {max_y}, {prefix}board_id)'
+    )
+
+
+def rtree_supported(connection):
+    """Czy SQLite ma wkompilowany moduł rtree"""
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(row[0] == 'ENABLE_RTREE' for row in cursor.fetchall())
+
+
+def rtree_available():
+    """Czy baza ma indeks R*Tree elementów (SQLite z modułem rtree, po migracji 0005)"""
+    if connection.vendor != 'sqlite':
+        return False
+    # Odczyt sqlite_master jest tani - bez pamiętania wyniku między migracjami
+    # i bazami testowymi
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+            [RTREE_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def rtree_create_statements():
+    """Polecenia tworzące indeks R*Tree z wyzwalaczami i wypełniające go (SQLite)"""
+    min_x, max_x, min_y, max_y = _bounds_sql('')
+    return [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} '
+        f'USING rtree(id, min_x, max_x, min_y, max_y, +board_id)',
+        f'CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_insert '
+        f'AFTER INSERT ON boards_element '
+        f'BEGIN {_upsert_sql("NEW.")}; END',
+        f'CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_update AFTER UPDATE OF '
+        f'position_x, position_y, width, height, rotation, board_id ON boards_element '
+        f'BEGIN {_upsert_sql("NEW.")}; END',
+        f'CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_delete '
+        f'AFTER DELETE ON boards_element '
+        f'BEGIN DELETE FROM {RTREE_TABLE} WHERE id = OLD.id; END',
+        f'INSERT OR REPLACE INTO {RTREE_TABLE} '
+        f'(id, min_x, max_x, min_y, max_y, board_id) '
+        f'SELECT id, {min_x}, {max_x}, {min_y}, {max_y}, board_id FROM boards_element',
+    ]
+
+
+def rtree_drop_statements():
+    return [
+        f'DROP TRIGGER IF EXISTS {RTREE_TABLE}_insert',
+        f'DROP TRIGGER IF EXISTS {RTREE_TABLE}_update',
+        f'DROP TRIGGER IF EXISTS {RTREE_TABLE}_delete',
+        f'DROP TABLE IF EXISTS {RTREE_TABLE}',
+    ]
+
+
+def filter_in_bbox(queryset, board_id, bbox):
+    """
+    Zawęź zapytanie o elementy tablicy do tych, które przecinają ramkę
+    (min_x, min_y, max_x, max_y).
+    """
+    x0, y0, x1, y1 = bbox
+    # Kolumna pomocnicza R*Tree nie ma typu - tekst '1' nie dopasowałby liczby 1
+    board_id = int(board_id)
+    queryset = queryset.filter(board_id=board_id)
+
+    if rtree_available():
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT id FROM {RTREE_TABLE} '
+            f'WHERE max_x >= %s AND min_x <= %s AND max_y >= %s AND min_y <= %s '
+            f'AND board_id = %s',
+            (x0, x1, y0, y1, board_id)
+        ))
+
+    cos, sin = Cos(Radians('rotation')), Sin(Radians('rotation'))
+    zero = Value(0.0, output_field=FloatField())
+    width, height = F('width'), F('height')
+    xs = (zero, width * cos, -height * sin, width * cos - height * sin)
+    ys = (zero, width * sin, height * cos, width * sin + height * cos)
+    return queryset.alias(
+        bbox_min_x=F('position_x') + Least(*xs),
+        bbox_max_x=F('position_x') + Greatest(*xs),
+        bbox_min_y=F('position_y') + Least(*ys),
+        bbox_max_y=F('position_y') + Greatest(*ys),
+    ).filter(
+        bbox_max_x__gte=x0, bbox_min_x__lte=x1, bbox_max_y__gte=y0, bbox_min_y__lte=y1
+    )
@@ -0,0 +1,103 @@
+"""
+Strumieniowe listy elementów (NDJSON - jeden obiekt JSON w linii).
+
+Wiersze są czytane kursorem bazy (.iterator()) jako słowniki (.values()),
+bez tworzenia obiektów modelu i serializatorów, a odpowiedź jest wysyłana
+paczkami linii - zużycie pamięci nie zależy od rozmiaru tablicy.
+
+Pod ASGI Django zbiera synchroniczny iterator odpowiedzi w całości
+(sync_to_async(list)), zanim cokolwiek wyśle - dlatego dla żądań ASGI
+paczki podawane są jako iterator asynchroniczny (streaming_response).
+"""
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework import serializers
+
+from . import codec
+from .conf import board_setting
+from .paths import points_to_text
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# Pola elementu w tej samej postaci co w ElementSerializer
+ELEMENT_ROW_FIELDS = (
+    'id', 'board_id', 'element_type', 'content', 'path', 'points',
+    'position_x', 'position_y', 'width', 'height',
+    'rotation', 'z_index', 'properties', 'created_at', 'updated_at',
+)
+
+_datetime = serializers.DateTimeField()
+
+# Znacznik końca paczek (next z wartością domyślną zamiast StopIteration)
+_END = object()
+
+
+def element_row(row):
+    """Wiersz z .values() w postaci elementu z API"""
+    row['board'] = row.pop('board_id')
+    row['points'] = points_to_text(row['points'])
+    row['created_at'] = _datetime.to_representation(row['created_at'])
+    row['updated_at'] = _datetime.to_representation(row['updated_at'])
+    return row
+
+
+def element_rows(queryset):
+    """Kolejne elementy zapytania (w kolejności z_index, id) jako słowniki"""
+    chunk_size = board_setting('ELEMENT_STREAM_CHUNK')
+    rows = queryset.order_by('z_index', 'id').values(*ELEMENT_ROW_FIELDS)
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield element_row(row)
+
+
+def ndjson_lines(rows, lines_per_chunk=100):
+    """Linie NDJSON łączone w paczki - jeden zapis do gniazda na paczkę, nie wiersz"""
+    chunk = []
+    for row in rows:
+        chunk.append(codec.dumps(row))
+        if len(chunk) >= lines_per_chunk:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+async def async_chunks(chunks):
+    """
+    Paczki synchronicznego generatora jako iterator asynchroniczny.
+
+    Każda paczka pobierana jest przez sync_to_async w tym samym wątku
+    (thread_sensitive) - kursor bazy nie zmienia wątku między paczkami.
+    """
+    chunks = iter(chunks)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, _END)
+            if chunk is _END:
+                return
+            yield chunk
+    finally:
+        # Przerwane wysyłanie zamyka generator (i kursor bazy)
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=True)()
+
+
+def streaming_response(request, chunks, **kwargs):
+    """StreamingHttpResponse wysyłany paczka po paczce - pod WSGI i pod ASGI"""
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        chunks = async_chunks(chunks)
+    return StreamingHttpResponse(chunks, **kwargs)
+
+
+def stream_elements(request, queryset):
+    """Odpowiedź NDJSON ze wszystkimi elementami zapytania"""
+    lines = ndjson_lines(element_rows(queryset))
+    return streaming_response(request, lines, content_type=NDJSON_CONTENT_TYPE)
+
+
+def wants_stream(request):
+    """Czy klient prosi o listę strumieniową (?stream=1)"""
+    return request.query_params.get('stream') in ('1', 'true')
@@ -1,3 +1,1745 @@
-from django.test import TestCase
+import asyncio
+import collections
+import gzip
+import json
+import math
+import os
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
\ No newline at end of file
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import connection, connections
+from django.test import (
+    AsyncClient,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+
+from . import board_templates, codec, db, spatial, writebehind
+from .broadcast import BoardOutbox, send_to_board
+from .layers import SQLiteChannelLayer
+from .management.commands.shard_proxy import ShardProxy
+from .models import Board, BoardChange, Element
+from .outbound import OutboundQueue
+from .paths import (
+    compact_element_data,
+    compact_path,
+    compact_points,
+    decode_points,
+    encode_points,
+    path_points,
+)
+from .routing import websocket_urlpatterns
+from .sharding import (
+    CLOSE_WRONG_SHARD,
+    BoardShardMiddleware,
+    board_shard,
+    path_board_id,
+)
+from .writebehind import WriteBehindBuffer, apply_element_changes
+
+application = URLRouter(websocket_urlpatterns)
+
+
+async def receive_action(communicator, action, timeout=2):
+    """Pierwsza wiadomość o danej akcji - pozostałe (też z ramek zbiorczych) pomijamy"""
+    while True:
+        message = await communicator.receive_json_from(timeout=timeout)
+        for item in message if isinstance(message, list) else [message]:
+            if item.get('action') == action:
+                return item
+
+
+def stroke(action, stroke_id, **fields):
+    """Wiadomość rysunku w trakcie (stroke_begin, stroke_append, stroke_end)"""
+    return {'action': action, 'stroke_id': stroke_id, **fields}
+
+
+class ConsumerTestCase(TransactionTestCase):
+    """Testy konsumenta tablicy - połączenia WebSocket przez WebsocketCommunicator"""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='test')
+
+    def run_client(self, scenario, subprotocols=None):
+        """Wykonaj scenariusz z jednym połączonym klientem"""
+        async def run():
+            communicator = WebsocketCommunicator(
+                application, f'/ws/boards/{self.board.id}/', subprotocols=subprotocols
+            )
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            try:
+                await scenario(communicator)
+            finally:
+                await communicator.disconnect()
+        asyncio.run(run())
+
+
+class MalformedFrameTests(ConsumerTestCase):
+    """Uszkodzone wiadomości kończą się ramką error, a połączenie działa dalej"""
+
+    def test_invalid_frames_keep_connection_open(self):
+        frames = [
+            {'text_data': 'to nie jest JSON'},
+            {'text_data': '[1, 2, 3]'},
+            {'text_data': '42'},
+            {'bytes_data': b'\x02'},
+            {'bytes_data': b'\x63\x00'},
+            {'bytes_data': b'\x00\x05\x00\x00\x00'},
+            {'bytes_data': b'\x02\x02[1]'},
+            {'text_data': json.dumps(
+                {'action': 'delete_element', 'element_id': 'abc'}
+            )},
+            {'text_data': json.dumps(
+                {'action': 'delete_element', 'element_id': {'id': 1}}
+            )},
+        ]
+
+        async def scenario(communicator):
+            for frame in frames:
+                await communicator.send_to(**frame)
+                error = await receive_action(communicator, 'error')
+                self.assertIn(error['reason'], ('invalid_frame', 'invalid_message'))
+            await communicator.send_json_to(
+                {'action': 'create_element', 'element': {'element_type': 'shape'}}
+            )
+            created = await receive_action(communicator, 'create_element')
+            self.assertTrue(created['element']['id'])
+            # Identyfikator jako tekst jest zamieniany na liczbę także w rozgłoszeniu
+            await communicator.send_json_to({
+                'action': 'delete_element', 'element_id': str(created['element']['id']),
+            })
+            deleted = await receive_action(communicator, 'delete_element')
+            self.assertEqual(deleted['element_id'], created['element']['id'])
+
+        self.run_client(scenario)
+
+    def test_binary_batch_frame(self):
+        frame = codec.encode_binary_batch([
+            {
+                'action': 'create_element',
+                'element': {'element_type': 'shape', 'position_x': 5},
+            },
+            {
+                'action': 'create_element',
+                'element': {'element_type': 'text', 'position_x': 7},
+            },
+        ])
+
+        async def scenario(communicator):
+            await communicator.send_to(bytes_data=frame)
+            await receive_action(communicator, 'create_element')
+
+        self.run_client(scenario)
+        self.assertEqual(Element.objects.filter(board=self.board).count(), 2)
+
+    @override_settings(BOARDS={'INBOUND_MAX_FRAME': 0, 'INBOUND_MAX_ITEMS': 0})
+    def test_zero_disables_frame_limits(self):
+        async def scenario(communicator):
+            await communicator.send_to(text_data=json.dumps({
+                'action': 'create_element',
+                'element': {'element_type': 'text', 'content': 'ż' * 5000},
+            }))
+            created = await receive_action(communicator, 'create_element')
+            self.assertEqual(len(created['element']['content']), 5000)
+
+        self.run_client(scenario)
+
+    @override_settings(BOARDS={'INBOUND_MAX_FRAME': 3000})
+    def test_frame_size_counted_in_bytes(self):
+        async def scenario(communicator):
+            # 2000 znaków, ale ponad 4000 bajtów UTF-8
+            await communicator.send_to(text_data=json.dumps(
+                {'action': 'create_element', 'element': {'content': 'ż' * 2000}},
+                ensure_ascii=False,
+            ))
+            limited = await receive_action(communicator, 'rate_limited')
+            self.assertEqual(limited['reason'], 'frame_too_large')
+
+        self.run_client(scenario)
+
+
+@override_settings(BOARDS={'WRITE_BEHIND_ENABLED': True})
+class WriteBehindUpdateTests(ConsumerTestCase):
+    """
+    Aktualizacje przez bufor zapisów - rozgłaszane są tylko poprawne zmiany
+    istniejących elementów.
+    """
+
+    def test_invalid_values_are_rejected(self):
+        element = Element.objects.create(
+            board=self.board, element_type='shape', position_x=1
+        )
+
+        async def scenario(communicator):
+            await communicator.send_json_to({
+                'action': 'update_element',
+                'element': {'id': element.id, 'position_x': 'abc'},
+            })
+            error = await receive_action(communicator, 'error')
+            self.assertEqual(error['reason'], 'invalid_element')
+            await communicator.send_json_to({
+                'action': 'update_element',
+                'element': {'id': element.id, 'z_index': 1.5},
+            })
+            await receive_action(communicator, 'error')
+            await communicator.send_json_to({
+                'action': 'update_element',
+                'element': {'id': element.id, 'position_x': '7.5'},
+            })
+            updated = await receive_action(communicator, 'update_element')
+            self.assertEqual(updated['element'], {'id': element.id, 'position_x': 7.5})
+
+        self.run_client(scenario)
+        element.refresh_from_db()
+        self.assertEqual(element.position_x, 7.5)
+
+    def test_unknown_element_is_not_broadcast(self):
+        async def scenario(communicator):
+            await communicator.send_json_to(
+                {'action': 'update_element', 'element': {'id': 999999, 'position_x': 1}}
+            )
+            error = await receive_action(communicator, 'error')
+            self.assertEqual(
+                error, {'action': 'error', 'reason': 'not_found', 'element_id': 999999}
+            )
+            self.assertTrue(await communicator.receive_nothing(0.2))
+
+        self.run_client(scenario)
+
+
+    def test_batch_checks_elements_with_one_query(self):
+        elements = Element.objects.bulk_create(
+            [Element(board=self.board, element_type='shape') for _ in range(20)]
+        )
+        operations = [
+            {'action': 'update_element', 'element': {'id': element.id, 'position_x': 3}}
+            for element in elements
+        ]
+        operations.append(
+            {'action': 'update_element', 'element': {'id': 999999, 'position_x': 3}}
+        )
+
+        async def scenario(communicator):
+            await communicator.send_json_to(
+                {'action': 'batch', 'operations': operations}
+            )
+            error = await receive_action(communicator, 'error')
+            self.assertEqual((error['reason'], error['index']), ('not_found', 20))
+            frame = await communicator.receive_json_from()
+            self.assertEqual(len(frame), 20)
+
+        with mock.patch(
+            'boards.writebehind.existing_element_ids',
+            wraps=writebehind.existing_element_ids,
+        ) as lookup:
+            self.run_client(scenario)
+        self.assertEqual(lookup.call_count, 1)
+
+
+@override_settings(BOARDS={'WRITE_BEHIND_MAX_RETRIES': 2})
+class WriteBehindFlushTests(TransactionTestCase):
+    """Zapis bufora - paczka, pojedynczo po błędzie, ponowienia i usunięte elementy"""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='test')
+        self.first = Element.objects.create(board=self.board, element_type='shape')
+        self.second = Element.objects.create(board=self.board, element_type='shape')
+
+    def flush(self, buffer, changes):
+        async def run():
+            for element_id, fields in changes.items():
+                await buffer.add(element_id, fields)
+            return await buffer.flush()
+        return asyncio.run(run())
+
+    @mock.patch('boards.writebehind.send_to_board')
+    def test_flush_writes_batch_and_bumps_version(self, send):
+        buffer = WriteBehindBuffer(self.board.id, flush_interval=60)
+        written = self.flush(buffer, {
+            self.first.id: {'position_x': 10}, self.second.id: {'position_y': 20},
+        })
+
+        self.assertEqual(written, 2)
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.version, 2)
+        send.assert_called_once_with(
+            f'board_{self.board.id}', {'action': 'version', 'seq': 2}
+        )
+        self.assertEqual(Element.objects.get(id=self.second.id).position_y, 20)
+
+    @mock.patch('boards.writebehind.send_to_board')
+    def test_failed_batch_falls_back_to_single_writes(self, _send):
+        calls = []
+
+        def flaky(board_id, changes):
+            calls.append(set(changes))
+            if len(changes) > 1 or self.second.id in changes:
+                raise RuntimeError('błąd zapisu')
+            return apply_element_changes(board_id, changes)
+
+        buffer = WriteBehindBuffer(self.board.id, flush_interval=60)
+        with (
+            mock.patch('boards.writebehind.apply_element_changes', flaky),
+            self.assertLogs('boards.writebehind'),
+        ):
+            written = self.flush(buffer, {
+                self.first.id: {'position_x': 10}, self.second.id: {'position_x': 20},
+            })
+
+        self.assertEqual(written, 1)
+        self.assertEqual(Element.objects.get(id=self.first.id).position_x, 10)
+        # Nieudana zmiana wraca do bufora i czeka na kolejny zapis
+        self.assertEqual(buffer.pending, {self.second.id: {'position_x': 20}})
+        self.assertEqual(buffer.retries, {self.second.id: 1})
+
+        with (
+            mock.patch('boards.writebehind.apply_element_changes', flaky),
+            self.assertLogs('boards.writebehind') as logs,
+        ):
+            self.flush(buffer, {})
+            self.flush(buffer, {})
+        self.assertIn('Porzucono zmiany elementu', logs.output[-1])
+        # Po WRITE_BEHIND_MAX_RETRIES ponowieniach zmiana jest porzucana
+        self.assertEqual(buffer.pending, {})
+        self.assertEqual(buffer.stats['failed'], 1)
+
+        self.flush(buffer, {self.second.id: {'position_x': 30}})
+        self.assertEqual(Element.objects.get(id=self.second.id).position_x, 30)
+
+    @mock.patch('boards.writebehind.send_to_board')
+    def test_flush_error_requeues_batch(self, _send):
+        buffer = WriteBehindBuffer(self.board.id, flush_interval=60)
+
+        async def run():
+            await buffer.add(self.first.id, {'position_x': 10})
+            with (
+                mock.patch(
+                    'boards.writebehind.write_buffered_changes',
+                    side_effect=RuntimeError,
+                ),
+                self.assertRaises(RuntimeError),
+            ):
+                await buffer.flush()
+            await buffer.add(self.first.id, {'position_y': 5})
+            return await buffer.flush()
+
+        self.assertEqual(asyncio.run(run()), 1)
+        element = Element.objects.get(id=self.first.id)
+        self.assertEqual((element.position_x, element.position_y), (10, 5))
+
+    @mock.patch('boards.writebehind.send_to_board')
+    def test_deleted_element_is_dropped_at_flush(self, send):
+        buffer = WriteBehindBuffer(self.board.id, flush_interval=60)
+
+        async def run():
+            self.assertTrue(await buffer.contains(self.first.id))
+            self.assertFalse(await buffer.contains(999999))
+            await buffer.add(self.first.id, {'position_x': 10})
+            delete = Element.objects.filter(id=self.first.id).delete
+            await database_sync_to_async(delete)()
+            return await buffer.flush()
+
+        self.assertEqual(asyncio.run(run()), 0)
+        send.assert_called_once_with(
+            f'board_{self.board.id}',
+            {'action': 'delete_element', 'element_id': self.first.id},
+        )
+
+
+class ElementPathTests(TestCase):
+    """Ścieżki rysunków zapisywane jako punkty"""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='test')
+        self.element = Element.objects.create(
+            board=self.board, element_type='path',
+            points=compact_points([(0, 0), (50, 50)]),
+        )
+
+    def test_patch_path_replaces_points(self):
+        response = self.client.patch(
+            f'/api/elements/{self.element.id}/', {'path': 'M 0 0 L 10 0 L 10 10'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.element.refresh_from_db()
+        self.assertIsNone(self.element.path)
+        points = [
+            (round(x, 3), round(y, 3)) for x, y in decode_points(self.element.points)
+        ]
+        self.assertEqual(points, [(0, 0), (10, 0), (10, 10)])
+
+    def test_patch_unsupported_path_clears_points(self):
+        response = self.client.patch(
+            f'/api/elements/{self.element.id}/', {'path': 'm 0 0 l 10 10'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.element.refresh_from_db()
+        self.assertEqual(self.element.path, 'm 0 0 l 10 10')
+        self.assertIsNone(self.element.points)
+
+    def test_curves_are_flattened_through_curve_points(self):
+        points = path_points('M 0 0 Q 10 10 20 0')
+        self.assertEqual(points[0], (0, 0))
+        self.assertEqual(points[-1], (20, 0))
+        # Środek krzywej, a nie punkt kontrolny (10, 10)
+        self.assertIn((10, 5), points)
+        smooth = path_points(
+            [['M', 0, 0], ['C', 0, 10, 20, 10, 20, 0], ['S', 40, -10, 40, 0]]
+        )
+        self.assertIn((30, -7.5), smooth)
+
+    def test_out_of_range_coordinates_keep_text(self):
+        with self.assertRaises(ValueError):
+            encode_points([(1e20, 0), (0, 0)])
+        self.assertIsNone(compact_path('M 1e20 0 L 0 0'))
+        response = self.client.patch(
+            f'/api/elements/{self.element.id}/', {'path': 'M 1e20 0 L 0 0'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.element.refresh_from_db()
+        self.assertEqual(self.element.path, 'M 1e20 0 L 0 0')
+        self.assertIsNone(self.element.points)
+
+    def test_invalid_points_are_rejected(self):
+        with self.assertRaises(ValueError):
+            compact_element_data({'element_type': 'path', 'points': 'nie base64!'})
+        response = self.client.post(f'/api/boards/{self.board.id}/import_state/', {
+            'elements': [{'element_type': 'path', 'points': 'nie base64!'}]
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Element.objects.filter(board=self.board).count(), 1)
+
+
+class ElementPatchTests(TestCase):
+    """Zmiana elementu przez REST - łatka właściwości i zapis tylko zmienionych pól"""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='test')
+        self.element = Element.objects.create(
+            board=self.board, element_type='shape', content='tekst',
+            properties={'color': 'red', 'style': {'width': 2, 'dash': True}},
+        )
+
+    def patch(self, data):
+        return self.client.patch(
+            f'/api/elements/{self.element.id}/', data, content_type='application/json'
+        )
+
+    def test_merge_patch_deletes_keys(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch(
+                {'properties_patch': {'color': None, 'style': {'dash': None}}}
+            )
+        self.assertEqual(response.status_code, 200)
+        expected = {'style': {'width': 2}}
+        self.assertEqual(response.json()['properties'], expected)
+        self.assertEqual(Element.objects.get(id=self.element.id).properties, expected)
+
+        # UPDATE elementu zapisuje tylko właściwości i czas zmiany
+        update = next(
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "boards_element"')
+        )
+        self.assertIn('"properties"', update)
+        self.assertNotIn('"content"', update)
+        self.assertNotIn('"position_x"', update)
+
+        change = self.board.changes.get()
+        self.assertEqual(change.data['element']['properties'], expected)
+
+    def test_unchanged_patch_skips_write(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch({'content': 'tekst'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any(
+            query['sql'].startswith('UPDATE "boards_element"')
+            for query in queries.captured_queries
+        ))
+
+
+class BulkElementTests(TestCase):
+    """Zapis zbiorczy /api/elements/bulk/ - wynik dla każdej pozycji żądania"""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='test')
+        self.other = Board.objects.create(title='inna')
+        self.first = Element.objects.create(board=self.board, element_type='shape')
+        self.second = Element.objects.create(board=self.board, element_type='shape')
+
+    def patch(self, items):
+        return self.client.patch(
+            '/api/elements/bulk/', items, content_type='application/json'
+        )
+
+    def statuses(self, response):
+        return [result['status'] for result in response.json()]
+
+    def test_update_results_follow_request_order(self):
+        response = self.patch([
+            {'id': 999999, 'position_x': 1},
+            {'id': self.first.id, 'position_x': 10},
+            {'id': self.second.id, 'position_y': 20},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.statuses(response), ['not_found', 'updated', 'updated']
+        )
+        self.assertEqual(response.json()[0]['id'], 999999)
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.version, 2)
+
+    def test_invalid_update_keeps_indexes(self):
+        response = self.patch([
+            {'id': 999999, 'position_x': 1},
+            {'id': self.first.id, 'position_x': 10},
+            {'id': self.second.id, 'element_type': 'x'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.statuses(response), ['not_found', 'valid', 'invalid'])
+        self.assertIn('element_type', response.json()[2]['errors'])
+        self.assertEqual(Element.objects.get(id=self.first.id).position_x, 0)
+
+    def test_duplicate_ids_are_rejected(self):
+        response = self.patch([
+            {'id': self.first.id, 'position_x': 1},
+            {'id': self.first.id, 'position_x': 2},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.statuses(response), ['valid', 'invalid'])
+        self.assertIn('id', response.json()[1]['errors'])
+
+    def test_board_change_is_rejected(self):
+        response = self.patch([
+            {'id': self.first.id, 'board': self.board.id, 'position_x': 1},
+            {'id': self.second.id, 'board': self.other.id},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.statuses(response), ['valid', 'invalid'])
+        self.assertIn('board', response.json()[1]['errors'])
+        self.assertEqual(Element.objects.get(id=self.second.id).board_id, self.board.id)
+
+    def test_delete_reports_missing_ids(self):
+        response = self.client.delete(
+            '/api/elements/bulk/', [self.first.id, 999999],
+            content_type='application/json',
+        )
+        self.assertEqual(response.json(), [
+            {'status': 'deleted', 'id': self.first.id},
+            {'status': 'not_found', 'id': 999999},
+        ])
+        self.assertFalse(Element.objects.filter(id=self.first.id).exists())
+
+
+class BoardImportTests(TestCase):
+    """Import stanu tablicy - zbiorczy upsert elementów i usuwanie brakujących"""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='test')
+        self.kept = Element.objects.create(
+            board=self.board, element_type='shape', position_x=1
+        )
+        self.changed = Element.objects.create(
+            board=self.board, element_type='shape', position_x=2
+        )
+        self.missing = Element.objects.create(
+            board=self.board, element_type='shape', position_x=3
+        )
+        self.elements = [
+            {'id': self.kept.id, 'element_type': 'shape', 'position_x': 1},
+            {'id': self.changed.id, 'element_type': 'shape', 'position_x': 20},
+            {'element_type': 'text', 'content': 'nowy'},
+        ]
+
+    def change_actions(self):
+        return list(self.board.changes.values_list('action', flat=True))
+
+    def test_bulk_upsert_and_delete_missing(self):
+        report = self.board.bulk_upsert_elements(self.elements)
+
+        self.assertEqual(
+            {
+                key: report[key]
+                for key in ('created', 'updated', 'unchanged', 'deleted')
+            },
+            {'created': 1, 'updated': 1, 'unchanged': 1, 'deleted': 1},
+        )
+        self.assertEqual(report['updated_fields'], ['position_x'])
+        self.assertFalse(Element.objects.filter(id=self.missing.id).exists())
+        self.assertEqual(Element.objects.get(id=self.changed.id).position_x, 20)
+        self.assertTrue(
+            Element.objects.filter(board=self.board, content='nowy').exists()
+        )
+        # Import rejestruje jedną zmianę reset
+        self.board.refresh_from_db()
+        self.assertEqual(self.change_actions(), ['reset'])
+
+    def test_save_registers_only_title_changes(self):
+        self.board.rebuild_snapshot()
+        version = self.board.version
+
+        self.board.update_from_json({'elements': self.elements})
+        self.board.save()
+        Board.objects.get(id=self.board.id).save()
+        self.board.refresh_from_db()
+        # Tylko reset z importu - zapis bez zmian nie trafia do dziennika
+        self.assertEqual(self.board.version, version + 1)
+        self.assertEqual(self.change_actions(), ['reset'])
+
+        self.board.rebuild_snapshot()
+        self.board.title = 'nowy tytuł'
+        self.board.save()
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.version, version + 2)
+        self.assertIsNone(self.board.serialized_state)
+        change = self.board.changes.order_by('seq').last()
+        self.assertEqual(
+            (change.action, change.data),
+            ('update_board', {'board': {'title': 'nowy tytuł'}}),
+        )
+
+        # update_fields bez śledzonych pól zapisuje dane, ale nie tworzy zmiany
+        self.board.save(update_fields=['updated_at'])
+        board = Board.objects.only('id').get(id=self.board.id)
+        board.save()
+        self.assertEqual(Board.objects.get(id=self.board.id).version, version + 2)
+
+    def test_bulk_upsert_without_delete(self):
+        report = self.board.bulk_upsert_elements(self.elements, delete_missing=False)
+        self.assertEqual(report['deleted'], 0)
+        self.assertTrue(Element.objects.filter(id=self.missing.id).exists())
+
+    def test_unchanged_import_registers_nothing(self):
+        report = self.board.bulk_upsert_elements([
+            {
+                'id': element.id, 'element_type': 'shape',
+                'position_x': element.position_x,
+            }
+            for element in (self.kept, self.changed, self.missing)
+        ])
+        self.assertEqual(report['unchanged'], 3)
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.version, 0)
+
+    def test_import_state_returns_report(self):
+        response = self.client.post(
+            f'/api/boards/{self.board.id}/import_state/',
+            {'title': 'nowa', 'elements': self.elements},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        report = response.json()['report']
+        self.assertEqual(
+            (report['created'], report['updated'], report['deleted']), (1, 1, 1)
+        )
+        self.assertEqual(Board.objects.get(id=self.board.id).title, 'nowa')
+
+    def test_update_from_json_without_elements(self):
+        self.assertIsNone(self.board.update_from_json({'title': 'nowa'}))
+
+
+class BoardListTests(TestCase):
+    """Lista tablic - liczba zapytań, wybór pól i stronicowanie kursorem"""
+
+    def setUp(self):
+        self.boards = [
+            Board.objects.create(title=f'tablica {index}') for index in range(5)
+        ]
+        for count, board in enumerate(self.boards):
+            for _ in range(count):
+                Element.objects.create(board=board, element_type='shape')
+
+    def test_query_count_does_not_grow_with_boards(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/boards/')
+        counts = {board['id']: board['elements_count'] for board in response.json()}
+        self.assertEqual(
+            counts, {board.id: index for index, board in enumerate(self.boards)}
+        )
+
+    def test_fields_limits_response_and_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/boards/?fields=id,title')
+        self.assertEqual(
+            {tuple(sorted(board)) for board in response.json()}, {('id', 'title')}
+        )
+        self.assertEqual(len(queries.captured_queries), 1)
+        sql = queries.captured_queries[0]['sql']
+        self.assertNotIn('serialized_state', sql)
+        self.assertNotIn('COUNT', sql)
+
+    def test_cursor_walks_all_boards_once(self):
+        url = '/api/boards/?page_size=2'
+        ids, pages = [], 0
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 2)
+            ids += [board['id'] for board in page['results']]
+            url = page['next']
+            pages += 1
+        # Od ostatnio zmienionych tablic
+        self.assertEqual(ids, [board.id for board in reversed(self.boards)])
+        self.assertEqual(pages, 3)
+
+
+class ElementPaginationTests(TestCase):
+    """Stronicowanie elementów kluczem (z_index, id)"""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='test')
+        for z_index in (2, 0, 0, 1, 0):
+            Element.objects.create(
+                board=self.board, element_type='shape', z_index=z_index
+            )
+        self.ordered = list(
+            Element.objects.filter(board=self.board)
+            .order_by('z_index', 'id').values_list('id', flat=True)
+        )
+
+    def test_cursor_walks_all_elements_once(self):
+        url = f'/api/boards/{self.board.id}/elements/?page_size=2'
+        ids, pages = [], 0
+        while url:
+            page = self.client.get(url).json()
+            ids += [element['id'] for element in page['results']]
+            url = page['next']
+            pages += 1
+        self.assertEqual(ids, self.ordered)
+        self.assertEqual(pages, 3)
+
+    def test_element_list_pages(self):
+        url = f'/api/elements/?board_id={self.board.id}&page_size=4'
+        page = self.client.get(url).json()
+        self.assertEqual(
+            [element['id'] for element in page['results']], self.ordered[:4]
+        )
+        rest = self.client.get(page['next']).json()
+        self.assertEqual(
+            [element['id'] for element in rest['results']], self.ordered[4:]
+        )
+        self.assertIsNone(rest['next'])
+
+    def test_without_page_size_returns_plain_list(self):
+        response = self.client.get(f'/api/boards/{self.board.id}/elements/')
+        self.assertEqual(len(response.json()), 5)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f'/api/boards/{self.board.id}/elements/?cursor=zły')
+        self.assertEqual(response.status_code, 404)
+
+
+class SnapshotTests(TestCase):
+    """Zapisany stan tablicy - unieważniany przy zapisie i odbudowywany przy odczycie"""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='test')
+        self.element = Element.objects.create(board=self.board, element_type='shape')
+
+    def export(self):
+        response = self.client.get(f'/api/boards/{self.board.id}/export_state/')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_snapshot_rebuilt_after_write(self):
+        self.assertEqual(self.export()['elements'][0]['position_x'], 0)
+        self.board.refresh_from_db()
+        snapshot = self.board.serialized_state
+        self.assertIsNotNone(snapshot)
+
+        # Kolejny odczyt korzysta z zapisanego stanu - bez zapytań o elementy
+        board = Board.objects.get(id=self.board.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(board.get_snapshot(), snapshot)
+
+        response = self.client.patch(
+            f'/api/elements/{self.element.id}/', {'position_x': 7},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.board.refresh_from_db()
+        self.assertIsNone(self.board.serialized_state)
+
+        data = self.export()
+        self.assertEqual(data['elements'][0]['position_x'], 7)
+        self.assertEqual(data['version'], self.board.version)
+        self.board.refresh_from_db()
+        self.assertEqual(json.loads(self.board.serialized_state), data)
+
+    def test_stale_rebuild_is_not_saved(self):
+        board = Board.objects.get(id=self.board.id)
+        Board.register_change(self.board.id, [{'action': 'reset'}])
+        # Stan zbudowany dla starej wersji nie nadpisuje nowszej tablicy
+        board.rebuild_snapshot()
+        self.board.refresh_from_db()
+        self.assertIsNone(self.board.serialized_state)
+
+
+class ConditionalGetTests(TestCase):
+    """ETag i odpowiedzi 304 dla odczytów tablicy"""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='test')
+        Element.objects.create(board=self.board, element_type='shape')
+
+    def test_not_modified_until_board_changes(self):
+        for url in (
+            f'/api/boards/{self.board.id}/',
+            f'/api/boards/{self.board.id}/elements/',
+            f'/api/boards/{self.board.id}/export_state/',
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                version = Board.objects.get(id=self.board.id).version
+                self.assertEqual(response['X-Board-Version'], str(version))
+
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+
+                Board.register_change(self.board.id, [{'action': 'reset'}])
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+
+class NdjsonTransferTests(TestCase):
+    """Strumieniowy eksport NDJSON i import tego samego pliku"""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='test')
+        Element.objects.create(
+            board=self.board, element_type='shape', position_x=5, z_index=1
+        )
+        Element.objects.create(
+            board=self.board, element_type='text', content='ż', properties={'a': 1}
+        )
+        Element.objects.create(
+            board=self.board, element_type='path',
+            points=compact_points([(0, 0), (10, 10), (20, 0)]),
+        )
+
+    def export(self, **headers):
+        response = self.client.get(
+            f'/api/boards/{self.board.id}/export_state/?stream=1', **headers
+        )
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content), response
+
+    def state(self):
+        return sorted(
+            Element.objects.filter(board=self.board).values_list(
+                'element_type', 'content', 'position_x', 'z_index', 'properties',
+                'points',
+            ),
+            key=repr
+        )
+
+    def test_round_trip(self):
+        body, _ = self.export()
+        lines = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+        self.assertEqual(lines[0]['board']['title'], 'test')
+        self.assertEqual(len(lines), 4)
+
+        before = self.state()
+        shapes = Element.objects.filter(board=self.board, element_type='shape')
+        shapes.update(position_x=99)
+        Element.objects.create(board=self.board, element_type='sticky')
+
+        response = self.client.post(
+            f'/api/boards/{self.board.id}/import_state/', body,
+            content_type='application/x-ndjson',
+        )
+        self.assertEqual(response.status_code, 200)
+        report = response.json()['report']
+        self.assertEqual(
+            (report['updated'], report['deleted'], report['created']), (1, 1, 0)
+        )
+        self.assertEqual(self.state(), before)
+
+    def test_gzip_round_trip(self):
+        body, response = self.export(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertEqual(len(gzip.decompress(body).splitlines()), 4)
+
+        before = self.state()
+        Element.objects.filter(board=self.board).delete()
+        response = self.client.post(
+            f'/api/boards/{self.board.id}/import_state/', body,
+            content_type='application/x-ndjson', HTTP_CONTENT_ENCODING='gzip'
+        )
+        self.assertEqual(response.json()['report']['created'], 3)
+        self.assertEqual(self.state(), before)
+
+    async def test_asgi_export_streams_asynchronously(self):
+        response = await AsyncClient().get(
+            f'/api/boards/{self.board.id}/export_state/?stream=1'
+        )
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.splitlines()), 4)
+        self.assertEqual(json.loads(body.splitlines()[0])['board']['title'], 'test')
+
+    def test_invalid_line(self):
+        response = self.client.post(
+            f'/api/boards/{self.board.id}/import_state/', b'{"board": {}}\n[1]\n',
+            content_type='application/x-ndjson',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Element.objects.filter(board=self.board).count(), 3)
+
+
+class ResumeTests(ConsumerTestCase):
+    """Wznowienie połączenia - przegapione zmiany z dziennika, potem bieżące"""
+
+    def test_resume_after_resync(self):
+        sent = []
+
+        async def send(text_data=None, **_kwargs):
+            sent.append(codec.loads(text_data))
+
+        async def run():
+            queue = OutboundQueue(self.board.id, send, high_water=10, max_queue=2)
+            for seq in (1, 2, 3):
+                queue.push(codec.dumps({'action': 'create_element', 'seq': seq}))
+            # Po resync_required kolejka nie przyjmuje zdarzeń aż do odpowiedzi
+            # na resume
+            queue.push(codec.dumps({'action': 'create_element', 'seq': 4}))
+            await asyncio.sleep(0)
+            queue.resume(codec.dumps({'action': 'resume', 'version': 4}))
+            queue.push(codec.dumps({'action': 'create_element', 'seq': 5}))
+            await asyncio.sleep(0.01)
+            queue.close()
+
+        asyncio.run(run())
+        self.assertEqual(
+            [message['action'] for message in sent],
+            ['resync_required', 'resume', 'create_element'],
+        )
+        self.assertEqual(sent[-1]['seq'], 5)
+
+    def test_resume_returns_missed_changes(self):
+        async def scenario(communicator):
+            await communicator.send_json_to(
+                {'action': 'create_element', 'element': {'element_type': 'shape'}}
+            )
+            created = await receive_action(communicator, 'create_element')
+            await communicator.send_json_to({
+                'action': 'delete_element', 'element_id': created['element']['id'],
+            })
+            await receive_action(communicator, 'delete_element')
+
+            await communicator.send_json_to(
+                {'action': 'resume', 'since': created['seq']}
+            )
+            reply = await receive_action(communicator, 'resume')
+            self.assertEqual(reply['version'], created['seq'] + 1)
+            self.assertEqual(
+                [change['action'] for change in reply['changes']], ['delete_element']
+            )
+            self.assertFalse(reply['resync'])
+
+        self.run_client(scenario)
+
+
+class BinaryBroadcastTests(ConsumerTestCase):
+    """Ramki binarne kodowane u odbiorcy - do grupy trafia tylko JSON"""
+
+    def test_binary_and_json_clients(self):
+        async def run():
+            clients = [
+                WebsocketCommunicator(
+                    application, f'/ws/boards/{self.board.id}/',
+                    subprotocols=subprotocols,
+                )
+                for subprotocols in ([codec.BINARY_SUBPROTOCOL], None)
+            ]
+            for communicator in clients:
+                self.assertTrue((await communicator.connect())[0])
+            binary, plain = clients
+
+            with mock.patch('boards.broadcast.get_channel_layer') as get_layer:
+                get_layer.return_value.group_send = mock.AsyncMock()
+                await send_to_board(
+                    f'board_{self.board.id}',
+                    {'action': 'update_element', 'element': {'id': 1}},
+                )
+                message = get_layer.return_value.group_send.call_args.args[1]
+                self.assertNotIn('binary_frame', message)
+
+            await plain.send_json_to({
+                'action': 'create_element',
+                'element': {'element_type': 'shape', 'position_x': 2},
+            })
+            created = await receive_action(plain, 'create_element')
+            element_id = created['element']['id']
+            frame = await binary.receive_from()
+            self.assertIsInstance(frame, bytes)
+            self.assertEqual(codec.decode_binary(frame)['element']['id'], element_id)
+
+            await plain.send_json_to({'action': 'batch', 'operations': [
+                {
+                    'action': 'update_element',
+                    'element': {'id': element_id, 'position_x': 3},
+                },
+            ]})
+            batch = codec.decode_binary(await binary.receive_from())
+            self.assertEqual(batch[0]['element']['position_x'], 3)
+
+            for communicator in clients:
+                await communicator.disconnect()
+
+        with override_settings(BOARDS={'WRITE_BEHIND_ENABLED': False}):
+            asyncio.run(run())
+
+
+class BroadcastTests(ConsumerTestCase):
+    """Rozsyłanie zdarzeń do grupy tablicy - tryb wsadowy i ramki serializowane raz"""
+
+    def test_outbox_coalesces_updates(self):
+        async def run():
+            outbox = BoardOutbox('board_test', tick=60, max_queue=100)
+            with mock.patch('boards.broadcast.get_channel_layer') as get_layer:
+                get_layer.return_value.group_send = mock.AsyncMock()
+                for element in (
+                    {'id': 1, 'position_x': 1},
+                    {'id': 2, 'position_x': 5},
+                    {'id': 1, 'properties': {'a': 1, 'b': 2}},
+                    {'id': 1, 'properties_patch': {'a': None}},
+                    {'id': 1, 'position_x': 3},
+                ):
+                    event = {'action': 'update_element', 'element': element}
+                    await outbox.push(event, bounds=(0, 0, 10, 10))
+                self.assertEqual(await outbox.flush(), 2)
+                get_layer.return_value.group_send.assert_awaited_once()
+                return outbox, get_layer.return_value.group_send.call_args.args[1]
+
+        outbox, message = asyncio.run(run())
+        self.assertEqual(message['type'], 'board_batch')
+        self.assertEqual(message['bounds'], [0, 0, 10, 10])
+        self.assertEqual(
+            [event['element'] for event in codec.loads(message['frame'])],
+            [
+                {'id': 1, 'position_x': 3, 'properties': {'b': 2}},
+                {'id': 2, 'position_x': 5},
+            ],
+        )
+        self.assertEqual(
+            outbox.stats,
+            {'events_in': 5, 'events_coalesced': 3, 'events_out': 2, 'frames': 1},
+        )
+
+
+    def test_frame_serialized_once_per_group(self):
+        async def run():
+            clients = [
+                WebsocketCommunicator(application, f'/ws/boards/{self.board.id}/')
+                for _ in range(3)
+            ]
+            for communicator in clients:
+                self.assertTrue((await communicator.connect())[0])
+
+            event = {'action': 'update_element', 'element': {'id': 1, 'position_x': 2}}
+            with mock.patch('boards.codec.dumps', wraps=codec.dumps) as dumps:
+                await send_to_board(f'board_{self.board.id}', event)
+                received = [
+                    await communicator.receive_from() for communicator in clients
+                ]
+            # Jedna serializacja u nadawcy, odbiorcy wysyłają gotową ramkę
+            self.assertEqual(dumps.call_count, 1)
+            self.assertEqual(received, [codec.dumps(event)] * len(clients))
+
+            for communicator in clients:
+                await communicator.disconnect()
+
+        asyncio.run(run())
+
+
+class ViewportTests(ConsumerTestCase):
+    """Subskrypcja widoku - klient dostaje tylko zdarzenia elementów w swoim widoku"""
+
+    def test_viewport_filters_updates(self):
+        far = Element.objects.create(
+            board=self.board, element_type='shape', position_x=5000, position_y=5000
+        )
+
+        async def run():
+            author, viewer = [
+                WebsocketCommunicator(application, f'/ws/boards/{self.board.id}/')
+                for _ in range(2)
+            ]
+            for communicator in (author, viewer):
+                self.assertTrue((await communicator.connect())[0])
+
+            async def update(changes):
+                await author.send_json_to({
+                    'action': 'update_element', 'element': {'id': far.id, **changes}
+                })
+                await receive_action(author, 'update_element')
+
+            await viewer.send_json_to({
+                'action': 'subscribe_viewport',
+                'viewport': {'x0': 0, 'y0': 0, 'x1': 800, 'y1': 600},
+            })
+            # Ramka subscribe_viewport nie ma odpowiedzi - czekamy na jej obsłużenie
+            self.assertTrue(await viewer.receive_nothing(0.05))
+
+            # Zmiana poza widokiem nie trafia do klienta
+            await update({'position_x': 4000})
+            self.assertTrue(await viewer.receive_nothing(0.1))
+
+            # Przesunięcie do widoku i z powrotem - ramka przed i po zmianie
+            await update({'position_x': 10, 'position_y': 10})
+            moved = await receive_action(viewer, 'update_element')
+            self.assertEqual(moved['element']['position_x'], 10)
+            await update({'position_x': 9000})
+            moved = await receive_action(viewer, 'update_element')
+            self.assertEqual(moved['element']['position_x'], 9000)
+            await update({'position_y': 9000})
+            self.assertTrue(await viewer.receive_nothing(0.1))
+
+            # Bez widoku klient znów dostaje zdarzenia z całej tablicy
+            await viewer.send_json_to(
+                {'action': 'subscribe_viewport', 'viewport': None}
+            )
+            self.assertTrue(await viewer.receive_nothing(0.05))
+            await update({'width': 3})
+            resized = await receive_action(viewer, 'update_element')
+            self.assertEqual(resized['element']['width'], 3)
+
+            for communicator in (author, viewer):
+                await communicator.disconnect()
+
+        with override_settings(BOARDS={'WRITE_BEHIND_ENABLED': False}):
+            asyncio.run(run())
+
+
+class SQLiteChannelLayerTests(TestCase):
+    """Warstwa kanałów na SQLite - odbiór z innego procesu"""
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'channels.sqlite3')
+
+    def test_bad_row_is_skipped(self):
+        async def run():
+            sender = SQLiteChannelLayer(path=self.path)
+            receiver = SQLiteChannelLayer(path=self.path)
+            channel = await receiver.new_channel()
+            # Uszkodzony wiersz przed poprawną wiadomością
+            row = (
+                receiver.non_local_name(channel), [channel], time.time() + 60,
+                b'{uszkodzone',
+            )
+            statement = receiver._insert_statement([row])
+            await receiver._db(receiver._write, [statement])
+            await sender.send(channel, {'type': 'ok'})
+            with self.assertLogs('boards.layers', 'ERROR'):
+                message = await asyncio.wait_for(receiver.receive(channel), 2)
+            self.assertEqual(message, {'type': 'ok'})
+            self.assertEqual(receiver.stats['bad_rows'], 1)
+
+        asyncio.run(run())
+
+    def test_idle_polling_backs_off(self):
+        async def run():
+            layer = SQLiteChannelLayer(
+                path=self.path, poll_interval=0.001, max_poll_interval=0.02
+            )
+            channel = await layer.new_channel()
+            receive = asyncio.ensure_future(layer.receive(channel))
+            await asyncio.sleep(0.1)
+            self.assertEqual(layer._idle_interval, 0.02)
+
+            await SQLiteChannelLayer(path=self.path).send(channel, {'type': 'ok'})
+            self.assertEqual(await asyncio.wait_for(receive, 2), {'type': 'ok'})
+            self.assertEqual(layer._idle_interval, 0.001)
+
+        asyncio.run(run())
+
+
+    def test_local_group_send_reads_members_once(self):
+        async def run():
+            layer = SQLiteChannelLayer(path=self.path, group_cache_ttl=60)
+            local = await layer.new_channel()
+            await layer.group_add('board_1', local)
+            with mock.patch.object(
+                layer, '_group_members', wraps=layer._group_members
+            ) as members:
+                for number in range(5):
+                    await layer.group_send(
+                        'board_1', {'type': 'event', 'number': number}
+                    )
+            self.assertEqual(members.call_count, 1)
+            received = [
+                await asyncio.wait_for(layer.receive(local), 2) for _ in range(5)
+            ]
+            self.assertEqual(
+                [message['number'] for message in received], list(range(5))
+            )
+
+            await layer.group_discard('board_1', local)
+            await layer.group_send('board_1', {'type': 'event'})
+            queue = layer._queues.get(local)
+            self.assertTrue(queue is None or queue.empty())
+
+        asyncio.run(run())
+
+    def test_remote_members_refresh_after_ttl(self):
+        async def run():
+            sender = SQLiteChannelLayer(path=self.path, group_cache_ttl=0)
+            receiver = SQLiteChannelLayer(path=self.path)
+            await sender.group_send('board_1', {'type': 'event', 'number': 0})
+            channel = await receiver.new_channel()
+            await receiver.group_add('board_1', channel)
+            await sender.group_send('board_1', {'type': 'event', 'number': 1})
+            message = await asyncio.wait_for(receiver.receive(channel), 2)
+            self.assertEqual(message['number'], 1)
+
+        asyncio.run(run())
+
+
+class ShardingTests(SimpleTestCase):
+    """Przydział tablic do procesów - hasz board_id, middleware i serwer proxy"""
+
+    def test_board_shard(self):
+        counts = collections.Counter(
+            board_shard(board_id, 4) for board_id in range(1, 10001)
+        )
+        self.assertEqual(set(counts), {0, 1, 2, 3})
+        self.assertTrue(all(2200 < count < 2800 for count in counts.values()), counts)
+        self.assertEqual(board_shard('17', 4), board_shard(17, 4))
+        # Po dodaniu procesu tablice przenoszą się tylko do nowego procesu
+        for board_id in range(1, 2001):
+            before, after = board_shard(board_id, 4), board_shard(board_id, 5)
+            self.assertIn(after, (before, 4))
+
+    def test_path_board_id(self):
+        self.assertEqual(path_board_id('/ws/boards/12/'), 12)
+        self.assertEqual(path_board_id('ws/boards/7/extra'), 7)
+        self.assertIsNone(path_board_id('/api/boards/12/'))
+        self.assertIsNone(path_board_id(None))
+
+    def connect(self, path):
+        sent = []
+
+        async def inner(scope, _receive, send):
+            await send({'type': 'accepted', 'shard': scope.get('board_shard')})
+
+        async def receive():
+            return {'type': 'websocket.connect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'websocket', 'path': path}
+        asyncio.run(BoardShardMiddleware(inner)(scope, receive, send))
+        return sent[0]
+
+    def test_strict_middleware_closes_wrong_shard(self):
+        shard = board_shard(7, 2)
+        strict = {'SHARD_COUNT': 2, 'SHARD_STRICT': True}
+        with override_settings(BOARDS={**strict, 'SHARD_INDEX': shard}):
+            self.assertEqual(
+                self.connect('/ws/boards/7/'), {'type': 'accepted', 'shard': shard}
+            )
+        with override_settings(BOARDS={**strict, 'SHARD_INDEX': 1 - shard}):
+            self.assertEqual(self.connect('/ws/boards/7/')['code'], CLOSE_WRONG_SHARD)
+        with override_settings(BOARDS={'SHARD_COUNT': 2, 'SHARD_INDEX': 1 - shard}):
+            self.assertEqual(self.connect('/ws/boards/7/')['type'], 'accepted')
+
+    def test_proxy_routes_by_board(self):
+        async def run():
+            servers = []
+            for index in range(2):
+                async def backend(reader, writer, index=index):
+                    await reader.readuntil(b'\r\n\r\n')
+                    writer.write(
+                        f'HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\n{index}'.encode()
+                    )
+                    await writer.drain()
+                    writer.close()
+                servers.append(await asyncio.start_server(backend, '127.0.0.1', 0))
+            proxy = ShardProxy(
+                [server.sockets[0].getsockname()[:2] for server in servers]
+            )
+            servers.append(await asyncio.start_server(proxy.handle, '127.0.0.1', 0))
+            port = servers[-1].sockets[0].getsockname()[1]
+            try:
+                for board_id in range(1, 6):
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                    writer.write(
+                        f'GET /ws/boards/{board_id}/ HTTP/1.1\r\n'
+                        f'Host: x\r\n\r\n'.encode()
+                    )
+                    response = await reader.read()
+                    writer.close()
+                    self.assertEqual(int(response[-1:]), board_shard(board_id, 2))
+            finally:
+                for server in servers:
+                    server.close()
+
+        asyncio.run(run())
+
+
+class DatabaseTests(SimpleTestCase):
+    """Pula wątków bazy i ustawienia nowych połączeń SQLite"""
+
+    def tearDown(self):
+        # Pula tworzona przez test nie może zostać dla kolejnych testów
+        executor = db.get_executor()
+        if executor is not None:
+            executor.shutdown(wait=False)
+        db._pool = (0, None)
+
+    def test_sqlite_limits_executor_to_one_worker(self):
+        with override_settings(BOARDS={'DB_EXECUTOR_WORKERS': 8}):
+            executor = db.get_executor()
+            self.assertIsNotNone(executor)
+            self.assertEqual(executor._max_workers, 1)
+            self.assertIs(db.get_executor(), executor)
+        with override_settings(BOARDS={'DB_EXECUTOR_WORKERS': 0}):
+            self.assertIsNone(db.get_executor())
+
+    def test_pragmas_applied_to_new_connections(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = {
+                **connection.settings_dict, 'NAME': os.path.join(directory, 'db'),
+            }
+            # Nowe połączenie wysyła connection_created, jak każde połączenie Django
+            backend = type(connections['default'])
+            new_connection = backend(settings_dict, alias='pragmas')
+            try:
+                with new_connection.cursor() as cursor:
+                    pragmas = {}
+                    for name in ('journal_mode', 'synchronous', 'busy_timeout'):
+                        cursor.execute(f'PRAGMA {name}')
+                        pragmas[name] = cursor.fetchone()[0]
+            finally:
+                new_connection.close()
+        # synchronous=NORMAL to 1
+        self.assertEqual(
+            pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000}
+        )
+
+
+class ChangeLogTests(TestCase):
+    """Dziennik zmian tablicy - numery zmian i wznawianie od wersji"""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='test')
+
+    def register(self, count):
+        return Board.register_change(self.board.id, [
+            {'action': 'update_element', 'element': {'id': number}}
+            for number in range(count)
+        ])
+
+    def since(self, seq):
+        self.board.refresh_from_db()
+        return BoardChange.since(self.board, seq)
+
+    def test_seq_numbers_follow_version(self):
+        self.assertEqual(self.register(3), 3)
+        self.assertEqual(self.register(2), 5)
+        seqs = self.board.changes.order_by('seq').values_list('seq', flat=True)
+        self.assertEqual(list(seqs), [1, 2, 3, 4, 5])
+
+        result = self.since(2)
+        self.assertEqual([change['seq'] for change in result['changes']], [3, 4, 5])
+        self.assertEqual(result['changes'][0]['element'], {'id': 2})
+        self.assertEqual(
+            (result['version'], result['resync'], result['has_more']), (5, False, False)
+        )
+        self.assertEqual(self.since(5)['changes'], [])
+
+    @override_settings(BOARDS={'CHANGE_LOG_PAGE_SIZE': 2})
+    def test_pages(self):
+        self.register(5)
+        first = self.since(0)
+        self.assertEqual([change['seq'] for change in first['changes']], [1, 2])
+        self.assertTrue(first['has_more'])
+        last = self.since(4)
+        self.assertEqual([change['seq'] for change in last['changes']], [5])
+        self.assertFalse(last['has_more'])
+
+    def test_resync(self):
+        self.register(3)
+        # Klient zna wersję nowszą niż tablica
+        self.assertTrue(self.since(10)['resync'])
+
+        BoardChange.objects.filter(board=self.board, seq__lte=2).delete()
+        self.assertTrue(self.since(0)['resync'])
+        self.assertFalse(self.since(2)['resync'])
+
+        Board.register_change(self.board.id, [{'action': 'reset'}])
+        self.assertTrue(self.since(3)['resync'])
+
+    def test_changes_endpoint(self):
+        self.register(2)
+        response = self.client.get(f'/api/boards/{self.board.id}/changes/?since=1')
+        self.assertEqual([change['seq'] for change in response.json()['changes']], [2])
+        response = self.client.get(f'/api/boards/{self.board.id}/changes/?since=7')
+        self.assertTrue(response.json()['resync'])
+
+
+@override_settings(BOARDS={'STROKE_MAX_POINTS': 3, 'STROKE_MAX_OPEN': 1})
+class StrokeLimitTests(ConsumerTestCase):
+    """Rysunki ponad limit kończą się ramką stroke_rejected, a nie cichym porzuceniem"""
+
+    def test_begin_over_limit(self):
+        async def scenario(communicator):
+            await communicator.send_json_to(
+                stroke('stroke_begin', 'a', points=[[0, 0]] * 4)
+            )
+            rejected = await receive_action(communicator, 'stroke_rejected')
+            self.assertEqual(
+                (rejected['stroke_id'], rejected['reason']), ('a', 'too_many_points')
+            )
+
+            await communicator.send_json_to(
+                stroke('stroke_begin', 'b', points=[[0, 0]])
+            )
+            await receive_action(communicator, 'stroke_begin')
+            await communicator.send_json_to(stroke('stroke_begin', 'c', points=[]))
+            rejected = await receive_action(communicator, 'stroke_rejected')
+            self.assertEqual(
+                (rejected['stroke_id'], rejected['reason']), ('c', 'too_many_strokes')
+            )
+
+        self.run_client(scenario)
+
+    def test_append_over_limit_cancels_stroke(self):
+        async def scenario(communicator):
+            await communicator.send_json_to(
+                stroke('stroke_begin', 'a', points=[[0, 0]])
+            )
+            await receive_action(communicator, 'stroke_begin')
+            await communicator.send_json_to(
+                stroke('stroke_append', 'a', points=[[1, 1]] * 3)
+            )
+            rejected = await receive_action(communicator, 'stroke_rejected')
+            self.assertEqual(rejected['reason'], 'too_many_points')
+            # Pozostali klienci usuwają podgląd, a stroke_end niczego już nie zapisuje
+            await receive_action(communicator, 'stroke_cancel')
+            await communicator.send_json_to(stroke('stroke_end', 'a', element={}))
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+
+        self.run_client(scenario)
+        self.assertFalse(Element.objects.filter(board=self.board).exists())
+
+    def test_invalid_stroke_id(self):
+        async def scenario(communicator):
+            for action in ('stroke_begin', 'stroke_append', 'stroke_end'):
+                for stroke_id in (['a'], {'id': 'a'}, None):
+                    await communicator.send_json_to(
+                        stroke(action, stroke_id, points=[[0, 0]])
+                    )
+                    error = await receive_action(communicator, 'error')
+                    self.assertEqual(error['reason'], 'invalid_message')
+            # Połączenie działa dalej
+            await communicator.send_json_to(
+                stroke('stroke_begin', 'a', points=[[0, 0]])
+            )
+            await receive_action(communicator, 'stroke_begin')
+
+        self.run_client(scenario)
+
+
+class BatchValidationTests(ConsumerTestCase):
+    """
+    Błędne utworzenia i wiadomości batch ponad limit kończą się ramką z opisem
+    odrzuconych operacji.
+    """
+
+    def test_invalid_creates_are_rejected(self):
+        async def scenario(communicator):
+            await communicator.send_json_to(
+                {'action': 'create_element', 'element': {'position_x': 1}}
+            )
+            error = await receive_action(communicator, 'error')
+            self.assertEqual(error['reason'], 'invalid_element')
+
+            await communicator.send_json_to({'action': 'batch', 'operations': [
+                {'action': 'create_element', 'element': {'element_type': 'shape'}},
+                {'action': 'create_element', 'element': {'position_x': 1}},
+                {
+                    'action': 'create_element',
+                    'element': {'element_type': 'shape', 'width': 'wide'},
+                },
+            ]})
+            errors = [await receive_action(communicator, 'error') for _ in range(2)]
+            self.assertEqual([error['index'] for error in errors], [1, 2])
+            created = await receive_action(communicator, 'create_element')
+            self.assertEqual(created['element']['element_type'], 'shape')
+
+        self.run_client(scenario)
+        self.assertEqual(Element.objects.filter(board=self.board).count(), 1)
+
+    def test_invalid_points_are_rejected(self):
+        async def scenario(communicator):
+            await communicator.send_json_to({
+                'action': 'create_element',
+                'element': {'element_type': 'path', 'points': 'nie base64!'},
+            })
+            error = await receive_action(communicator, 'error')
+            self.assertEqual(error['reason'], 'invalid_element')
+
+            # Rysunek, którego punktów nie da się zapisać, nie staje się pustym
+            # elementem
+            await communicator.send_json_to(
+                stroke('stroke_begin', 'a', points=[[1e20, 0]])
+            )
+            await communicator.send_json_to(stroke('stroke_end', 'a'))
+            error = await receive_action(communicator, 'error')
+            self.assertEqual(
+                (error['reason'], error['stroke_id']), ('invalid_element', 'a')
+            )
+            await receive_action(communicator, 'stroke_cancel')
+
+        self.run_client(scenario)
+        self.assertFalse(Element.objects.filter(board=self.board).exists())
+
+    @override_settings(BOARDS={'INBOUND_MESSAGE_RATE': 1, 'INBOUND_BURST': 1})
+    def test_rate_limited_batch_is_rejected_whole(self):
+        element = Element.objects.create(board=self.board, element_type='shape')
+
+        async def scenario(communicator):
+            await communicator.send_json_to(
+                {'action': 'subscribe_viewport', 'viewport': None}
+            )
+            await communicator.send_json_to({'action': 'batch', 'operations': [
+                {'action': 'create_element', 'element': {'element_type': 'shape'}},
+                {
+                    'action': 'update_element',
+                    'element': {'id': element.id, 'position_x': 5},
+                },
+                {'action': 'delete_element', 'element_id': element.id},
+            ]})
+            rejected = await receive_action(communicator, 'batch_rejected')
+            self.assertEqual(rejected['operations'], [0, 1, 2])
+            self.assertGreater(rejected['retry_after'], 0)
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+
+        self.run_client(scenario)
+        rows = Element.objects.filter(board=self.board).values_list('id', 'position_x')
+        self.assertEqual(list(rows), [(element.id, 0)])
+
+    @override_settings(BOARDS={'WRITE_BEHIND_ENABLED': False})
+    def test_events_keep_operation_order(self):
+        first, second = Element.objects.bulk_create(
+            [Element(board=self.board, element_type='shape') for _ in range(2)]
+        )
+
+        async def scenario(communicator):
+            await communicator.send_json_to({'action': 'batch', 'operations': [
+                {'action': 'delete_element', 'element_id': first.id},
+                {
+                    'action': 'update_element',
+                    'element': {'id': second.id, 'position_x': 4},
+                },
+                {
+                    'action': 'update_element',
+                    'element': {'id': first.id, 'position_x': 4},
+                },
+                {'action': 'create_element', 'element': {'element_type': 'text'}},
+                {
+                    'action': 'update_element',
+                    'element': {'id': second.id, 'position_y': 6},
+                },
+            ]})
+            # Aktualizacja usuniętego wcześniej elementu - jak przy wysłaniu
+            # operacji po kolei
+            error = await receive_action(communicator, 'error')
+            self.assertEqual((error['reason'], error['index']), ('not_found', 2))
+            frame = await communicator.receive_json_from()
+            self.assertEqual(
+                [event['action'] for event in frame],
+                ['delete_element', 'create_element', 'update_element']
+            )
+            self.assertEqual(
+                frame[2]['element'], {'id': second.id, 'position_x': 4, 'position_y': 6}
+            )
+            seqs = [event['seq'] for event in frame]
+            self.assertEqual(seqs, sorted(seqs))
+
+        self.run_client(scenario)
+
+
+class BoardTemplateTests(TestCase):
+    """
+    Wstawianie szablonu - przesunięcie i skala względem rogu oraz pamięć
+    skompilowanych szablonów.
+    """
+
+    def setUp(self):
+        self.template = Board.objects.create(title='Szablon')
+        self.board = Board.objects.create(title='Tablica')
+        Element.objects.create(
+            board=self.template, element_type='shape',
+            position_x=10, position_y=20, width=30, height=40,
+        )
+        Element.objects.create(
+            board=self.template, element_type='path', position_x=20, position_y=30,
+            points=compact_points([(20, 30), (40, 50)]),
+        )
+        self.template.refresh_from_db()
+
+    def apply(self, data):
+        return self.client.post(
+            f'/api/boards/{self.board.id}/apply_template/', data,
+            content_type='application/json',
+        )
+
+    def test_offset_and_scale(self):
+        shape, path = board_templates.template_elements(
+            self.template, self.board.id, (100, 200), 2
+        )
+        self.assertEqual((shape.position_x, shape.position_y), (100, 200))
+        self.assertEqual((shape.width, shape.height), (60, 80))
+        self.assertEqual((path.position_x, path.position_y), (120, 220))
+        points = [(round(x, 3), round(y, 3)) for x, y in decode_points(path.points)]
+        self.assertEqual(points, [(120, 220), (160, 260)])
+
+        # Bez położenia elementy zostają tam, gdzie były w szablonie
+        shape, _ = board_templates.template_elements(self.template, self.board.id)
+        self.assertEqual((shape.position_x, shape.width), (10, 30))
+
+    def test_apply_endpoint(self):
+        response = self.apply(
+            {'template': self.template.id, 'x': 0, 'y': 0, 'scale': 0.5}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 2)
+        shape = Element.objects.get(board=self.board, element_type='shape')
+        self.assertEqual((shape.position_x, shape.position_y, shape.width), (0, 0, 15))
+
+    def test_invalid_input(self):
+        for data in (
+            {'template': 'abc'},
+            {'template': self.template.id, 'x': 'nan'},
+            {'template': self.template.id, 'y': 'inf'},
+            {'template': self.template.id, 'scale': 0},
+            [self.template.id],
+        ):
+            self.assertEqual(self.apply(data).status_code, 400, data)
+        self.assertEqual(self.apply({'template': 999999}).status_code, 404)
+        self.assertFalse(Element.objects.filter(board=self.board).exists())
+
+    def test_cache_follows_template_version(self):
+        _, rows = board_templates.compile_template(self.template)
+        self.assertIs(board_templates.compile_template(self.template)[1], rows)
+
+        Element.objects.create(
+            board=self.template, element_type='text', position_x=0, position_y=0
+        )
+        self.template.version = Board.register_change(
+            self.template.id, [{'action': 'reset'}]
+        )
+        origin, rows = board_templates.compile_template(self.template)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(origin, (0, 0))
+
+
+class SpatialTests(TestCase):
+    """Filtr ?bbox= - ramki obróconych elementów i indeks R*Tree z wyzwalaczami"""
+
+    def setUp(self):
+        if spatial.rtree_supported(connection):
+            # Baza testowa bez migracji nie ma indeksu - tworzymy go jak migracja 0005
+            with connection.cursor() as cursor:
+                for statement in spatial.rtree_create_statements():
+                    cursor.execute(statement)
+        self.board = Board.objects.create(title='test')
+        self.near = Element.objects.create(
+            board=self.board, element_type='shape',
+            position_x=0, position_y=0, width=10, height=10,
+        )
+        self.far = Element.objects.create(
+            board=self.board, element_type='shape', position_x=1000, position_y=1000
+        )
+        # Obrót o 90° wokół lewego górnego rogu - zajmuje x 190..200, y 0..100
+        self.rotated = Element.objects.create(
+            board=self.board, element_type='shape',
+            position_x=200, position_y=0, width=100, height=10, rotation=90,
+        )
+        Element.objects.create(
+            board=Board.objects.create(title='inna'), element_type='shape',
+            position_x=0, position_y=0,
+        )
+
+    def ids(self, bbox):
+        response = self.client.get(
+            f'/api/boards/{self.board.id}/elements/?bbox={bbox}'
+        )
+        self.assertEqual(response.status_code, 200)
+        return sorted(element['id'] for element in response.json())
+
+    def rtree_bounds(self, element_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT min_x, min_y, max_x, max_y FROM {spatial.RTREE_TABLE} '
+                f'WHERE id = %s',
+                [element_id],
+            )
+            row = cursor.fetchone()
+        return row and tuple(round(value) for value in row)
+
+    def test_rotated_bounds(self):
+        bounds = spatial.element_bounds(200, 0, 100, 10, 90)
+        self.assertEqual(tuple(round(value, 6) for value in bounds), (190, 0, 200, 100))
+        bounds = spatial.element_bounds(0, 0, 10, 10, 45)
+        self.assertAlmostEqual(bounds[0], -10 / math.sqrt(2))
+        self.assertAlmostEqual(bounds[3], 20 / math.sqrt(2))
+
+    def test_bbox_filter(self):
+        self.assertEqual(self.ids('-5,-5,50,50'), [self.near.id])
+        self.assertEqual(self.ids('185,50,189,60'), [])
+        self.assertEqual(self.ids('196,60,195,50'), [self.rotated.id])
+        response = self.client.get(
+            f'/api/elements/?board_id={self.board.id}&bbox=-5,-5,50,50'
+        )
+        self.assertEqual(
+            [element['id'] for element in response.json()], [self.near.id]
+        )
+        for bbox in ('1,2', 'a,b,c,d', '0,0,inf,1'):
+            response = self.client.get(
+                f'/api/boards/{self.board.id}/elements/?bbox={bbox}'
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_rtree_follows_writes(self):
+        if not spatial.rtree_available():
+            self.skipTest('SQLite bez modułu rtree')
+        self.assertEqual(self.rtree_bounds(self.rotated.id), (190, 0, 200, 100))
+
+        Element.objects.filter(id=self.far.id).update(position_x=5, position_y=5)
+        self.assertEqual(self.rtree_bounds(self.far.id), (5, 5, 105, 105))
+
+        self.near.position_x = 300
+        Element.objects.bulk_update([self.near], ['position_x'])
+        self.assertEqual(self.rtree_bounds(self.near.id), (300, 0, 310, 10))
+
+        self.rotated.delete()
+        self.assertIsNone(self.rtree_bounds(self.rotated.id))
+        self.assertEqual(self.ids('0,0,50,50'), [self.far.id])
+
+    def test_fallback_without_rtree(self):
+        with mock.patch('boards.spatial.rtree_available', return_value=False):
+            self.assertEqual(self.ids('-5,-5,50,50'), [self.near.id])
+            self.assertEqual(self.ids('195,50,196,60'), [self.rotated.id])
+            queryset = spatial.filter_in_bbox(
+                Element.objects.all(), self.board.id, (0, 0, 1, 1)
+            )
+            self.assertNotIn(spatial.RTREE_TABLE, str(queryset.query))
@@ -0,0 +1,183 @@
+"""
+Strumieniowy eksport i import tablic (NDJSON).
+
+Pierwsza linia to nagłówek {"board": {...}} z danymi tablicy, każda
+kolejna to jeden element w postaci z export_state. Eksport czyta elementy
+kursorem bazy, a import parsuje treść żądania linia po linii i zapisuje
+elementy paczkami po IMPORT_BATCH_SIZE - zużycie pamięci nie zależy od
+rozmiaru tablicy. Pod ASGI paczki eksportu wysyłane są przez
+streaming_response (iterator asynchroniczny), a treść importu Django
+odkłada do pliku tymczasowego, zanim trafi do widoku.
+
+Obie strony obsługują kompresję gzip, a jeśli zainstalowany jest pakiet
+zstandard - także zstd (Accept-Encoding / Content-Encoding).
+"""
+
+import gzip
+import io
+import time
+import zlib
+
+from django.db import transaction
+from django.db.models import Max
+
+from . import codec
+from .conf import board_setting
+from .models import ELEMENT_DATA_FIELDS, Board, Element, elapsed_ms, element_export_data
+from .streaming import ndjson_lines
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard jest opcjonalny
+    zstandard = None
+
+# Obsługiwane kodowania w kolejności preferencji
+ENCODINGS = ('zstd', 'gzip') if zstandard is not None else ('gzip',)
+
+# Poziom kompresji gzip - szybki, bo eksport kompresowany jest w locie
+GZIP_LEVEL = 5
+
+
+def export_rows(board):
+    """Nagłówek tablicy i kolejne elementy (w kolejności z_index, id)"""
+    yield {'board': board.export_header()}
+    elements = (
+        Element.objects.filter(board_id=board.id)
+        .order_by('z_index', 'id')
+        .only('id', *ELEMENT_DATA_FIELDS)
+        .iterator(chunk_size=board_setting('ELEMENT_STREAM_CHUNK'))
+    )
+    for element in elements:
+        yield element_export_data(element)
+
+
+def accepted_encoding(accept_encoding):
+    """Najlepsze obsługiwane kodowanie z nagłówka Accept-Encoding albo None"""
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in ENCODINGS:
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def compress_chunks(chunks, encoding):
+    """Kompresja w locie - każda paczka tekstu trafia do kompresora strumieniowego"""
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(board, encoding=None):
+    """Kolejne paczki eksportu NDJSON (bajty, jeśli podano kodowanie)"""
+    chunks = ndjson_lines(export_rows(board))
+    return compress_chunks(chunks, encoding) if encoding else chunks
+
+
+def decoded_stream(stream, encoding):
+    """Treść żądania po dekompresji (Content-Encoding) - do czytania liniami"""
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return stream
+    if encoding == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if encoding == 'zstd' and zstandard is not None:
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream))
+    raise ValueError(f'Nieobsługiwane kodowanie: {encoding}')
+
+
+def read_ndjson(stream):
+    """Kolejne obiekty z linii NDJSON (puste linie są pomijane)"""
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = codec.loads(line)
+        except ValueError as error:
+            raise ValueError(f'Niepoprawny JSON w linii {number}') from error
+        if not isinstance(row, dict):
+            raise ValueError(f'Linia {number} nie jest obiektem')
+        yield row
+
+
+def import_stream(board, rows, delete_missing=True):
+    """
+    Zsynchronizuj tablicę z kolejnymi wierszami eksportu NDJSON.
+
+    Elementy są zapisywane paczkami po IMPORT_BATCH_SIZE (upsert_element_batch),
+    całość w jednej transakcji. W pamięci zostają tylko identyfikatory
+    zaimportowanych elementów - potrzebne do usunięcia brakujących.
+    """
+    batch_size = board_setting('IMPORT_BATCH_SIZE')
+    timings = {}
+    started = time.perf_counter()
+    report = {'created': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'batches': 0}
+    updated_fields = set()
+    seen_ids = set()
+
+    def apply(batch):
+        result = board.upsert_element_batch(batch, timings=timings)
+        for key in ('created', 'updated', 'unchanged'):
+            report[key] += result[key]
+        updated_fields.update(result['updated_fields'])
+        seen_ids.update(result['seen_ids'])
+        report['batches'] += 1
+
+    with transaction.atomic():
+        # Elementy utworzone przez import dostaną większe id - nie usuwamy ich niżej
+        existing = Element.objects.filter(board_id=board.id)
+        last_existing = existing.aggregate(last=Max('id'))['last'] or 0
+        batch = []
+        for row in rows:
+            header = row.get('board')
+            if isinstance(header, dict):
+                if 'title' in header and header['title'] != board.title:
+                    board.title = header['title']
+                    board.save()
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                apply(batch)
+                batch = []
+        if batch:
+            apply(batch)
+
+        phase = time.perf_counter()
+        if delete_missing:
+            # Istniejące elementy przeglądamy paczkami po id (bez listy wszystkich)
+            last_id = 0
+            while True:
+                ids = list(
+                    existing.filter(id__gt=last_id, id__lte=last_existing)
+                    .order_by('id').values_list('id', flat=True)[:batch_size]
+                )
+                if not ids:
+                    break
+                last_id = ids[-1]
+                to_delete = [
+                    element_id for element_id in ids if element_id not in seen_ids
+                ]
+                if to_delete:
+                    deleted, _ = Element.objects.filter(id__in=to_delete).delete()
+                    report['deleted'] += deleted
+        timings['delete'] = elapsed_ms(phase)
+
+        if report['created'] or report['updated'] or report['deleted']:
+            # Import zmienia zbyt wiele naraz - klienci muszą pobrać całą tablicę
+            Board.register_change(board.id, [{'action': 'reset'}])
+
+    timings['total'] = elapsed_ms(started)
+    report['updated_fields'] = sorted(updated_fields)
+    report['timings_ms'] = {phase: round(ms, 3) for phase, ms in timings.items()}
+    return report
@@ -0,0 +1,145 @@
+import math
+
+from .db import db_sync_to_async
+from .models import Element, coerce_element_id
+from .paths import parse_points, points_bounds
+from .spatial import element_data_bounds, union_bounds
+
+# Pola elementu wyznaczające jego ramkę ograniczającą
+GEOMETRY_FIELDS = ('position_x', 'position_y', 'width', 'height', 'rotation')
+
+# Geometria elementów tablic obsługiwanych w tym procesie (board_id -> BoardGeometry)
+_geometries = {}
+
+
+def _bounds(geometry):
+    try:
+        bounds = element_data_bounds(geometry)
+    except (TypeError, ValueError):
+        return None
+    return bounds if all(math.isfinite(value) for value in bounds) else None
+
+
+def _geometry_changes(element):
+    """Pola geometrii obecne w (częściowych) danych elementu"""
+    return {field: element[field] for field in GEOMETRY_FIELDS if field in element}
+
+
+class BoardGeometry:
+    """
+    Ostatnio znane położenie i rozmiar elementów jednej tablicy.
+
+    Służy do wyznaczania ramki, której dotyczy zdarzenie - aktualizacje
+    z WebSocket niosą zwykle tylko zmienione pola. Geometria jest
+    wczytywana z bazy przy pierwszej aktualizacji nieznanego elementu
+    i dalej śledzona na podstawie rozgłaszanych zdarzeń.
+    """
+
+    def __init__(self, board_id):
+        self.board_id = board_id
+        self.elements = {}
+        self.connections = 0
+        self._loaded = False
+
+    def _read_elements(self):
+        rows = Element.objects.filter(board_id=self.board_id).values_list(
+            'id', *GEOMETRY_FIELDS
+        )
+        return {
+            row[0]: dict(zip(GEOMETRY_FIELDS, row[1:], strict=True)) for row in rows
+        }
+
+    async def load(self):
+        """Wczytaj geometrię wszystkich elementów tablicy jednym zapytaniem"""
+        rows = await db_sync_to_async(self._read_elements)()
+        for element_id, geometry in rows.items():
+            # Stan znany z rozgłoszonych zdarzeń jest nowszy niż ten w bazie
+            self.elements.setdefault(element_id, geometry)
+        self._loaded = True
+
+    async def event_bounds(self, event):
+        """
+        Ramka (min_x, min_y, max_x, max_y) dotknięta zdarzeniem albo None.
+
+        Dla aktualizacji jest to ramka obejmująca położenie sprzed i po
+        zmianie, żeby element opuszczający widok dotarł do jego odbiorców.
+        None oznacza zdarzenie dla całej tablicy.
+        """
+        action = event.get('action')
+        if action == 'stroke_append':
+            # Kolejne punkty rysunku - tylko dla widoków, przez które przechodzi
+            return points_bounds(parse_points(event.get('points')) or [])
+        if action == 'delete_element':
+            self.elements.pop(coerce_element_id(event.get('element_id')), None)
+            return None
+        if action not in ('create_element', 'update_element'):
+            return None
+
+        element = event.get('element') or {}
+        element_id = coerce_element_id(element.get('id'))
+        if element_id is None:
+            return None
+
+        if action == 'create_element':
+            geometry = {field: element.get(field) for field in GEOMETRY_FIELDS}
+            self.elements[element_id] = geometry
+            return _bounds(geometry)
+
+        previous = self.elements.get(element_id)
+        if previous is None and not self._loaded:
+            await self.load()
+            previous = self.elements.get(element_id)
+        if previous is None:
+            # Element nieznany w tym procesie - zdarzenie trafi do wszystkich
+            return None
+
+        current = {**previous, **_geometry_changes(element)}
+        self.elements[element_id] = current
+        before, after = _bounds(previous), _bounds(current)
+        if before is None or after is None:
+            return None
+        return union_bounds(before, after)
+
+
+def track_events(board_id, events):
+    """
+    Uwzględnij w geometrii tablicy zmiany zapisane poza połączeniami WebSocket
+    (np. przez REST API) - tylko jeśli ten proces ją śledzi.
+    """
+    geometry = _geometries.get(board_id)
+    if geometry is None:
+        return
+    for event in events:
+        if event.get('action') == 'delete_element':
+            geometry.elements.pop(coerce_element_id(event.get('element_id')), None)
+            continue
+        element = event.get('element') or {}
+        element_id = coerce_element_id(element.get('id'))
+        if element_id is not None:
+            previous = geometry.elements.get(element_id, {})
+            geometry.elements[element_id] = {**previous, **_geometry_changes(element)}
+
+
+def get_geometry(board_id):
+    """Zwróć (i w razie potrzeby utwórz) geometrię elementów tablicy"""
+    geometry = _geometries.get(board_id)
+    if geometry is None:
+        geometry = _geometries[board_id] = BoardGeometry(board_id)
+    return geometry
+
+
+def attach_geometry(board_id):
+    """Zarejestruj połączenie z tablicą"""
+    geometry = get_geometry(board_id)
+    geometry.connections += 1
+    return geometry
+
+
+def detach_geometry(board_id):
+    """Wyrejestruj połączenie - geometria tablicy bez połączeń jest zwalniana"""
+    geometry = _geometries.get(board_id)
+    if geometry is None:
+        return
+    geometry.connections -= 1
+    if geometry.connections <= 0:
+        del _geometries[board_id]
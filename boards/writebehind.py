@@ -0,0 +1,316 @@
+import asyncio
+import atexit
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .broadcast import send_to_board
+from .conf import board_setting
+from .db import db_sync_to_async
+from .models import PROPERTIES_PATCH, Board, Element, apply_merge_patch
+
+logger = logging.getLogger(__name__)
+
+# Bufory zapisów dla tablic obsługiwanych w tym procesie (board_id -> WriteBehindBuffer)
+_buffers = {}
+
+
+def _written_fields(element, element_changes):
+    """Zapisane wartości pól elementu - łatki zamienione na wynikowe properties"""
+    data = {'id': element.id}
+    for field in element_changes:
+        field = 'properties' if field == PROPERTIES_PATCH else field
+        data[field] = getattr(element, field)
+    return data
+
+
+def merge_changes(entry, fields):
+    """Dołącz zmiany pól do wcześniejszych zmian elementu (nowsze wartości wygrywają)"""
+    fields = dict(fields)
+    patches = fields.pop(PROPERTIES_PATCH, ())
+    if 'properties' in fields:
+        # Pełne właściwości unieważniają wcześniejsze łatki
+        entry.pop(PROPERTIES_PATCH, None)
+    entry.update(fields)
+    if patches:
+        entry.setdefault(PROPERTIES_PATCH, []).extend(patches)
+    return entry
+
+
+def apply_element_changes(board_id, changes):
+    """
+    Zapisz zmiany elementów jednym bulk_update (bez wpisu do dziennika zmian).
+
+    changes to słownik element_id -> {pole: wartość}. Pod kluczem
+    PROPERTIES_PATCH może się znaleźć lista łatek właściwości. Aktualizowane
+    są tylko pola, które pojawiły się w zmianach (plus updated_at). Elementy
+    usunięte w międzyczasie są pomijane. Zwraca listę zdarzeń update_element
+    z zapisanymi wartościami - do dziennika i rozgłoszenia.
+    """
+    fields = set().union(*changes.values()) if changes else set()
+    if PROPERTIES_PATCH in fields:
+        fields.discard(PROPERTIES_PATCH)
+        fields.add('properties')
+    if not fields:
+        return []
+
+    with transaction.atomic():
+        elements = list(
+            Element.objects.filter(board_id=board_id, id__in=changes.keys())
+            .only('id', *fields)
+        )
+        now = timezone.now()
+        for element in elements:
+            element_changes = changes[element.id]
+            for field, value in element_changes.items():
+                if field != PROPERTIES_PATCH:
+                    setattr(element, field, value)
+            # Łatki nakładane są po polach ustawionych wprost, w kolejności nadejścia
+            for patch in element_changes.get(PROPERTIES_PATCH, ()):
+                element.properties = apply_merge_patch(element.properties, patch)
+            element.updated_at = now
+
+        if elements:
+            Element.objects.bulk_update(elements, sorted(fields) + ['updated_at'])
+
+    return [
+        {
+            'action': 'update_element',
+            'element': _written_fields(element, changes[element.id]),
+        }
+        for element in elements
+    ]
+
+
+def write_element_changes(board_id, changes):
+    """
+    Zapisz zmiany elementów (apply_element_changes) i odnotuj je w dzienniku.
+
+    Zwraca liczbę zapisanych wierszy i nową wersję tablicy (None, jeśli
+    nic nie zapisano).
+    """
+    with transaction.atomic():
+        written = apply_element_changes(board_id, changes)
+        version = Board.register_change(board_id, written) if written else None
+    return len(written), version
+
+
+def write_buffered_changes(board_id, batch):
+    """
+    Zapisz paczkę zmian z bufora - zwraca (id zapisanych elementów, wersję,
+    nieudane zmiany).
+
+    Gdy zapis całej paczki się nie uda, elementy zapisywane są pojedynczo -
+    błąd jednego wiersza nie blokuje pozostałych. Zmiany, których nie udało
+    się zapisać, zwracane są do ponownej próby.
+    """
+    try:
+        with transaction.atomic():
+            written = apply_element_changes(board_id, batch)
+            version = Board.register_change(board_id, written) if written else None
+        return {event['element']['id'] for event in written}, version, {}
+    except Exception:
+        logger.exception(
+            'Błąd zapisu paczki zmian tablicy %s - zapis pojedynczo', board_id
+        )
+
+    written_ids, version, failed = set(), None, {}
+    for element_id, changes in batch.items():
+        try:
+            with transaction.atomic():
+                written = apply_element_changes(board_id, {element_id: changes})
+                if written:
+                    version = Board.register_change(board_id, written)
+        except Exception:
+            logger.exception('Błąd zapisu elementu %s tablicy %s', element_id, board_id)
+            failed[element_id] = changes
+            continue
+        if written:
+            written_ids.add(element_id)
+    return written_ids, version, failed
+
+
+def existing_element_ids(board_id, element_ids):
+    """Identyfikatory z element_ids, które należą do tablicy"""
+    return set(
+        Element.objects.filter(board_id=board_id, id__in=element_ids)
+        .values_list('id', flat=True)
+    )
+
+
+class WriteBehindBuffer:
+    """
+    Bufor zapisów jednej tablicy.
+
+    Dla każdego elementu trzymany jest tylko najnowszy stan zmienionych pól.
+    Zapis do bazy następuje po upływie flush_interval od pierwszej zmiany
+    albo natychmiast, gdy liczba brudnych elementów osiągnie max_batch.
+
+    Zmiany, których nie udało się zapisać, wracają do bufora i czekają na
+    kolejny zapis - najwyżej WRITE_BEHIND_MAX_RETRIES razy. Elementy, których
+    nie ma już na tablicy, są pomijane, a klienci dostają delete_element.
+    """
+
+    def __init__(self, board_id, flush_interval=None, max_batch=None):
+        self.board_id = board_id
+        self.flush_interval = (
+            flush_interval if flush_interval is not None
+            else board_setting('WRITE_BEHIND_FLUSH_INTERVAL')
+        )
+        self.max_batch = (
+            max_batch if max_batch is not None
+            else board_setting('WRITE_BEHIND_MAX_BATCH')
+        )
+        self.pending = {}
+        # Elementy, o których wiadomo, że należą do tablicy (sprawdzone w bazie)
+        self.known_ids = set()
+        # Nieudane próby zapisu zmian elementu (element_id -> liczba prób)
+        self.retries = {}
+        self.stats = {'updates': 0, 'flushes': 0, 'rows_written': 0, 'failed': 0}
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+
+    async def add(self, element_id, fields):
+        """Zapamiętaj zmiany pól elementu, nadpisując wcześniejsze wartości"""
+        merge_changes(self.pending.setdefault(element_id, {}), fields)
+        self.stats['updates'] += 1
+
+        if len(self.pending) >= self.max_batch:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def contains(self, element_id):
+        """Czy element należy do tablicy - każdy nowy identyfikator sprawdzany raz"""
+        return element_id in await self.contains_many([element_id])
+
+    async def contains_many(self, element_ids):
+        """Które elementy należą do tablicy - nieznane sprawdzane jednym zapytaniem"""
+        unknown = set(element_ids) - self.pending.keys() - self.known_ids
+        if unknown:
+            existing = db_sync_to_async(existing_element_ids)
+            self.known_ids.update(await existing(self.board_id, unknown))
+        return {
+            element_id for element_id in element_ids
+            if element_id in self.pending or element_id in self.known_ids
+        }
+
+    def discard(self, element_id):
+        """Porzuć niezapisane zmiany elementu (np. po jego usunięciu)"""
+        self.pending.pop(element_id, None)
+        self.known_ids.discard(element_id)
+        self.retries.pop(element_id, None)
+
+    def requeue(self, failed):
+        """Przywróć nieudane zmiany do bufora - nowsze zmiany mają pierwszeństwo"""
+        for element_id, changes in failed.items():
+            attempts = self.retries.get(element_id, 0) + 1
+            if attempts > board_setting('WRITE_BEHIND_MAX_RETRIES'):
+                logger.error(
+                    'Porzucono zmiany elementu %s tablicy %s po %s próbach zapisu',
+                    element_id, self.board_id, attempts - 1
+                )
+                self.retries.pop(element_id, None)
+                self.stats['failed'] += 1
+                continue
+            self.retries[element_id] = attempts
+            newer = self.pending.get(element_id, {})
+            self.pending[element_id] = merge_changes(changes, newer)
+        if self.pending and self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception('Błąd zapisu bufora tablicy %s', self.board_id)
+
+    async def flush(self):
+        """Zapisz wszystkie brudne elementy do bazy"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        if not self.pending:
+            return 0
+
+        batch, self.pending = self.pending, {}
+        # Zapisy tej samej tablicy nie mogą się wyprzedzać
+        async with self._write_lock:
+            try:
+                write = db_sync_to_async(write_buffered_changes)
+                written_ids, version, failed = await write(self.board_id, batch)
+            except Exception:
+                # Zapis w ogóle się nie odbył (np. brak połączenia z bazą) - zmiany
+                # wracają do bufora
+                self.requeue(batch)
+                raise
+
+        self.stats['flushes'] += 1
+        self.stats['rows_written'] += len(written_ids)
+        for element_id in written_ids:
+            self.retries.pop(element_id, None)
+        if failed:
+            self.requeue(failed)
+
+        group = f'board_{self.board_id}'
+        if version is not None:
+            # Aktualizacje zostały rozgłoszone przed zapisem - klienci dostają
+            # tylko znacznik wersji, od której mogą później wznowić połączenie
+            await send_to_board(group, {'action': 'version', 'seq': version})
+        for element_id in batch.keys() - written_ids - failed.keys():
+            # Element zniknął przed zapisem - klienci usuwają go z widoku
+            self.known_ids.discard(element_id)
+            await send_to_board(
+                group, {'action': 'delete_element', 'element_id': element_id}
+            )
+        return len(written_ids)
+
+    def flush_sync(self):
+        """Synchroniczny zapis - używany przy zamykaniu procesu, poza pętlą zdarzeń"""
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, {}
+        written_ids, _, failed = write_buffered_changes(self.board_id, batch)
+        if failed:
+            logger.error(
+                'Nie zapisano zmian %s elementów tablicy %s przy zamykaniu',
+                len(failed), self.board_id,
+            )
+        return len(written_ids)
+
+
+def get_buffer(board_id):
+    """Zwróć (i w razie potrzeby utwórz) bufor zapisów tablicy"""
+    buffer = _buffers.get(board_id)
+    if buffer is None:
+        buffer = _buffers[board_id] = WriteBehindBuffer(board_id)
+    return buffer
+
+
+async def flush_board(board_id):
+    """Zapisz zbuforowane zmiany tablicy i zwolnij pusty bufor"""
+    buffer = _buffers.get(board_id)
+    if buffer is None:
+        return 0
+    written = await buffer.flush()
+    idle = not buffer.pending and not buffer._write_lock.locked()
+    if idle and _buffers.get(board_id) is buffer:
+        del _buffers[board_id]
+    return written
+
+
+def flush_all_sync():
+    """Zapisz bufory wszystkich tablic - wywoływane przy zamykaniu procesu"""
+    for board_id, buffer in list(_buffers.items()):
+        try:
+            buffer.flush_sync()
+        except Exception:
+            logger.exception('Błąd zapisu bufora tablicy %s przy zamykaniu', board_id)
+    _buffers.clear()
+
+
+atexit.register(flush_all_sync)
@@ -53,6 +53,19 @@ const boardService = {
     return response.data;
   },
 
+  /**
+   * Pobierz tylko elementy przecinające widoczny obszar tablicy
+   * @param {number} boardId ID tablicy
+   * @param {Object} viewport Obszar {x0, y0, x1, y1} we współrzędnych tablicy
+   * @returns {Promise} Odpowiedź z danymi elementów
+   */
+  async getBoardElementsInViewport(boardId, { x0, y0, x1, y1 }) {
+    const response = await api.get(`/boards/${boardId}/elements/`, {
+      params: { bbox: [x0, y0, x1, y1].join(',') }
+    });
+    return response.data;
+  },
+
   /**
    * Eksportuj stan tablicy jako JSON
    * @param {number} boardId ID tablicy
@@ -72,6 +85,18 @@ const boardService = {
   async importBoardState(boardId, state) {
     const response = await api.post(`/boards/${boardId}/import_state/`, state);
     return response.data;
+  },
+
+  /**
+   * Wstaw do tablicy elementy innej tablicy (szablonu)
+   * @param {number} boardId ID tablicy docelowej
+   * @param {number} templateId ID tablicy-szablonu
+   * @param {Object} options Opcjonalnie {x, y} - miejsce lewego górnego rogu szablonu, scale - skala
+   * @returns {Promise} Liczba i ID utworzonych elementów
+   */
+  async applyTemplate(boardId, templateId, { x, y, scale } = {}) {
+    const response = await api.post(`/boards/${boardId}/apply_template/`, { template: templateId, x, y, scale });
+    return response.data;
   }
 };
 
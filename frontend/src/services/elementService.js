@@ -43,6 +43,37 @@ const elementService = {
   async deleteElement(boardId, elementId) {
     await api.delete(`/elements/${elementId}/`);
     return true;
+  },
+
+  /**
+   * Utwórz wiele elementów jednym żądaniem
+   * @param {number} boardId ID tablicy
+   * @param {Array} elements Dane elementów
+   * @returns {Promise} Wyniki dla kolejnych elementów ({ status, element })
+   */
+  async createElements(boardId, elements) {
+    const response = await api.post('/elements/bulk/', elements.map(data => ({ ...data, board: boardId })));
+    return response.data;
+  },
+
+  /**
+   * Zaktualizuj wiele elementów jednym żądaniem (tylko przesłane pola)
+   * @param {Array} elements Zmiany elementów - każda z polem id
+   * @returns {Promise} Wyniki dla kolejnych elementów ({ status, element })
+   */
+  async updateElements(elements) {
+    const response = await api.patch('/elements/bulk/', elements);
+    return response.data;
+  },
+
+  /**
+   * Usuń wiele elementów jednym żądaniem
+   * @param {Array} elementIds ID elementów
+   * @returns {Promise} Wyniki dla kolejnych elementów ({ status, id })
+   */
+  async deleteElements(elementIds) {
+    const response = await api.delete('/elements/bulk/', { data: elementIds });
+    return response.data;
   }
 };
 
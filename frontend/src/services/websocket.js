@@ -1,5 +1,153 @@
 // Zastąp zawartość pliku frontend/src/services/websocket.js
 
+// Binarny podprotokół dla zmian elementów (zgodny z boards/codec.py).
+// Wiadomość: u8 kod operacji, u8 flagi, [f64 id], [pola geometrii], [JSON reszty pól].
+// Geometria jako float32 (z_index jako int32), liczby little-endian. Bit OP_POINTS
+// w kodzie operacji oznacza punkty rysunku (u32 długość + bajty) po geometrii.
+export const BINARY_SUBPROTOCOL = 'whiteboard.bin.v1';
+export const JSON_SUBPROTOCOL = 'whiteboard.json';
+
+const OP_BATCH = 0;
+const OP_POINTS = 0x80;
+const BINARY_OPS = { create_element: 1, update_element: 2, delete_element: 3 };
+const BINARY_ACTIONS = { 1: 'create_element', 2: 'update_element', 3: 'delete_element' };
+const FLAG_ID = 1;
+const FLAG_EXTRA = 2;
+const GEOMETRY_FIELDS = [
+  ['position_x', 'float32', 4],
+  ['position_y', 'float32', 8],
+  ['width', 'float32', 16],
+  ['height', 'float32', 32],
+  ['rotation', 'float32', 64],
+  ['z_index', 'int32', 128]
+];
+
+const textEncoder = new TextEncoder();
+const textDecoder = new TextDecoder();
+
+const isEncodable = (value, type) => {
+  if (typeof value !== 'number' || !Number.isFinite(value)) return false;
+  return type === 'int32' ? Number.isInteger(value) && Math.abs(value) < 2 ** 31 : true;
+};
+
+export function encodeBinaryMessage(action, data) {
+  const op = BINARY_OPS[action];
+  if (op === undefined) return null;
+
+  const element = action === 'delete_element' ? { id: data.element_id } : (data.element || {});
+  const extra = { ...element };
+  let flags = 0;
+  let size = 2;
+
+  if (Number.isSafeInteger(element.id)) {
+    flags |= FLAG_ID;
+    size += 8;
+    delete extra.id;
+  }
+
+  GEOMETRY_FIELDS.forEach(([name, type, bit]) => {
+    if (isEncodable(element[name], type)) {
+      flags |= bit;
+      size += 4;
+      delete extra[name];
+    }
+  });
+
+  let extraBytes = null;
+  if (Object.keys(extra).length > 0) {
+    flags |= FLAG_EXTRA;
+    extraBytes = textEncoder.encode(JSON.stringify(extra));
+    size += extraBytes.length;
+  }
+
+  const buffer = new ArrayBuffer(size);
+  const view = new DataView(buffer);
+  view.setUint8(0, op);
+  view.setUint8(1, flags);
+  let offset = 2;
+
+  if (flags & FLAG_ID) {
+    view.setFloat64(offset, element.id, true);
+    offset += 8;
+  }
+
+  GEOMETRY_FIELDS.forEach(([name, type, bit]) => {
+    if (flags & bit) {
+      if (type === 'int32') {
+        view.setInt32(offset, element[name], true);
+      } else {
+        view.setFloat32(offset, element[name], true);
+      }
+      offset += 4;
+    }
+  });
+
+  if (extraBytes) {
+    new Uint8Array(buffer, offset).set(extraBytes);
+  }
+
+  return buffer;
+}
+
+export function decodeBinaryMessage(buffer) {
+  const view = new DataView(buffer);
+  const op = view.getUint8(0);
+
+  // Ramka zbiorcza: u32 liczba wiadomości, każda poprzedzona długością u32
+  if (op === OP_BATCH) {
+    const count = view.getUint32(1, true);
+    const messages = [];
+    let offset = 5;
+    for (let i = 0; i < count; i++) {
+      const length = view.getUint32(offset, true);
+      offset += 4;
+      messages.push(decodeBinaryMessage(buffer.slice(offset, offset + length)));
+      offset += length;
+    }
+    return messages;
+  }
+
+  const action = BINARY_ACTIONS[op & ~OP_POINTS];
+  if (!action) {
+    throw new Error(`Nieznany kod operacji binarnej: ${op}`);
+  }
+
+  const flags = view.getUint8(1);
+  let element = {};
+  let offset = 2;
+
+  if (flags & FLAG_ID) {
+    element.id = view.getFloat64(offset, true);
+    offset += 8;
+  }
+
+  GEOMETRY_FIELDS.forEach(([name, type, bit]) => {
+    if (flags & bit) {
+      element[name] = type === 'int32'
+        ? view.getInt32(offset, true)
+        : parseFloat(view.getFloat32(offset, true).toPrecision(7));
+      offset += 4;
+    }
+  });
+
+  if (op & OP_POINTS) {
+    const length = view.getUint32(offset, true);
+    offset += 4;
+    // Surowe bajty punktów - decodePoints (utils/pathPoints.js) przyjmuje je bez zmian
+    element.points = new Uint8Array(buffer.slice(offset, offset + length));
+    offset += length;
+  }
+
+  if (flags & FLAG_EXTRA) {
+    element = { ...JSON.parse(textDecoder.decode(new Uint8Array(buffer, offset))), ...element };
+  }
+
+  if (action === 'delete_element') {
+    return { action, element_id: element.id };
+  }
+  return { action, element };
+}
+
 class WebSocketService {
   constructor() {
     this.socket = null;
@@ -7,10 +155,23 @@ class WebSocketService {
     this.reconnectAttempts = 0;
     this.maxReconnectAttempts = 5;
     this.reconnectInterval = 3000; // 3 sekundy
+    // Binarny podprotokół dla zmian elementów (serwer może go nie wynegocjować)
+    this.useBinaryProtocol = false;
+    this.binaryNegotiated = false;
+    // Ostatnia znana wersja tablicy - od niej wznawiamy po ponownym połączeniu
+    this.boardId = null;
+    this.lastSeq = null;
+    // Widoczny obszar tablicy - serwer wysyła tylko zdarzenia elementów w jego pobliżu
+    this.viewport = null;
     this.listeners = {
       create_element: [],
       update_element: [],
       delete_element: [],
+      resync: [],
+      stroke_begin: [],
+      stroke_append: [],
+      stroke_cancel: [],
+      stroke_rejected: [],
       message: [],
       connection_status: []
     };
@@ -22,6 +183,13 @@ class WebSocketService {
       return;
     }
 
+    // Wersja znana dla innej tablicy nie ma znaczenia
+    if (String(boardId) !== String(this.boardId)) {
+      this.boardId = boardId;
+      this.lastSeq = null;
+      this.viewport = null;
+    }
+
     // Użyj adresu backendu bezpośrednio
     const backendHost = window.location.hostname;
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
@@ -32,7 +200,12 @@ class WebSocketService {
     console.log(`Łączenie z WebSocket: ${wsUrl}`);
 
     try {
-      this.socket = new WebSocket(wsUrl);
+      if (this.useBinaryProtocol) {
+        this.socket = new WebSocket(wsUrl, [BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL]);
+        this.socket.binaryType = 'arraybuffer';
+      } else {
+        this.socket = new WebSocket(wsUrl);
+      }
 
       this.socket.onopen = this._onOpen.bind(this);
       this.socket.onmessage = this._onMessage.bind(this);
@@ -55,6 +228,12 @@ class WebSocketService {
 
   send(action, data) {
     if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+      const binaryMessage = this.binaryNegotiated ? encodeBinaryMessage(action, data) : null;
+      if (binaryMessage) {
+        this.socket.send(binaryMessage);
+        return true;
+      }
+
       const message = JSON.stringify({
         action,
         ...data
@@ -96,33 +275,154 @@ class WebSocketService {
     return this.send('delete_element', { element_id: elementId });
   }
 
+  // Kilka operacji jedną wiadomością - serwer zapisuje je w jednej transakcji
+  // operations: [{ action: 'update_element', element }, { action: 'delete_element', element_id }, ...]
+  sendBatch(operations) {
+    return this.send('batch', { operations });
+  }
+
+  // Rysunek odręczny przesyłany w trakcie rysowania - tylko nowe punkty [[x, y], ...]
+  sendStrokeBegin(strokeId, points, properties) {
+    return this.send('stroke_begin', { stroke_id: strokeId, points, properties });
+  }
+
+  sendStrokeAppend(strokeId, points) {
+    return this.send('stroke_append', { stroke_id: strokeId, points });
+  }
+
+  sendStrokeEnd(strokeId, element) {
+    return this.send('stroke_end', { stroke_id: strokeId, element });
+  }
+
+  // Ustaw widoczny obszar {x0, y0, x1, y1} we współrzędnych tablicy (null - cała tablica)
+  subscribeViewport(viewport) {
+    this.viewport = viewport;
+    if (this.isConnected) {
+      this.send('subscribe_viewport', { viewport });
+    }
+  }
+
   // Metody prywatne
   _onOpen(event) {
     console.log('WebSocket połączony pomyślnie');
     this.isConnected = true;
     this.reconnectAttempts = 0;
+    this.binaryNegotiated = this.socket.protocol === BINARY_SUBPROTOCOL;
     this._notifyListeners('connection_status', { connected: true });
+
+    // Nowe połączenie po stronie serwera subskrybuje całą tablicę
+    if (this.viewport) {
+      this.send('subscribe_viewport', { viewport: this.viewport });
+    }
+
+    // Pobierz tylko zmiany przegapione od ostatniej znanej wersji
+    this._requestResume();
+  }
+
+  // Ustaw wersję tablicy, którą klient już zna (np. po pobraniu stanu tablicy)
+  setLastSeq(seq) {
+    this.lastSeq = seq;
+    this._requestResume();
+  }
+
+  _requestResume() {
+    if (this.lastSeq !== null && this.isConnected) {
+      this.send('resume', { since: this.lastSeq });
+    }
+  }
+
+  _handleResume(data) {
+    if (data.resync) {
+      // Dziennik zmian nie sięga tak daleko - trzeba pobrać całą tablicę
+      this._notifyListeners('resync', data);
+      return;
+    }
+
+    // Zmiany, które klient już dostał na żywo (seq <= lastSeq), są pomijane
+    data.changes
+      .filter(change => !this._isStale(change))
+      .forEach(change => this._dispatchMessage(change));
+    if (data.has_more && data.changes.length > 0) {
+      this.lastSeq = data.changes[data.changes.length - 1].seq;
+      this._requestResume();
+    } else {
+      this.lastSeq = data.version;
+    }
   }
 
   _onMessage(event) {
     try {
-      const data = JSON.parse(event.data);
+      const data = event.data instanceof ArrayBuffer
+        ? decodeBinaryMessage(event.data)
+        : JSON.parse(event.data);
       console.log('Otrzymano wiadomość WebSocket:', data);
 
-      // Powiadom specyficzne nasłuchiwacze akcji
-      if (data.action && this.listeners[data.action]) {
-        this._notifyListeners(data.action, data);
-      }
-
-      // Powiadom ogólnych nasłuchiwaczy wiadomości
-      this._notifyListeners('message', data);
+      // W trybie wsadowym serwer wysyła tablicę zdarzeń w jednej ramce
+      const messages = Array.isArray(data) ? data : [data];
+      messages.forEach(message => this._dispatchMessage(message));
     } catch (error) {
       console.error('Błąd parsowania wiadomości WebSocket:', error);
     }
   }
 
+  // Zdarzenie z numerem zmiany, którą klient już zna (np. z odpowiedzi na resume)
+  _isStale(data) {
+    return typeof data.seq === 'number' && this.lastSeq !== null && data.seq <= this.lastSeq;
+  }
+
+  _dispatchMessage(data) {
+    if (data.action === 'resume') {
+      this._handleResume(data);
+      return;
+    }
+
+    if (this._isStale(data)) {
+      // Zdarzenie zawarte już w odpowiedzi na resume albo w pobranym stanie tablicy
+      return;
+    }
+
+    if (data.action === 'rate_limited') {
+      // Serwer porzucił lub odłożył część naszych wiadomości
+      console.warn(`Przekroczono limit wiadomości (${data.reason}): porzucone ${data.dropped}, odłożone ${data.deferred}`);
+    }
+
+    if (data.action === 'batch_rejected') {
+      // Wiadomość batch ponad limit - serwer nie wykonał żadnej z jej operacji
+      console.warn(`Serwer odrzucił wiadomość batch (${data.reason}), ponów za ${data.retry_after} s`, data.operations);
+    }
+
+    if (data.action === 'error') {
+      // Serwer odrzucił naszą wiadomość (np. uszkodzoną ramkę) - połączenie zostaje otwarte
+      console.warn(`Serwer odrzucił wiadomość: ${data.reason}`, data);
+    }
+
+    if (data.action === 'resync_required') {
+      // Serwer porzucił zaległe zdarzenia (klient nie nadążał) - nadrób je z dziennika zmian
+      if (this.lastSeq !== null) {
+        this._requestResume();
+      } else {
+        this._notifyListeners('resync', data);
+      }
+      return;
+    }
+
+    // Zapamiętaj numer ostatniej zmiany (także ze znaczników 'version')
+    if (typeof data.seq === 'number' && (this.lastSeq === null || data.seq > this.lastSeq)) {
+      this.lastSeq = data.seq;
+    }
+
+    // Powiadom specyficzne nasłuchiwacze akcji
+    if (data.action && this.listeners[data.action]) {
+      this._notifyListeners(data.action, data);
+    }
+
+    // Powiadom ogólnych nasłuchiwaczy wiadomości
+    this._notifyListeners('message', data);
+  }
+
   _onClose(event) {
     this.isConnected = false;
+    this.binaryNegotiated = false;
     console.log(`WebSocket rozłączony: Kod ${event.code} - ${event.reason}`);
     this._notifyListeners('connection_status', { 
       connected: false,
@@ -1,5 +1,6 @@
 import api from '@/services/api';
 import websocketService from '@/services/websocket';
+import { applyElementDelta, diffElement } from '@/utils/elementDelta';
 
 const state = {
   elements: [],
@@ -77,14 +78,15 @@ const actions = {
   },
 
   // Update an element
-  async updateElement({ commit }, { elementId, elementData }) {
+  async updateElement({ commit, state }, { elementId, elementData }) {
     commit('SET_LOADING', true);
     try {
+      const previous = state.elements.find(el => el.id === elementId);
       const response = await api.put(`/elements/${elementId}/`, elementData);
       commit('UPDATE_ELEMENT', response.data);
 
-      // Send WebSocket notification
-      websocketService.send('update_element', { element: response.data });
+      // Send WebSocket notification - only the changed fields
+      websocketService.send('update_element', { element: diffElement(previous, response.data) });
 
       return response.data;
     } catch (error) {
@@ -141,9 +143,11 @@ const mutations = {
     }
   },
 
-  UPDATE_ELEMENT(state, element) {
-    const index = state.elements.findIndex(el => el.id === element.id);
+  UPDATE_ELEMENT(state, delta) {
+    const index = state.elements.findIndex(el => el.id === delta.id);
     if (index !== -1) {
+      // Aktualizacje mogą zawierać tylko zmienione pola
+      const element = applyElementDelta(state.elements[index], delta);
       state.elements.splice(index, 1, element);
 
       // Update selected element if it's the one being updated
@@ -0,0 +1,72 @@
+// Zmiany elementów przesyłane jako delty - tylko zmienione pola,
+// a właściwości jako łatka JSON Merge Patch (zgodnie z boards/models.py)
+
+const PROPERTIES_PATCH = 'properties_patch';
+
+const isObject = value => value !== null && typeof value === 'object' && !Array.isArray(value);
+
+// Nałóż łatkę na obiekt właściwości (null usuwa klucz)
+export function applyMergePatch(target, patch) {
+  if (!isObject(patch)) return patch;
+
+  const result = isObject(target) ? { ...target } : {};
+  Object.keys(patch).forEach(key => {
+    const value = patch[key];
+    if (value === null) {
+      delete result[key];
+    } else if (isObject(value)) {
+      result[key] = applyMergePatch(result[key], value);
+    } else {
+      result[key] = value;
+    }
+  });
+  return result;
+}
+
+// Łatka zamieniająca obiekt previous w next
+export function createMergePatch(previous, next) {
+  const patch = {};
+  const prev = isObject(previous) ? previous : {};
+
+  Object.keys(prev).forEach(key => {
+    if (!(key in next)) patch[key] = null;
+  });
+  Object.keys(next).forEach(key => {
+    if (isObject(next[key]) && isObject(prev[key])) {
+      const nested = createMergePatch(prev[key], next[key]);
+      if (Object.keys(nested).length > 0) patch[key] = nested;
+    } else if (JSON.stringify(prev[key]) !== JSON.stringify(next[key])) {
+      patch[key] = next[key];
+    }
+  });
+  return patch;
+}
+
+// Delta elementu: id oraz tylko pola, które się zmieniły
+export function diffElement(previous, next) {
+  const delta = { id: next.id };
+  if (!previous) return { ...next };
+
+  Object.keys(next).forEach(key => {
+    if (key === 'properties' && isObject(previous.properties) && isObject(next.properties)) {
+      const patch = createMergePatch(previous.properties, next.properties);
+      if (Object.keys(patch).length > 0) delta[PROPERTIES_PATCH] = patch;
+    } else if (JSON.stringify(previous[key]) !== JSON.stringify(next[key])) {
+      delta[key] = next[key];
+    }
+  });
+  return delta;
+}
+
+// Nałóż deltę otrzymaną przez WebSocket na lokalny element
+export function applyElementDelta(element, delta) {
+  const result = { ...element };
+  Object.keys(delta).forEach(key => {
+    if (key === PROPERTIES_PATCH) {
+      result.properties = applyMergePatch(result.properties, delta[key]);
+    } else {
+      result[key] = delta[key];
+    }
+  });
+  return result;
+}
@@ -0,0 +1,70 @@
+// Zwarty zapis rysunków odręcznych (zgodny z boards/paths.py).
+// Format: u8 wersja, f32 kwant, potem pary liczb varint (zigzag) - różnice
+// kwantowanych współrzędnych względem poprzedniego punktu.
+
+const POINTS_FORMAT = 1;
+const HEADER_SIZE = 5;
+
+// Punkty przychodzą w JSON jako base64, a w binarnym podprotokole jako bajty
+const toBytes = (points) => {
+  if (points instanceof Uint8Array) return points;
+  const binary = atob(points);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return bytes;
+};
+
+export function decodePoints(points) {
+  const bytes = toBytes(points);
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  if (view.getUint8(0) !== POINTS_FORMAT) {
+    throw new Error(`Nieznany format punktów: ${view.getUint8(0)}`);
+  }
+  const quantum = view.getFloat32(1, true);
+
+  const values = [];
+  let value = 0;
+  let scale = 1;
+  for (let i = HEADER_SIZE; i < bytes.length; i++) {
+    const byte = bytes[i];
+    // Mnożenie zamiast przesunięć bitowych - wartości mogą przekraczać 32 bity
+    value += (byte & 0x7f) * scale;
+    if (byte & 0x80) {
+      scale *= 128;
+      continue;
+    }
+    values.push(value % 2 ? -(value + 1) / 2 : value / 2);
+    value = 0;
+    scale = 1;
+  }
+
+  const result = [];
+  let x = 0;
+  let y = 0;
+  for (let i = 0; i + 1 < values.length; i += 2) {
+    x += values[i];
+    y += values[i + 1];
+    result.push([x * quantum, y * quantum]);
+  }
+  return result;
+}
+
+// Ścieżka SVG (łamana) z listy punktów - do utworzenia obiektu fabric.Path
+export function pointsToSvgPath(points) {
+  if (points.length === 0) return '';
+  const commands = points.map(([x, y], i) => `${i === 0 ? 'M' : 'L'} ${+x.toFixed(4)} ${+y.toFixed(4)}`);
+  if (points.length === 1) {
+    commands.push(commands[0].replace('M', 'L'));
+  }
+  return commands.join(' ');
+}
+
+// Ścieżka elementu - z tekstu SVG albo zwartych punktów
+export function elementPath(data) {
+  if (data.points) {
+    return pointsToSvgPath(decodePoints(data.points));
+  }
+  return data.path;
+}
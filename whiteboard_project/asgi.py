@@ -18,13 +18,16 @@ django.setup()
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import boards.routing
+from boards.sharding import BoardShardMiddleware
 
 # Initialize application
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
-        URLRouter(
-            boards.routing.websocket_urlpatterns
+    "websocket": BoardShardMiddleware(
+        AuthMiddlewareStack(
+            URLRouter(
+                boards.routing.websocket_urlpatterns
+            )
         )
     ),
 })
\ No newline at end of file
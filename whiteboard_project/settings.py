@@ -86,6 +86,8 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'if-none-match',
+    'if-modified-since',
 ]
 
 CORS_ALLOW_METHODS = [
@@ -98,7 +100,9 @@ CORS_ALLOW_METHODS = [
 ]
 
 # Pozwól na niestandardowe nagłówki i cookie
-CORS_EXPOSE_HEADERS = ['Content-Type', 'Authorization']
+CORS_EXPOSE_HEADERS = [
+    'Content-Type', 'Authorization', 'ETag', 'Last-Modified', 'X-Board-Version',
+]
 
 # REST Framework
 REST_FRAMEWORK = {
@@ -155,23 +159,142 @@ WSGI_APPLICATION = 'whiteboard_project.wsgi.application'
 ASGI_APPLICATION = 'whiteboard_project.asgi.application'  # ASGI dla Channels
 
 # Konfiguracja kanałów dla WebSockets
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-        # W produkcji lepiej użyć Redis:
-        # 'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        # 'CONFIG': {
-        #     'hosts': [('127.0.0.1', 6379)],
-        # },
+# CHANNEL_LAYER=sqlite włącza warstwę na SQLite (kilka procesów serwera na jednej
+# maszynie bez Redisa), domyślnie kanały działają w pamięci jednego procesu
+CHANNEL_LAYER = os.environ.get('CHANNEL_LAYER', 'memory')
+
+if CHANNEL_LAYER == 'sqlite':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'boards.layers.SQLiteChannelLayer',
+            'CONFIG': {
+                # Plik wspólny dla wszystkich procesów serwera
+                'path': os.environ.get(
+                    'CHANNEL_LAYER_PATH', str(BASE_DIR / 'channels.sqlite3')
+                ),
+                'capacity': 1000,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            # W produkcji na wielu serwerach lepiej użyć Redis:
+            # 'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            # 'CONFIG': {
+            #     'hosts': [('127.0.0.1', 6379)],
+            # },
+        },
+    }
+
+# Ustawienia aplikacji tablic (pełna lista wartości domyślnych w boards/conf.py)
+BOARDS = {
+    # Aktualizacje elementów z WebSocket są rozgłaszane od razu, a do bazy
+    # trafiają zbiorczo co WRITE_BEHIND_FLUSH_INTERVAL sekund; nieudany zapis
+    # jest ponawiany najwyżej WRITE_BEHIND_MAX_RETRIES razy
+    'WRITE_BEHIND_ENABLED': True,
+    'WRITE_BEHIND_FLUSH_INTERVAL': 0.5,
+    'WRITE_BEHIND_MAX_BATCH': 200,
+    'WRITE_BEHIND_MAX_RETRIES': 3,
+    # Tryb wsadowy: zdarzenia zbierane przez BROADCAST_TICK sekund i wysyłane
+    # jako jedna ramka z tablicą zdarzeń (klient musi obsługiwać tablice)
+    'BROADCAST_BATCHING': False,
+    'BROADCAST_TICK': 0.03,
+    'BROADCAST_MAX_QUEUE': 500,
+    # Eksport tablicy serwowany z zapisanego dokumentu JSON odbudowywanego po zmianach
+    'SNAPSHOT_ENABLED': True,
+    # Dziennik zmian dla klientów wznawiających połączenie
+    # (GET /api/boards/<id>/changes/?since=N)
+    'CHANGE_LOG_RETENTION': 1000,
+    'CHANGE_LOG_COMPACT_EVERY': 100,
+    'CHANGE_LOG_PAGE_SIZE': 500,
+    # Klient z ustawionym widokiem (subscribe_viewport) dostaje zdarzenia elementów
+    # przecinających widok powiększony o ten margines
+    'VIEWPORT_MARGIN': 200,
+    # Rysunki odręczne zapisywane jako uproszczone, kwantowane punkty - ścieżka SVG
+    # powstaje dopiero przy eksporcie
+    'PATH_COMPACT_ENABLED': True,
+    'PATH_QUANTUM': 0.1,
+    'PATH_SIMPLIFY_TOLERANCE': 0.5,
+    # Rysunki w trakcie rysowania: punkty trzymane w pamięci połączenia i rozsyłane
+    # na bieżąco, do bazy trafia jeden element przy stroke_end
+    'STROKE_MAX_POINTS': 20000,
+    'STROKE_MAX_OPEN': 8,
+    # Sharding: połączenia tablicy trafiają zawsze do procesu board_shard(board_id),
+    # numer procesu w zmiennej BOARD_SHARD (uruchamianie opisane w boards/sharding.py)
+    'SHARD_COUNT': int(os.environ.get('BOARD_SHARDS', 1)),
+    'SHARD_INDEX': (
+        int(os.environ['BOARD_SHARD']) if 'BOARD_SHARD' in os.environ else None
+    ),
+    'SHARD_STRICT': False,
+    # Wolny klient: powyżej OUTBOUND_HIGH_WATER ramek w kolejce aktualizacje elementu
+    # są scalane, powyżej OUTBOUND_MAX_QUEUE musi nadrobić zmiany z dziennika
+    # (resync_required)
+    'OUTBOUND_HIGH_WATER': 64,
+    'OUTBOUND_MAX_QUEUE': 512,
+    # Limity wiadomości od klientów: ramki większe niż INBOUND_MAX_FRAME są odrzucane,
+    # wiadomości ponad limit na sekundę porzucane (aktualizacje elementów - odkładane
+    # i scalane), a klient dostaje komunikat rate_limited
+    'INBOUND_MAX_FRAME': 1024 * 1024,
+    'INBOUND_MAX_ITEMS': 5000,
+    'INBOUND_MESSAGE_RATE': 60,
+    'INBOUND_BYTE_RATE': 512 * 1024,
+    'BOARD_MESSAGE_RATE': 600,
+    'BOARD_BYTE_RATE': 4 * 1024 * 1024,
+    'INBOUND_BURST': 2.0,
+    # Maksymalna liczba pozycji w żądaniu /api/elements/bulk/ (POST, PATCH, DELETE)
+    'BULK_MAX_ITEMS': 1000,
+    # Listy elementów: ?page_size=N (najwyżej ELEMENT_PAGE_MAX) stronicuje po
+    # (z_index, id), ?stream=1 zwraca NDJSON czytany z bazy paczkami po
+    # ELEMENT_STREAM_CHUNK wierszy
+    'ELEMENT_PAGE_MAX': 1000,
+    'ELEMENT_STREAM_CHUNK': 2000,
+    # Import NDJSON (Content-Type: application/x-ndjson) zapisuje elementy paczkami
+    # tej wielkości
+    'IMPORT_BATCH_SIZE': 500,
+    # Liczba wątków bazy dla operacji z WebSocket (zmienna BOARD_DB_WORKERS) - tylko dla
+    # PostgreSQL, przy SQLite zostaw 0 (opis w boards/db.py)
+    'DB_EXECUTOR_WORKERS': int(os.environ.get('BOARD_DB_WORKERS', 0)),
+    # PRAGMA dla każdego połączenia SQLite - WAL pozwala czytać w trakcie zapisów,
+    # synchronous=NORMAL nie robi fsync przy każdym commicie
+    'SQLITE_PRAGMAS': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
     },
 }
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE=postgres przełącza na PostgreSQL (dane połączenia w zmiennych POSTGRES_*),
+# domyślnie SQLite. Połączenia są utrzymywane przez DB_CONN_MAX_AGE sekund zamiast
+# otwierania nowego przy każdym żądaniu i każdej operacji z WebSocket - przy wielu
+# procesach serwera przed PostgreSQL warto postawić pgbouncer
+DATABASE = os.environ.get('DATABASE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
+if DATABASE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'whiteboard'),
+            'USER': os.environ.get('POSTGRES_USER', 'whiteboard'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            # Ustawienia połączenia (WAL itd.) - BOARDS['SQLITE_PRAGMAS']
+        }
     }
-}
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},